@@ -1 +1,4 @@
-from boxctrl import UniformizeSim, FilterSim, BoxSim
\ No newline at end of file
+from boxctrl import UniformizeSim, FilterSim, BoxSim
+from boxpool import BoxSimPool
+from remote import RemoteBoxSim
+from runner import ResultStore, run_orders
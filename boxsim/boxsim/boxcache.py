@@ -0,0 +1,83 @@
+import collections
+import threading
+import hashlib
+import sqlite3
+import json
+
+
+class ResultCache(object):
+    """Memoize the raw results of the simulation.
+
+    Results are kept in an in-memory LRU of at most `size` entries, and, if
+    `path` is given, in a sqlite database that can be shared between processes
+    and runs. If `precision` is not None, orders are quantized to multiples of
+    `precision` before lookup, so that nearly identical orders share a result.
+    """
+
+    def __init__(self, size = 10000, precision = None, path = None):
+        self.size      = size
+        self.precision = precision
+        self.path      = path
+
+        self.hits   = 0
+        self.misses = 0
+
+        self._lru  = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+        self._db = None
+        if path is not None:
+            self._db = sqlite3.connect(path, timeout = 60.0, check_same_thread = False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, result TEXT)')
+            self._db.commit()
+
+    def _quantize(self, values):
+        if self.precision is None:
+            return tuple(float(v) for v in values)
+        return tuple(int(round(v/self.precision)) for v in values)
+
+    def key(self, conf, nsteps, init_pos, order):
+        """Compute the key of a trial.
+
+        :param conf:  everything sent to the server in MSG_CONF.
+        """
+        desc = (tuple(conf), int(nsteps), self.precision,
+                self._quantize(init_pos), self._quantize(order))
+        return hashlib.sha1(repr(desc).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Return the cached result, or None"""
+        with self._lock:
+            result = self._lru.pop(key, None)
+            if result is None and self._db is not None:
+                row = self._db.execute('SELECT result FROM results WHERE key = ?', (key,)).fetchone()
+                if row is not None:
+                    result = tuple(tuple(r) for r in json.loads(row[0]))
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._store_lru(key, result)
+            return result
+
+    def put(self, key, result):
+        with self._lock:
+            self._store_lru(key, result)
+            if self._db is not None:
+                self._db.execute('INSERT OR REPLACE INTO results VALUES (?, ?)',
+                                 (key, json.dumps([[float(r_i) for r_i in r] for r in result])))
+                self._db.commit()
+
+    def _store_lru(self, key, result):
+        if self.size > 0:
+            self._lru[key] = result
+            while len(self._lru) > self.size:
+                self._lru.popitem(last = False)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._lru)}
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
@@ -1,18 +1,33 @@
-import os
+import os, sys
 import traceback, random, time
 import signal
 import subprocess
-import socket
+import struct
+import threading
+import itertools
+import collections
+import multiprocessing
+import tempfile
+import shutil
+import atexit
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+from concurrent.futures import Future
 
+import numpy as np
 import treedict
 
 from toolbox import gfx
-from sockit.client import Client
 from sockit.outmsg import OutboundMessage
 
+import wire
+
 # Socket adress
 IP = 'localhost'
 PORT = 1989
+UNIX_PREFIX = 'unix:' # addresses of unix domain sockets
 
 # Protocol
 MSG_HELLO     = 0  # Server available.            out   void
@@ -27,27 +42,593 @@ MSG_STEP      = 8  # Run simulation steps         in    int
 MSG_RESULT    = 9  # Simulation results           out   list of floats
 MSG_INVERSE   = 10 # Inverse request              out   list of floats
 MSG_DISPLAY   = 11 # Overlay display request      out   list of floats
+MSG_BATCH     = 12 # Run a batch of trials        in    list of trials
+
+# The high bits of the message types carry the id of the world addressed,
+# when a server hosts several worlds.
+WORLD_SHIFT = 8
+TYPE_MASK   = (1 << WORLD_SHIFT) - 1
+
+MSG_NAMES = {MSG_HELLO: 'HELLO', MSG_BYE: 'BYE', MSG_ERROR: 'ERROR', MSG_EXIT: 'EXIT',
+             MSG_CONF: 'CONF', MSG_RESET: 'RESET', MSG_SENSOR: 'SENSOR', MSG_ORDER: 'ORDER',
+             MSG_STEP: 'STEP', MSG_RESULT: 'RESULT', MSG_INVERSE: 'INVERSE',
+             MSG_DISPLAY: 'DISPLAY', MSG_BATCH: 'BATCH'}
+
+# Solver configurations: STEP_FREQ, STEP_ITER, ITER_VEL, ITER_POS. Each step
+# is STEP_ITER physics steps, with ITER_VEL velocity and ITER_POS position
+# iterations of the constraint solver.
+SOLVER_PRESETS = {'fast'    : [60.0, 1,  8,  3],
+                  'default' : [60.0, 3, 20, 20],
+                  'precise' : [60.0, 6, 40, 40]}
+SOLVER_FIELDS  = ('step_freq', 'step_iter', 'iter_vel', 'iter_pos')
 
 prefixcolor = gfx.purple
 
 defaultcfg = treedict.TreeDict()
-defaultcfg.java_output = False
-defaultcfg.debug       = False
+defaultcfg.java_output    = False
+defaultcfg.debug          = False
+defaultcfg.launch_timeout = 60.0
+defaultcfg.launch_timeout_desc = 'maximum time (in s) to wait for the server to be ready'
+defaultcfg.server         = 'java'
+defaultcfg.transport      = 'tcp'
+defaultcfg.transport_desc = ("'tcp', or 'unix' to connect to the server through a unix domain socket, avoiding "
+                             "the loopback TCP stack (the java server needs java >= 16)")
+defaultcfg.server_desc    = "'java', or 'standin' for the python stand-in server, with fake physics"
+defaultcfg.standin_step_latency = 0.0
+defaultcfg.standin_step_latency_desc = 'duration (in s) of each step of the stand-in server'
+defaultcfg.sensor_dtype   = 'float64'
+defaultcfg.sensor_dtype_desc = 'float64 or float32; precision of the sensor readings sent by the server'
+defaultcfg.pipeline_depth = 2
+defaultcfg.reply_timeout = 1000.0
+defaultcfg.reply_timeout_desc = ('maximum time (in s) to wait for a reply of the server, per trial, before it is '
+                                 'considered stalled')
+defaultcfg.pipeline_depth_desc = 'number of asynchronous orders kept in flight on the connection'
+defaultcfg.settle_threshold = 0.0
+defaultcfg.settle_threshold_desc = ('if > 0, the server stops a trial once the joints had the time to reach their '
+                                    'targets at their maximum velocity, and every sensor reading moved slower than this '
+                                    '(in unit/s) during settle_window steps. A reading that keeps creeping slower than '
+                                    'this, like a lagging joint, is not detected: the final readings may differ from a '
+                                    'full trial by up to settle_threshold times its remaining duration. 0 disables it')
+defaultcfg.settle_window = 30
+defaultcfg.settle_window_desc = 'number of consecutive steps the scene must stay under settle_threshold to be at rest'
+defaultcfg.worlds_per_server = 1
+defaultcfg.worlds_per_server_desc = ('if > 1, servers host up to this many independent worlds, each used by a BoxCom '
+                                     'through its own session on the shared connection; incompatible with visu')
+defaultcfg.world_threads = None
+defaultcfg.world_threads_desc = ('number of threads stepping the worlds of a server; if None, the number of cpus, '
+                                 'up to worlds_per_server')
+defaultcfg.spare_servers = 0
+defaultcfg.spare_servers_desc = ('if > 0, this many servers are kept launched, configured and warmed up in the '
+                                 'background, and new simulations take one instead of launching theirs')
+defaultcfg.spare_warmup_trials = 5
+defaultcfg.spare_warmup_trials_desc = 'number of trials run by spare servers, for the JIT to compile the simulation code'
+defaultcfg.solver = 'default'
+defaultcfg.solver_desc = ("accuracy of the physics: 'fast', 'default' or 'precise' (see SOLVER_PRESETS, and "
+                          "tests/bench/calibrate_solver.py for their speed and error)")
+defaultcfg.step_freq = None
+defaultcfg.step_freq_desc = 'if not None, overrides the steps per simulated second of the solver preset'
+defaultcfg.step_iter = None
+defaultcfg.step_iter_desc = 'if not None, overrides the physics steps per step of the solver preset'
+defaultcfg.iter_vel = None
+defaultcfg.iter_vel_desc = 'if not None, overrides the velocity iterations of the solver preset'
+defaultcfg.iter_pos = None
+defaultcfg.iter_pos_desc = 'if not None, overrides the position iterations of the solver preset'
+defaultcfg.reset_mode = 'rebuild'
+defaultcfg.reset_mode_desc = ("'rebuild' creates a new world on every reset; 'restore' builds it once per configuration and "
+                              "initial pose, and restores a snapshot of its state on later resets")
+defaultcfg.sensor_log = 'auto'
+defaultcfg.sensor_log_desc = ("history of the sensors kept by the server: 'off', 'every' (one step every "
+                              "sensor_log_period steps), 'ring' (the last sensor_log_size steps), or 'auto', "
+                              "that is 'off' until a trajectory is requested, and 'every' afterwards")
+defaultcfg.sensor_log_period = 1
+defaultcfg.sensor_log_period_desc = "with sensor_log = 'every', the server logs one step every sensor_log_period steps"
+defaultcfg.sensor_log_size = 10000
+defaultcfg.sensor_log_size_desc = "with sensor_log = 'ring', number of steps kept by the server"
+
+RESET_MODES = {'rebuild': 0, 'restore': 1}
+LOG_MODES   = {'off': 0, 'every': 1, 'ring': 2}
+
+# Sensor readings are sent as blocks of little-endian floats
+SENSOR_WIDTHS = {'float64': 8, 'float32': 4}
+SENSOR_DTYPES = {8: np.dtype('<f8'), 4: np.dtype('<f4')}
+
+def solver_conf(cfg):
+    """Return the solver configuration of cfg.solver, with the fields of cfg
+    that are not None overriding the preset"""
+    cfg.update(defaultcfg, overwrite = False)
+    conf = list(SOLVER_PRESETS[cfg.solver])
+    for i, field in enumerate(SOLVER_FIELDS):
+        value = getattr(cfg, field)
+        if value is not None:
+            conf[i] = float(value) if i == 0 else int(value)
+    return conf
+
+def read_block(msg, n, width):
+    """Read a block of n little-endian floats of the given width from a message.
+    The messages of the wire clients hand back their raw payload (readBytes()),
+    that is decoded without copy. For sockit messages, the bytes are
+    recovered four at a time, through readInt()."""
+    nbytes = n*width
+    if hasattr(msg, 'readBytes'):
+        raw = msg.readBytes(nbytes)
+    else:
+        raw = b''.join(struct.pack('>i', msg.readInt()) for _ in range(nbytes//4))
+    return np.frombuffer(raw, dtype = SENSOR_DTYPES[width], count = n)
+
+def request(type_msg, content = (), timeout = None, world = 0):
+    """Return a (message, timeout) request for a world of the server, the
+    message being tagged with its type, for the metrics"""
+    msg = OutboundMessage(type_msg | (world << WORLD_SHIFT), list(content))
+    msg.type_name = MSG_NAMES[type_msg]
+    return msg, timeout
+
+# Line printed by the server on stdout once it accepts connections, followed
+# by the address it listens on.
+READY_SIGNAL = 'READY'
+
+_socket_dir   = None
+_socket_lock  = threading.Lock()
+_socket_count = itertools.count()
+
+def socket_path():
+    """Return a fresh path for the unix socket of a server, in a directory
+    private to the process, removed at exit"""
+    global _socket_dir
+    with _socket_lock:
+        if _socket_dir is None:
+            _socket_dir = tempfile.mkdtemp(prefix = 'boxsim-')
+            atexit.register(shutil.rmtree, _socket_dir, True)
+    return os.path.join(_socket_dir, 'server-{}.sock'.format(next(_socket_count)))
+
+
+class LaunchError(Exception):
+    """The simulation server could not be started"""
+    pass
+
+class ServerError(Exception):
+    """The server did not reply in time, or replied out of protocol"""
+    pass
+
+# Errors of a request that mean the server is unusable: no or unexpected
+# reply, connection closed (EOFError) or broken (socket errors).
+SERVER_ERRORS = (ServerError, EOFError, EnvironmentError)
+
+def expect(msg, type_msg):
+    """Check that a reply was received and is of the expected type"""
+    if msg is None:
+        raise ServerError("no reply from the server to the {} request".format(MSG_NAMES[type_msg]))
+    if msg.type & TYPE_MASK == MSG_ERROR and type_msg != MSG_ERROR:
+        raise ServerError("the server replied to the {} request with an error: {}".format(
+                          MSG_NAMES[type_msg], msg.readString()))
+    if msg.type & TYPE_MASK != type_msg:
+        raise ServerError("expected a {} reply from the server, received {}".format(
+                          MSG_NAMES[type_msg], MSG_NAMES.get(msg.type & TYPE_MASK, msg.type)))
+    return msg
+
+
+class Pipeline(object):
+    """Keep several requests in flight on a connection, and match the replies to
+    the requests. The server processes the messages in order, so the replies
+    come back in the order of the requests.
+
+    A request is a list of (message, timeout) pairs, sent without waiting for
+    the replies, and a function that processes the list of replies into the
+    result of the request's future. If the server streams a variable number
+    of replies, `more` is called with the replies received so far, and
+    returns True while more replies are expected.
+    """
+
+    def __init__(self, client, depth, metrics = None):
+        self.client  = client
+        self.depth   = depth
+        self.metrics = metrics
+
+        self._requests = queue.Queue()
+        self._error = None
+        self._thread = threading.Thread(target = self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, requests, process, more = None):
+        future = Future()
+        self._requests.put((requests, process, more, future))
+        return future
+
+    def stop(self, wait = True):
+        """Stop the pipeline once the submitted requests are completed"""
+        self._requests.put(None)
+        if wait:
+            self._thread.join()
+
+    def abort(self, error):
+        """Fail the requests in flight and the queued ones with error, and stop
+        the pipeline, without waiting for the replies. Call it before closing
+        the connection; it can be called from a callback of the pipeline."""
+        self._error = error
+        self._requests.put(None)
+
+    def _fail_all(self, inflight):
+        for item in inflight:
+            item[3].set_exception(self._error)
+        while True:
+            try:
+                item = self._requests.get(block = False)
+            except queue.Empty:
+                return
+            if item is not None and item[3].set_running_or_notify_cancel():
+                item[3].set_exception(self._error)
+
+    def _run(self):
+        inflight = collections.deque()
+        stopping = False
+        while not stopping or len(inflight) > 0:
+            if self._error is not None:
+                self._fail_all(inflight)
+                return
+            while not stopping and len(inflight) < self.depth:
+                try:
+                    item = self._requests.get(block = len(inflight) == 0)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                requests, process, more, future = item
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    for msg, timeout in requests:
+                        self.client.send(msg)
+                    inflight.append(item + (time.time(),))
+                except Exception as e:
+                    future.set_exception(self._error or e)
+
+            if len(inflight) > 0:
+                requests, process, more, future, sent = inflight.popleft()
+                try:
+                    replies = []
+                    for msg, timeout in requests:
+                        if timeout is None:
+                            replies.append(self.client.receive())
+                        else:
+                            replies.append(self.client.receive(timeout = timeout))
+                    while more is not None and more(replies):
+                        replies.append(self.client.receive())
+                    if self.metrics is not None:
+                        self.metrics.record('pipeline.' + requests[0][0].type_name, time.time() - sent)
+                    future.set_result(process(replies))
+                except Exception as e:
+                    # once aborted, errors come from the closed connection
+                    future.set_exception(self._error or e)
+
+
+class Multiplexer(object):
+    """Share the connection to a server between the worlds it hosts. A thread
+    reads the replies, and hands each one to the session of its world, given
+    by the high bits of its type. If the connection fails, the error is
+    raised by every session."""
+
+    def __init__(self, client):
+        self.client = client
+        self.error  = None
+
+        self._inboxes = {}
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._thread = threading.Thread(target = self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def session(self, world):
+        with self._lock:
+            self._inboxes[world] = queue.Queue()
+            if self.error is not None:
+                self._inboxes[world].put(self.error)
+        return Session(self, world)
+
+    def close_session(self, world):
+        with self._lock:
+            self._inboxes.pop(world, None)
+
+    def send(self, msg):
+        with self._send_lock:
+            self.client.send(msg)
+
+    def _run(self):
+        try:
+            while True:
+                msg = self.client.receive()
+                if msg is None:
+                    raise EOFError("the connection to the server was closed")
+                with self._lock:
+                    inbox = self._inboxes.get(msg.type >> WORLD_SHIFT)
+                if inbox is not None: # else, the world was closed
+                    inbox.put(msg)
+        except Exception as e:
+            with self._lock:
+                self.error = e
+                for inbox in self._inboxes.values():
+                    inbox.put(e)
+
+
+class Session(object):
+    """The connection of a world to a shared server, with the interface of a
+    sockit Client"""
+
+    def __init__(self, mux, world):
+        self.mux   = mux
+        self.world = world
+        self.port  = mux.client.port
+        self._inbox = mux._inboxes[world]
+
+    def send(self, msg):
+        self.mux.send(msg)
+
+    def receive(self, timeout = None):
+        """Return the next reply of the world, or None after timeout seconds"""
+        try:
+            item = self._inbox.get(timeout = timeout)
+        except queue.Empty:
+            return None
+        if isinstance(item, Exception):
+            self._inbox.put(item)
+            raise item
+        return item
+
+    def sendAndReceive(self, msg, timeout = None):
+        self.send(msg)
+        return self.receive(timeout = timeout)
+
+    def disconnect(self):
+        self.mux.close_session(self.world)
+
+
+    ## Registry of idle servers ##
+
+_idle_servers  = []
+_registry_lock = threading.Lock()
+
+def server_key(cfg):
+    """Return the options a server is launched with; a server can only serve
+    simulations with the same ones"""
+    return (cfg.server, cfg.transport, cfg.worlds_per_server, cfg.debug, cfg.standin_step_latency, cfg.visu)
+
+def acquire(sim):
+    """Return an idle server compatible with the simulation if
+    cfg.reuse_server is set, or else take or launch a new one"""
+    sim.cfg.update(defaultcfg, overwrite = False)
+    if sim.cfg.reuse_server:
+        with _registry_lock:
+            for i, com in enumerate(_idle_servers):
+                if server_key(com.cfg) == server_key(sim.cfg) and com.simproc.poll() is None:
+                    del _idle_servers[i]
+                    com.bind(sim)
+                    com.print_status("reusing server on port {}".format(com.client.port))
+                    return com
+    return launch(sim)
+
+def launch(sim):
+    """Return a new server for the simulation: a spare one if cfg.spare_servers
+    is set, or else one launched now"""
+    sim.cfg.update(defaultcfg, overwrite = False)
+    if sim.cfg.spare_servers > 0 and not sim.cfg.visu:
+        return spare_pool(sim).take(sim)
+    return BoxCom(sim, sim.cfg)
+
+def release(com):
+    """Keep a server alive, for future simulations to reuse"""
+    with _registry_lock:
+        _idle_servers.append(com)
+
+@atexit.register
+def close_idle_servers():
+    with _registry_lock:
+        while len(_idle_servers) > 0:
+            _idle_servers.pop().close()
+
+
+    ## Spare servers ##
+
+class _Untaken(object):
+    """Stands for the simulation of a spare server, until one takes it"""
+    metrics = None
+
+    def __init__(self, cfg):
+        self.cfg = cfg
+
+class SparePool(object):
+    """Servers launched, configured and warmed up in the background, ready to
+    be taken by new simulations. The pool launches new servers as soon as
+    some are taken, to hold cfg.spare_servers of them. A simulation that
+    finds the pool empty waits for the first server to be ready."""
+
+    def __init__(self, sim):
+        self.cfg = sim.cfg.copy(deep = True)
+        self.cfg.verbose = False
+        self.conf = list(sim.conf)
+
+        self._ready   = queue.Queue() # servers, or the errors of failed launches
+        self._pending = 0
+        self._threads = []
+        self._closed  = False
+        self._lock = threading.Lock()
+
+    def fill(self):
+        """Launch servers in the background, until the pool holds cfg.spare_servers"""
+        with self._lock:
+            if self._closed:
+                return
+            self._threads = [t for t in self._threads if t.is_alive()]
+            missing = self.cfg.spare_servers - self._ready.qsize() - self._pending
+            for _ in range(missing):
+                self._pending += 1
+                thread = threading.Thread(target = self._launch)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def _launch(self):
+        try:
+            com = BoxCom(_Untaken(self.cfg), self.cfg)
+            try:
+                com.warm_up(self.conf, self.cfg.spare_warmup_trials)
+            except Exception:
+                com.close()
+                raise
+        except Exception as e:
+            com = e
+        with self._lock:
+            self._pending -= 1
+            if not self._closed:
+                self._ready.put(com)
+                return
+        if isinstance(com, BoxCom):
+            com.close()
+
+    def take(self, sim):
+        """Return a ready server, bound to the simulation"""
+        start = time.time()
+        while True:
+            self.fill()
+            try:
+                com = self._ready.get(timeout = sim.cfg.launch_timeout)
+            except queue.Empty:
+                raise LaunchError("no spare server was ready after {:.1f}s".format(sim.cfg.launch_timeout))
+            if isinstance(com, Exception):
+                self.fill()
+                raise com
+            if com.simproc.poll() is None:
+                break
+            com.close() # it exited while waiting
+        self.fill()
+
+        com.bind(sim)
+        com.launch_time = time.time() - start
+        if com.metrics is not None:
+            com.metrics.record('server.launch', com.launch_time)
+        com.print_status("took a spare server in {:.2f}s".format(com.launch_time))
+        return com
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            threads = list(self._threads)
+        for thread in threads: # so that no launch outlives the process
+            thread.join()
+        while not self._ready.empty():
+            com = self._ready.get()
+            if isinstance(com, BoxCom):
+                com.close()
+
+_spare_pools = {}
+
+def spare_pool(sim):
+    """Return the pool of spare servers launched with the options of the simulation"""
+    key = server_key(sim.cfg)
+    with _registry_lock:
+        if key not in _spare_pools:
+            _spare_pools[key] = SparePool(sim)
+        return _spare_pools[key]
+
+@atexit.register
+def close_spare_servers():
+    with _registry_lock:
+        pools = list(_spare_pools.values())
+        _spare_pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+    ## Registry of shared servers ##
+
+class SharedServer(object):
+    """A server hosting several worlds, and the ids of its open worlds.
+
+    It is registered as soon as its launch starts, so that worlds can be
+    reserved on it while it launches; they wait for `ready`. World ids only
+    increase, so that a new world never gets the replies of a closed one."""
+
+    def __init__(self, cfg):
+        self.cfg     = cfg
+        self.simproc = None
+        self.address = None
+        self.mux     = None
+        self.error   = None
+        self.ready   = threading.Event()
+        self.worlds  = set()
+        self.next_world = 0
+
+    def reserve(self):
+        """Return a new world id; call with _registry_lock held"""
+        world = self.next_world
+        self.next_world += 1
+        self.worlds.add(world)
+        return world
+
+    def started(self, simproc, address, mux):
+        self.simproc = simproc
+        self.address = address
+        self.mux     = mux
+        self.ready.set()
+
+    def failed(self, error):
+        with _registry_lock:
+            self.error = error
+            if self in _shared_servers:
+                _shared_servers.remove(self)
+        self.ready.set()
+
+    def usable(self, cfg):
+        return (self.error is None and (self.simproc is None or self.simproc.poll() is None)
+                and (self.mux is None or self.mux.error is None) and self.cfg.server == cfg.server
+                and self.cfg.transport == cfg.transport and len(self.worlds) < cfg.worlds_per_server)
+
+_shared_servers = []
+
 
 class BoxCom(object):
     """Handle all technical aspects of simulation instanciation and communication"""
 
     def __init__(self, sim, cfg, debug = False, java_output = False):
-        self.sim = sim
-        self.cfg = sim.cfg
-        self.cfg.update(defaultcfg, overwrite = False)
+        self.bind(sim)
+
+        self.client = wire.UnixClient() if self.cfg.transport == 'unix' else wire.TCPClient()
+        self.address = None
+        self.conf = None
+        self.conf_msg = None
+        self.history_needed = False # for cfg.sensor_log == 'auto'
+        self.pipeline = None
+        self.world  = 0
+        self.shared = None
 
-        self.client = Client()
+        # steps requested and actually run, that differ when trials end early
+        self.trials_run      = 0
+        self.steps_requested = 0
+        self.steps_run       = 0
 
-        port = self.find_port()
-        self.simproc = self.launch_sim(port)
+        start = time.time()
+        deadline = start + self.cfg.launch_timeout
 
-        self.connect(port)
+        if self.cfg.worlds_per_server > 1:
+            self.open_world(deadline)
+        else:
+            self.simproc = self.launch_sim(self.listen_address())
+            self.wait_ready(deadline)
+            self.connect(deadline)
+
+        self.launch_time = time.time() - start
+        if self.metrics is not None:
+            self.metrics.record('server.launch', self.launch_time)
+        self.print_status("server ready in {:.2f}s".format(self.launch_time))
+
+    def bind(self, sim):
+        """Attach the server to a simulation"""
+        self.sim = sim
+        self.cfg = sim.cfg
+        self.cfg.update(defaultcfg, overwrite = False)
+        self.metrics = getattr(sim, 'metrics', None)
+        if getattr(self, 'pipeline', None) is not None:
+            self.pipeline.metrics = self.metrics
 
     def print_debug(self, s):
         if self.cfg.debug:
@@ -57,99 +638,432 @@ class BoxCom(object):
         if self.cfg.verbose:
             print("{}sim{}: {}{}".format(prefixcolor, gfx.end, s, '\033[K'))
 
-    def find_port(self):
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM, 0)
-        sock.bind(('', 0))
-        sock.listen(socket.SOMAXCONN)
-        ipaddr, port = sock.getsockname()
-        sock.close()
-        return port
+    def listen_address(self):
+        """Return the address for the server to listen on: a fresh unix socket
+        path, or port 0, for the server to pick a free port itself and report
+        it on its ready line; a port picked here could be taken in between."""
+        if self.cfg.transport == 'unix':
+            return UNIX_PREFIX + socket_path()
+        return '0'
 
-    def launch_sim(self, port):
+    def launch_sim(self, address):
 
         interact_file = os.path.dirname(__file__) + '/' + 'interact.jar'
-        assert os.path.exists(interact_file), "The file {} does not exist. Did you build the java code ?".format(interact_file)
+        standin_file  = os.path.dirname(__file__) + '/' + 'standin.py'
 
-        if self.cfg.visu:
-            cmd = "java -cp {} experiments.interact.ProcSketch {}".format(interact_file, port)
-        else:
-            cmd = "java -cp {} experiments.interact.StandAlone {}".format(interact_file, port)
+        args = address
+        if self.cfg.worlds_per_server > 1:
+            threads = self.cfg.world_threads
+            if threads is None:
+                threads = min(multiprocessing.cpu_count(), self.cfg.worlds_per_server)
+            args += " {}".format(threads)
 
-        if self.cfg.java_output:
-            DEVNULL = None
+        # the server prints a status line per message only when debugging
+        log_flag = " -Dinteract.log_messages=true" if self.cfg.debug else ""
+
+        if self.cfg.server == 'standin':
+            cmd = "{} {} {} --step-latency {}".format(sys.executable, standin_file, args, self.cfg.standin_step_latency)
+        elif self.cfg.visu:
+            cmd = "java{} -cp {} experiments.interact.ProcSketch {}".format(log_flag, interact_file, args)
         else:
-            DEVNULL = open(os.devnull, 'wb')
-        proc = subprocess.Popen(cmd, stdout=DEVNULL,
+            cmd = "java{} -cp {} experiments.interact.StandAlone {}".format(log_flag, interact_file, args)
+
+        if self.cfg.server == 'java':
+            assert os.path.exists(interact_file), "The file {} does not exist. Did you build the java code ?".format(interact_file)
+
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
                                 shell=True, preexec_fn=os.setsid)
 
-        time.sleep(5)
+        self._ready = threading.Event()
+        self._output_tail = collections.deque(maxlen = 20)
+        reader = threading.Thread(target = self._read_output, args = (proc.stdout,))
+        reader.daemon = True
+        reader.start()
+
         return proc
 
+    def open_world(self, deadline):
+        """Open a world on a shared server that has room for it, launching a
+        new server if none has"""
+        assert not self.cfg.visu, "the worlds of a server can't be displayed"
+        # the launch happens outside of the lock, that other launches need
+        with _registry_lock:
+            for shared in _shared_servers:
+                if shared.usable(self.cfg):
+                    launch = False
+                    break
+            else:
+                shared = SharedServer(self.cfg)
+                _shared_servers.append(shared)
+                launch = True
+            self.world = shared.reserve()
+
+        if launch:
+            try:
+                self.simproc = self.launch_sim(self.listen_address())
+                self.wait_ready(deadline)
+                self.connect(deadline) # opens the world 0
+            except Exception as e:
+                shared.failed(e)
+                raise
+            shared.started(self.simproc, self.address, Multiplexer(self.client))
+        elif not shared.ready.wait(max(0.0, deadline - time.time())) or shared.error is not None:
+            with _registry_lock:
+                shared.worlds.discard(self.world)
+            raise LaunchError("the shared server did not start: {}".format(shared.error or 'timeout'))
+
+        self.shared  = shared
+        self.simproc = shared.simproc
+        self.address = shared.address
+        self.client  = shared.mux.session(self.world)
+        msg, timeout = self._request(MSG_HELLO)
+        expect(self.client.sendAndReceive(msg, timeout = self.cfg.launch_timeout), MSG_HELLO)
+        self.print_status("opened world {} of the server on port {}".format(self.world, self.client.port))
+
+    def close_world(self, sig):
+        """Drop the world of the server, and stop the server with sig if it was its last one"""
+        with _registry_lock:
+            self.shared.worlds.discard(self.world)
+            last = len(self.shared.worlds) == 0 or sig == signal.SIGKILL
+            if last and self.shared in _shared_servers:
+                _shared_servers.remove(self.shared)
+        if last:
+            try:
+                os.killpg(self.simproc.pid, sig)
+            except OSError:
+                pass
+            self.remove_socket()
+        else:
+            try: # the reply is not waited for; the world id is not reused
+                self.client.send(self._request(MSG_BYE)[0])
+            except SERVER_ERRORS:
+                pass
+        self.client.disconnect()
+
+    def warm_up(self, conf, n_trials):
+        """Configure the server, and run a few trials, for the JIT to compile
+        the simulation code; the trials are not counted"""
+        self.send_conf(conf)
+        armsize = int(conf[0])
+        self.send_orders([([0.0]*armsize, [0.5, 1.0]*armsize, self.cfg.steps)]*n_trials)
+        self.trials_run = self.steps_requested = self.steps_run = 0
+
+    def _read_output(self, stdout):
+        """Drain the server output, watching for the ready signal"""
+        for line in iter(stdout.readline, b''):
+            line = line.decode('utf-8', 'replace')
+            if line.startswith(READY_SIGNAL) and not self._ready.is_set():
+                self.address = line.split()[1]
+                self._ready.set()
+            self._output_tail.append(line)
+            if self.cfg.java_output:
+                sys.stdout.write(line)
+                sys.stdout.flush()
+
+    def _launch_error(self, reason):
+        self.close()
+        return LaunchError("{}\nlast server output:\n{}".format(reason, ''.join(self._output_tail)))
+
+    def wait_ready(self, deadline):
+        """Wait for the server to signal it accepts connections"""
+        while not self._ready.wait(0.05):
+            if self.simproc.poll() is not None:
+                raise self._launch_error("the server exited during launch (return code {})".format(self.simproc.returncode))
+            if time.time() > deadline:
+                raise self._launch_error("the server was not ready after {:.1f}s".format(self.cfg.launch_timeout))
+
+    def _exchange(self, requests, process, more = None):
+        """Send messages and process their replies, through the pipeline if it is active"""
+        if self.pipeline is not None:
+            return self.pipeline.submit(requests, process, more).result()
+        replies = []
+        for msg, timeout in requests:
+            start = time.time() if self.metrics is not None else None
+            if timeout is None:
+                replies.append(self.client.sendAndReceive(msg))
+            else:
+                replies.append(self.client.sendAndReceive(msg, timeout = timeout))
+            if start is not None:
+                self.metrics.record('msg.' + msg.type_name, time.time() - start)
+        while more is not None and more(replies):
+            replies.append(self.client.receive())
+        if self.metrics is None:
+            return process(replies)
+
+        start = time.time()
+        result = process(replies)
+        self.metrics.record('client.decode', time.time() - start)
+        return result
+
+    def start_pipeline(self):
+        if self.pipeline is None:
+            self.pipeline = Pipeline(self.client, self.cfg.pipeline_depth, self.metrics)
+
     def receive_sensors(self):
         """Interprets and return results"""
-        resmsg = self.client.sendAndReceive(OutboundMessage(MSG_SENSOR, []))
-        assert resmsg.type == MSG_SENSOR
+        return self._exchange([self._request(MSG_SENSOR)], self._process_sensor_reply)
+
+    def _process_sensor_reply(self, replies):
+        resmsg, = replies
+        expect(resmsg, MSG_SENSOR)
 
         results =  self.process_sensors(resmsg)
-        self.print_debug("Received results: {}".format(", ".join(["%+2.1f" % e for e in results]),))
+        if self.cfg.debug:
+            self.print_debug("Received results: {}".format(", ".join(["%+2.1f" % e for e in results]),))
 
         return results
 
     def process_sensors(self, resmsg):
         n_size = resmsg.readInt()
-        return tuple(resmsg.readDouble() for _ in range(n_size))
+        width  = resmsg.readInt()
+        return read_block(resmsg, n_size, width)
+
+    def _order_requests(self, init_pos, order, nsteps, conf):
+        if self.cfg.debug:
+            self.print_debug("Reseting the simulation")
+            self.print_debug("Sending order({})".format(", ".join(["%+2.1f" % o for o in order]), prefixcolor, gfx.end))
+            self.print_debug("Requesting {} steps run".format(nsteps))
+        self.steps_requested += nsteps
+        timeout = self.cfg.reply_timeout
+        return [self._request(MSG_RESET, [len(init_pos)] + init_pos + conf, timeout = timeout),
+                self._request(MSG_ORDER, [len(order)] + order, timeout = timeout),
+                self._request(MSG_STEP, [nsteps], timeout = timeout),
+                self._request(MSG_SENSOR, timeout = timeout)]
+
+    def _process_order_replies(self, replies):
+        resetMsg, orderConfirm, stepConfirm, sensorMsg = replies
+        expect(resetMsg, MSG_SENSOR)
+        expect(orderConfirm, MSG_ORDER)
+        expect(stepConfirm, MSG_STEP)
+        self._count_steps(stepConfirm.readInt(), stepConfirm.readDouble())
+
+        return self.process_sensors(resetMsg), self._process_sensor_reply([sensorMsg])
+
+    def _count_steps(self, steps_run, step_time):
+        """Account for a trial, given the number of steps run by the server and their duration"""
+        self.trials_run += 1
+        self.steps_run  += steps_run
+        if self.metrics is not None:
+            self.metrics.record('server.step', step_time)
 
     def send_order(self, init_pos, order, nsteps, conf):
         """Send an order, run nsteps, and return result"""
+        return self._exchange(self._order_requests(init_pos, order, nsteps, conf),
+                              self._process_order_replies)
 
+    def _trajectory_request(self, every, chunk_rows):
+        if self.cfg.debug:
+            self.print_debug("Requesting sensor history, every {} steps".format(every))
+        return self._request(MSG_RESULT, [every, chunk_rows], timeout = self.cfg.reply_timeout)
 
-        self.print_debug("Reseting the simulation")
-        resetMsg = self.client.sendAndReceive(OutboundMessage(MSG_RESET, [len(init_pos)] + init_pos + conf))
-        assert resetMsg.type == MSG_SENSOR
+    def _request(self, type_msg, content = (), timeout = None):
+        return request(type_msg, content, timeout, self.world)
 
-        self.print_debug("Sending order({})".format(", ".join(["%+2.1f" % o for o in order]), prefixcolor, gfx.end))
-        orderConfirm = self.client.sendAndReceive(OutboundMessage(MSG_ORDER, [len(order)]+order ))
-        assert orderConfirm.type == MSG_ORDER
+    @staticmethod
+    def _more_chunks(replies):
+        """Return True while chunks of the sensor history are missing"""
+        last = replies[-1]
+        if last is None or last.type & TYPE_MASK != MSG_RESULT:
+            return False
+        last.chunk_header = rows, start, n = last.readInt(), last.readInt(), last.readInt()
+        return start + n < rows
 
-        self.print_debug("Requesting {} steps run".format(nsteps))
-        stepConfirm = self.client.sendAndReceive(OutboundMessage(MSG_STEP, [nsteps]), timeout = 1000)
-        assert stepConfirm.type == MSG_STEP
+    def process_trajectory(self, chunks):
+        """Assemble the chunks of the sensor history into an array of shape (rows, features)"""
+        trajectory = None
+        for chunk in chunks:
+            expect(chunk, MSG_RESULT)
+            rows, start, n = chunk.chunk_header # read by _more_chunks()
+            n_feats, width = chunk.readInt(), chunk.readInt()
+            if trajectory is None:
+                trajectory = np.empty((rows, n_feats))
+            trajectory[start:start + n] = read_block(chunk, n*n_feats, width).reshape(n, n_feats)
+        return trajectory
 
-        return self.process_sensors(resetMsg), self.receive_sensors()
+    def _process_trajectory_replies(self, replies):
+        before, after = self._process_order_replies(replies[:4])
+        return before, after, self.process_trajectory(replies[4:])
 
-    def close(self):
-        os.killpg(self.simproc.pid, signal.SIGTERM)
+    def _log_history(self):
+        """With cfg.sensor_log == 'auto', switch the server logging on before
+        the first trajectory"""
+        if not self.history_needed:
+            self.history_needed = True
+            if self.cfg.sensor_log == 'auto' and self.conf is not None:
+                self.send_conf(self.conf)
+
+    def send_order_trajectory(self, init_pos, order, nsteps, conf, every = 1, chunk_rows = 1000):
+        """Send an order, run nsteps, and return the sensor readings before and
+        after, and the history of the sensors, keeping one step every `every`.
+        The history is streamed by the server in chunks of at most chunk_rows rows."""
+        self._log_history()
+        return self._exchange(self._order_requests(init_pos, order, nsteps, conf) + [self._trajectory_request(every, chunk_rows)],
+                              self._process_trajectory_replies, self._more_chunks)
+
+    def send_order_trajectory_async(self, init_pos, order, nsteps, conf, every = 1, chunk_rows = 1000):
+        self._log_history()
+        self.start_pipeline()
+        return self.pipeline.submit(self._order_requests(init_pos, order, nsteps, conf) + [self._trajectory_request(every, chunk_rows)],
+                                    self._process_trajectory_replies, self._more_chunks)
+
+    def send_order_async(self, init_pos, order, nsteps, conf):
+        """Send an order without waiting for the result, and return a future.
+        The replies are processed by the pipeline, that keeps up to
+        cfg.pipeline_depth orders queued on the server, so that the next
+        order starts as soon as the previous one ends."""
+        self.start_pipeline()
+        return self.pipeline.submit(self._order_requests(init_pos, order, nsteps, conf),
+                                    self._process_order_replies)
+
+    def send_orders(self, trials):
+        """Run a batch of (init_pos, order, nsteps) trials in a single round trip,
+        and return the list of (before, after) sensor readings"""
+        content = [len(trials)]
+        for init_pos, order, nsteps in trials:
+            content += [len(init_pos)] + list(init_pos) + [len(order)] + list(order) + [nsteps]
+            self.steps_requested += nsteps
 
-    def connect(self, port):
-        b = self.client.connect(IP, port)
+        if self.cfg.debug:
+            self.print_debug("Sending a batch of {} orders".format(len(trials)))
+        return self._exchange([self._request(MSG_BATCH, content, timeout = self.cfg.reply_timeout*len(trials))],
+                              self._process_batch_reply)
+
+    def _process_batch_reply(self, replies):
+        resmsg, = replies
+        expect(resmsg, MSG_BATCH)
+
+        results = []
+        for _ in range(resmsg.readInt()):
+            results.append((self.process_sensors(resmsg), self.process_sensors(resmsg)))
+            self._count_steps(resmsg.readInt(), resmsg.readDouble())
+        return results
+
+    def receive_inverse_request(self):
+        """Allow the server to send an inverse request, and wait for it. The
+        server sends one request, when the mouse moves, then waits to be
+        allowed again. Return the indexes of the effect features targeted by
+        the request, and their values."""
+        assert self.pipeline is None, "inverse requests can't be received while orders are pipelined"
+        msg, timeout = self._request(MSG_INVERSE, [True])
+        self.client.send(msg)
+        msg = expect(self.client.receive(), MSG_INVERSE)
+        feats  = [msg.readInt() for _ in range(msg.readInt())]
+        values = [msg.readDouble() for _ in range(msg.readInt())]
+        return feats, values
 
+    def close(self):
+        if self.pipeline is not None:
+            self.pipeline.stop()
+            self.pipeline = None
+        if self.shared is not None:
+            self.close_world(signal.SIGTERM)
+            return
         try:
-            if b:
-                msg = self.client.sendAndReceive(OutboundMessage(type_msg=MSG_HELLO), timeout = 1.0)
-                self.print_status("connected on port {}".format(self.client.port))
-            else:
-                self.print_status("ERROR")
-        except KeyboardInterrupt:
-            exit(1)
-        except:
-            traceback.print_exc()
-            self.client.disconnect()
+            os.killpg(self.simproc.pid, signal.SIGTERM)
+        except OSError: # the server already exited
+            pass
+        self.remove_socket()
+
+    def kill(self):
+        """Kill the server without waiting for the pending requests, that fail.
+        Unlike close(), it can be called from a callback of the pipeline."""
+        if self.pipeline is not None:
+            self.pipeline.abort(ServerError("the server was killed"))
+            self.pipeline = None
+        if self.shared is not None: # the other worlds of the server fail too
+            self.close_world(signal.SIGKILL)
+            return
+        try:
+            os.killpg(self.simproc.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        self.remove_socket()
+        self.client.disconnect()
+
+    def remove_socket(self):
+        """Remove the file of the unix socket of the server, that it leaves behind"""
+        if self.address is not None and self.address.startswith(UNIX_PREFIX):
+            try:
+                os.unlink(self.address[len(UNIX_PREFIX):])
+            except OSError:
+                pass
+
+    def connect(self, deadline):
+        """Connect to the address reported by the server, retrying with an
+        exponential backoff until the deadline"""
+        delay = 0.01
+        while True:
+            try:
+                if self.address.startswith(UNIX_PREFIX):
+                    connected = self.client.connect(self.address[len(UNIX_PREFIX):])
+                else:
+                    connected = self.client.connect(IP, int(self.address))
+                if connected:
+                    msg = self.client.sendAndReceive(OutboundMessage(type_msg=MSG_HELLO), timeout = 1.0)
+                    if msg is not None and msg.type == MSG_HELLO:
+                        self.print_status("connected on port {}".format(self.client.port))
+                        return
+                self.client.disconnect()
+            except KeyboardInterrupt:
+                exit(1)
+            except Exception:
+                if self.cfg.debug:
+                    traceback.print_exc()
+
+            if self.simproc.poll() is not None:
+                raise self._launch_error("the server exited before accepting the connection (return code {})".format(self.simproc.returncode))
+            if time.time() + delay > deadline:
+                raise self._launch_error("could not connect to the server on {} after {:.1f}s".format(self.address, self.cfg.launch_timeout))
+            time.sleep(delay)
+            delay = min(2*delay, 1.0)
+
+    def ping(self):
+        """Exchange a MSG_HELLO with the server, and return the round-trip time (in s)"""
+        start = time.time()
+        msg, = self._exchange([self._request(MSG_HELLO, timeout = self.cfg.reply_timeout)], list)
+        expect(msg, MSG_HELLO)
+        return time.time() - start
+
+    def conf_message(self, conf):
+        """Return the content of the MSG_CONF message for the configuration vector"""
+        return (solver_conf(self.cfg) + list(conf) + [SENSOR_WIDTHS[self.cfg.sensor_dtype]]
+                + [float(self.cfg.settle_threshold), int(self.cfg.settle_window)]
+                + [RESET_MODES[self.cfg.reset_mode]])
+
+    def log_policy(self):
+        """Return the [mode, parameter] of the sensor history logging, sent
+        after the configuration. It does not change the effects, and is kept
+        out of conf_message, so that it does not change the cache keys."""
+        mode = self.cfg.sensor_log
+        if mode == 'auto':
+            mode = 'every' if self.history_needed else 'off'
+        param = int(self.cfg.sensor_log_size) if mode == 'ring' else int(self.cfg.sensor_log_period)
+        return [LOG_MODES[mode], max(1, param)]
 
     def send_conf(self, conf):
-        msg = self.client.sendAndReceive(OutboundMessage(MSG_CONF, [60.0, 3, 20, 20] + conf))
-        assert msg.type == MSG_CONF
+        """Configure the server; the round trip is skipped if the configuration did not change"""
+        conf_msg = self.conf_message(conf) + self.log_policy()
+        if conf_msg == self.conf_msg:
+            return self.reachable_space
+
+        msg, = self._exchange([self._request(MSG_CONF, conf_msg, timeout = self.cfg.reply_timeout)], list)
+        expect(msg, MSG_CONF)
 
         reachable_space = ((msg.readDouble(), msg.readDouble()), (msg.readDouble(), msg.readDouble()))
-        self.print_status("sent configuration {}".format(", ".join("{:+3.1f}".format(c_i) if type(c_i) == float else "{}".format(c_i) for c_i in [60.0, 3, 20, 20] + conf)))
+        self.print_status("sent configuration {}".format(", ".join("{:+3.1f}".format(c_i) if type(c_i) == float else "{}".format(c_i) for c_i in conf_msg)))
         self.print_status("reachable space: x:({:+3.1f}, {:+3.1f}), y:({:+3.1f}, {:+3.1f})".format(
                           reachable_space[0][0], reachable_space[0][1], reachable_space[1][0], reachable_space[1][1]))
+
+        self.conf = list(conf)
+        self.conf_msg = conf_msg
+        self.reachable_space = reachable_space
         return reachable_space
 
     def disconnect(self):
         self.print_status("disconnecting")
 
-        msg = self.client.sendAndReceive(OutboundMessage(MSG_BYE, ["Bye Server !"]))
-        assert msg.type == MSG_BYE
+        msg, = self._exchange([self._request(MSG_BYE, ["Bye Server !"])], list)
+        expect(msg, MSG_BYE)
 
         self.client.disconnect()
 
@@ -2,12 +2,20 @@
 from __future__ import division
 import numbers, sys
 import math
+import time
 
+import numpy as np
 import treedict
+from concurrent.futures import Future
 
 from toolbox import gfx
 
 import boxcom
+import boxcache
+import contact
+import metrics
+import supervisor
+import inverse
 
 prefixcolor = gfx.purple
 
@@ -55,6 +63,74 @@ defaultcfg.verbose_desc = ''
 defaultcfg.steps = None
 defaultcfg.steps_desc = 'duration (in s) of each trial'
 
+defaultcfg.batch_size = 100
+defaultcfg.batch_size_desc = 'maximum number of orders sent to the server in a single batch message'
+
+defaultcfg.trajectory_every = 1
+defaultcfg.trajectory_every_desc = 'when trajectories are requested, keep one step every trajectory_every steps'
+
+defaultcfg.trajectory_chunk = 1000
+defaultcfg.trajectory_chunk_desc = 'maximum number of trajectory steps sent by the server in a single message'
+
+defaultcfg.reuse_server = False
+defaultcfg.reuse_server_desc = 'if True, closed servers are kept alive, and reused by new simulations of the same process'
+
+defaultcfg.supervise = False
+defaultcfg.supervise_desc = ('if True, servers that crash, stall or, with max_server_memory, use too much memory '
+                             'are replaced by fresh ones, and the failed requests are run again; see supervisor.py')
+
+defaultcfg.cache_size = 0
+defaultcfg.cache_size_desc = 'maximum number of results kept in the in-memory cache; 0 to disable'
+
+defaultcfg.cache_precision = None
+defaultcfg.cache_precision_desc = 'if not None, orders are quantized to this precision before cache lookup'
+
+defaultcfg.cache_path = None
+defaultcfg.cache_path_desc = 'if not None, path of a result cache database shared between processes and runs'
+
+defaultcfg.contact_filter = False
+defaultcfg.contact_filter_desc = ('if True, trials in which the arm provably can\'t touch any toy are not simulated '
+                                  '(toy sensors only)')
+
+defaultcfg.contact_margin = 10.0
+defaultcfg.contact_margin_desc = 'distance added to the size of the toys by the contact filter, for the width of the arm'
+
+defaultcfg.contact_angle_margin = 0.05
+defaultcfg.contact_angle_margin_desc = 'angle (in rad) added to the course of the joints by the contact filter, for overshoots'
+
+defaultcfg.contact_segments = 1
+defaultcfg.contact_segments_desc = ('number of time segments the contact filter splits the course of the joints into; '
+                                    'above 1, the filter assumes that the joints move in lockstep at their maximum '
+                                    'velocity, which the PID controller does not, and may skip trials with contacts')
+
+defaultcfg.contact_verify = 0.0
+defaultcfg.contact_verify_desc = 'fraction of the trials skipped by the contact filter that are simulated anyway, to check it'
+
+defaultcfg.inverse_index = False
+defaultcfg.inverse_index_desc = ('if True, the orders executed and their effects are kept in a nearest-neighbour index, '
+                                 'for BoxSim.inverse() and the inverse requests of the visualization')
+
+defaultcfg.metrics = False
+defaultcfg.metrics_desc = 'if True, count the messages and trials, and record their latencies; see BoxSim.stats()'
+
+defaultcfg.metrics_path = None
+defaultcfg.metrics_path_desc = 'if not None, the metrics are periodically written as json to this file'
+
+defaultcfg.metrics_every = 60.0
+defaultcfg.metrics_every_desc = 'minimum duration (in s) between two writes of the metrics file'
+
+def _chain(future, f):
+    """Return a future of f applied to the result of future"""
+    chained = Future()
+    def done(future):
+        try:
+            chained.set_result(f(future.result()))
+        except Exception as e:
+            chained.set_exception(e)
+    future.add_done_callback(done)
+    return chained
+
+
 class FilterSim(object):
 
     def __init__(self, sim, s_feats = None, s_bounds_factor = None):
@@ -64,6 +140,7 @@ class FilterSim(object):
         self.m_feats  = sim.m_feats
         self.s_feats  = tuple(s_feats) if s_feats is not None else sim.s_feats
         self._s_feats_validity = [s_i in self.s_feats for s_i in self.sim.s_feats]
+        self._s_index = np.array([i for i, v_i in enumerate(self._s_feats_validity) if v_i], dtype = int)
         self.m_bounds = sim.m_bounds
 
         self.s_bounds_factor = s_bounds_factor
@@ -93,8 +170,18 @@ class FilterSim(object):
                                                  ", ".join("{}{:+3.2f}{}".format(gfx.green, e_i, gfx.end) for e_i in uni_effect), '\033[K'))
         return effect
 
+    def execute_order_async(self, order):
+        return _chain(self.sim.execute_order_async(order), self._filtered_effect)
+
+    def execute_orders(self, orders):
+        """Execute an array of orders, and return the array of filtered effects"""
+        return self._filtered_effects(self.sim.execute_orders(orders))
+
     def _filtered_effect(self, effect):
-        return tuple(e_i for e_i, v_i in zip(effect, self._s_feats_validity) if v_i)
+        return tuple(np.asarray(effect)[self._s_index].tolist())
+
+    def _filtered_effects(self, effects):
+        return np.asarray(effects)[:, self._s_index]
 
     def close(self):
         return self.sim.close()
@@ -115,11 +202,22 @@ class UniformizeSim(object):
         self.m_bounds = len(sim.m_bounds)*((0.0, 1.0),)
         self.s_bounds = len(sim.s_bounds)*((0.0, 1.0),)
 
+        self._m_min  = np.array([b_min for b_min, b_max in sim.m_bounds], dtype = float)
+        self._m_span = np.array([b_max - b_min for b_min, b_max in sim.m_bounds], dtype = float)
+        self._s_min  = np.array([s_min for s_min, s_max in sim.s_bounds], dtype = float)
+        self._s_span = np.array([s_max - s_min for s_min, s_max in sim.s_bounds], dtype = float)
+
     def _uni2sim(self, order):
-        return tuple(e_i*(b_max - b_min) + b_min for e_i, (b_min, b_max) in zip(order, self.sim.m_bounds))
+        return tuple(self._uni2sim_array(np.asarray(order, dtype = float)).tolist())
 
     def _sim2uni(self, effect):
-        return tuple((e_i - s_min)/(s_max - s_min) for e_i, (s_min, s_max) in zip(effect, self.sim.s_bounds))
+        return tuple(self._sim2uni_array(np.asarray(effect, dtype = float)).tolist())
+
+    def _uni2sim_array(self, orders):
+        return orders*self._m_span + self._m_min
+
+    def _sim2uni_array(self, effects):
+        return (effects - self._s_min)/self._s_span
 
     def execute_order(self, uni_order, verbose = False):
         order = self._uni2sim(uni_order)
@@ -132,6 +230,15 @@ class UniformizeSim(object):
 
         return uni_effect
 
+    def execute_order_async(self, uni_order):
+        order = self._uni2sim(uni_order)
+        return _chain(self.sim.execute_order_async(order), self._sim2uni)
+
+    def execute_orders(self, uni_orders):
+        """Execute an array of uniformized orders, and return the array of uniformized effects"""
+        orders = self._uni2sim_array(np.asarray(uni_orders, dtype = float))
+        return self._sim2uni_array(np.asarray(self.sim.execute_orders(orders), dtype = float))
+
     def close(self):
         return self.sim.close()
 
@@ -146,6 +253,33 @@ class BoxSimBase(object):
 
         self.armsize  = len(self.cfg.arm_lengths)
 
+        self.metrics = None
+        if self.cfg.metrics:
+            self.metrics = metrics.Metrics(path = self.cfg.metrics_path, every = self.cfg.metrics_every)
+
+        self.cache = None
+        self._setup_cache()
+        self.contact_filter = None
+
+    def _setup_cache(self):
+        """Create the result cache, if enabled and if its parameters changed"""
+        params = (self.cfg.cache_size, self.cfg.cache_precision, self.cfg.cache_path)
+        if self.cache is not None:
+            if params == (self.cache.size, self.cache.precision, self.cache.path):
+                return
+            self.cache.close()
+            self.cache = None
+        if self.cfg.cache_size > 0 or self.cfg.cache_path is not None:
+            self.cache = boxcache.ResultCache(*params)
+
+    def _setup_contact_filter(self):
+        self.contact_filter = None
+        if self.cfg.contact_filter:
+            self.contact_filter = contact.ContactFilter(self.cfg, margin = self.cfg.contact_margin,
+                                                        angle_margin = self.cfg.contact_angle_margin,
+                                                        segments = self.cfg.contact_segments,
+                                                        verify = self.cfg.contact_verify)
+
     @staticmethod
     def _check_cfg(cfg):
         """Check and format config"""
@@ -170,21 +304,106 @@ class BoxSimBase(object):
         assert isinstance(cfg.verbose, bool)
         assert isinstance(cfg.visu, bool)
 
-    def _execute_raw(self, order):
-        assert len(order) == 3*self.armsize
-        order = [float(oi) for oi in order]
+    def _split_orders(self, orders):
+        """Convert full motor orders into initial poses and flat orders for the server"""
+        orders = np.asarray(orders, dtype = float)
+        assert orders.shape[1] == 3*self.armsize
 
-        init_pose   = order[:self.armsize]
-        target_pose = order[self.armsize:2*self.armsize]
-        max_vel     = order[2*self.armsize:3*self.armsize]
+        init_poses  = orders[:, :self.armsize]
+        target_pose = orders[:, self.armsize:2*self.armsize]
+        max_vel     = orders[:, 2*self.armsize:3*self.armsize]
+        assert np.all(max_vel >= -0.00001)
 
-        flat_order = []
-        for t_i, v_i in zip(target_pose, max_vel):
-            assert v_i >= -0.00001
-            v_i = max(0.0, v_i)
-            flat_order += [t_i, v_i]
+        flat_orders = np.empty((len(orders), 2*self.armsize))
+        flat_orders[:, 0::2] = target_pose
+        flat_orders[:, 1::2] = np.maximum(0.0, max_vel)
 
-        return self._boxcom.send_order(init_pose, flat_order, self.cfg.steps, self.conf)
+        return init_poses.tolist(), flat_orders.tolist()
+
+    def _split_order(self, order):
+        """Convert a full motor order into an initial pose and a flat order for the server"""
+        init_poses, flat_orders = self._split_orders([order])
+        return init_poses[0], flat_orders[0]
+
+    def _execute_raw(self, order):
+        return self._execute_raw_batch([order])[0]
+
+    def _execute_raw_batch(self, orders):
+        """Execute several full motor orders, skipping those that can't touch a toy
+        and using the cache if enabled, with as few round trips as possible"""
+        if self.contact_filter is not None:
+            return self.contact_filter.execute(orders, self._execute_sim_batch)
+        return self._execute_sim_batch(orders)
+
+    def _execute_sim_batch(self, orders):
+        init_poses, flat_orders = self._split_orders(orders)
+        trials = [(init_pose, flat_order, self.cfg.steps) for init_pose, flat_order in zip(init_poses, flat_orders)]
+        if self.cache is None:
+            return self._run_trials(trials)
+
+        conf_msg = self._boxcom.conf_message(self.conf)
+        keys = [self.cache.key(conf_msg, nsteps, init_pose, flat_order)
+                for init_pose, flat_order, nsteps in trials]
+        results = [self.cache.get(key) for key in keys]
+
+        missing = [i for i, result in enumerate(results) if result is None]
+        for i, result in zip(missing, self._run_trials([trials[i] for i in missing])):
+            self.cache.put(keys[i], result)
+            results[i] = result
+        return results
+
+    def _execute_raw_arrays(self, orders):
+        """Execute several full motor orders, and return the arrays of the raw
+        sensor readings before and after each"""
+        results = self._execute_raw_batch(orders)
+        return (np.array([result[0] for result in results], dtype = float),
+                np.array([result[1] for result in results], dtype = float))
+
+    def _execute_raw_async(self, order):
+        if (self.contact_filter is not None and self.contact_filter.rest is not None
+            and not self.contact_filter.may_touch([order])[0]):
+            future = Future()
+            future.set_result(self._execute_raw(order))
+            return future
+
+        init_pose, flat_order = self._split_order(order)
+        if self.cache is not None:
+            key = self.cache.key(self._boxcom.conf_message(self.conf), self.cfg.steps, init_pose, flat_order)
+            result = self.cache.get(key)
+            if result is not None:
+                future = Future()
+                future.set_result(result)
+                return future
+
+        future = self._boxcom.send_order_async(init_pose, flat_order, self.cfg.steps, self.conf)
+        if self.cache is not None:
+            def store(result):
+                self.cache.put(key, result)
+                return result
+            future = _chain(future, store)
+        return future
+
+    def _execute_raw_trajectories(self, orders):
+        """Execute several full motor orders, and return the sensor readings
+        before and after each, and the history of the sensors during each.
+        The cache is not used."""
+        init_poses, flat_orders = self._split_orders(orders)
+        futures = [self._boxcom.send_order_trajectory_async(init_pose, flat_order, self.cfg.steps, self.conf,
+                                                            every = self.cfg.trajectory_every,
+                                                            chunk_rows = self.cfg.trajectory_chunk)
+                   for init_pose, flat_order in zip(init_poses, flat_orders)]
+        return [future.result() for future in futures]
+
+    def _run_trials(self, trials):
+        if len(trials) == 1 or self.cfg.visu:
+            # the visualization runs steps asynchronously, and can't do batches.
+            return [self._boxcom.send_order(init_pose, flat_order, nsteps, self.conf)
+                    for init_pose, flat_order, nsteps in trials]
+
+        results = []
+        for start in range(0, len(trials), self.cfg.batch_size):
+            results += self._boxcom.send_orders(trials[start:start + self.cfg.batch_size])
+        return results
 
     def _make_conf(self):
         self.conf = ( [self.armsize]
@@ -207,70 +426,97 @@ class BoxSimBase(object):
         return self.conf
 
     def _send_conf(self, conf_vector):
-        self._boxcom = boxcom.BoxCom(self, self.cfg)
+        if self.cfg.supervise:
+            self._boxcom = supervisor.Supervisor(self)
+        else:
+            self._boxcom = boxcom.acquire(self)
         self._geo_bounds = self._boxcom.send_conf(conf_vector)
 
+    def stats(self):
+        """Return the counters of the simulation, and, if cfg.metrics is True,
+        the latencies of each message type, of the server steps, and of the
+        client-side processing"""
+        stats = {}
+        if self._boxcom is not None:
+            stats['server'] = {'launch_time'     : self._boxcom.launch_time,
+                               'trials_run'      : self._boxcom.trials_run,
+                               'steps_requested' : self._boxcom.steps_requested,
+                               'steps_run'       : self._boxcom.steps_run}
+            if self.cfg.supervise:
+                stats['server'].update(self._boxcom.stats())
+        if self.cache is not None:
+            stats['cache'] = self.cache.stats()
+        if self.contact_filter is not None:
+            stats['contact'] = self.contact_filter.stats()
+        if self.metrics is not None:
+            stats.update(self.metrics.summary())
+            # time spent in BoxSim but not waiting for the server
+            latencies = stats['latencies']
+            sim_time = sum(h['total'] for name, h in latencies.items() if name.startswith('sim.'))
+            msg_time = sum(h['total'] for name, h in latencies.items() if name.startswith('msg.'))
+            stats['client_overhead'] = sim_time - msg_time
+        return stats
+
     def close(self):
-        self._boxcom.close()
+        if self.metrics is not None and self.metrics.path is not None:
+            self.metrics.dump()
+        if self.cache is not None:
+            self.cache.close()
+        if self.cfg.reuse_server and not self.cfg.supervise:
+            boxcom.release(self._boxcom)
+        else:
+            self._boxcom.close()
 
 
     ## Sensory features extraction functions ##
+    # before and after are arrays of shape (n, raw sensors), the readings of
+    # the sensors before and after each trial.
 
-def _extract_sfeat(result, s_feats, absolute = True):
-    s_value = tuple(result[1][s_i] for s_i in s_feats)
+def _extract_sfeat(before, after, s_index, absolute = True):
+    s_value = after[:, s_index]
     if not absolute:
-        s_value = tuple(s_vi - result[0][s_i] for s_vi, s_i in zip(s_value, s_feats))
+        s_value = s_value - before[:, s_index]
     return s_value
 
-def _arm_pos(self, result, absolute = True):
-    toy_n = len(self.cfg.toy_order)
-    return _extract_sfeat(result, (-3 - 2*toy_n, -2 - 2*toy_n), absolute = absolute)
-
-def _toy_pos(self, result, absolute = True):
-    toy_n = len(self.cfg.toy_order)
-    toy_pos = tuple()
-    for i in range(toy_n, 0, -1):
-        toy_pos += _extract_sfeat(result, (-2*i, -2*i+1), absolute = absolute)
-        toy_displacement = _extract_sfeat(result, (-2*i, -2*i+1), absolute = False)
-        if toy_displacement == (0., 0.):
-            toy_pos += ((0.0),)
-        else:
-            toy_pos += ((1.0),)
-    return toy_pos
+def _arm_pos(self, before, after, absolute = True):
+    return _extract_sfeat(before, after, self._arm_index, absolute = absolute)
+
+def _toy_pos(self, before, after, absolute = True):
+    n, toy_n = len(after), len(self.cfg.toy_order)
+    toy_pos = _extract_sfeat(before, after, self._toy_index, absolute = absolute).reshape(n, toy_n, 2)
+    moved = np.any((after[:, self._toy_index] != before[:, self._toy_index]).reshape(n, toy_n, 2), axis = 2)
+    return np.concatenate((toy_pos, moved.reshape(n, toy_n, 1)), axis = 2).reshape(n, 3*toy_n)
 
-def _armtoys_pos(self, result, absolute = True):
-    return _arm_pos(self, result, absolute = absolute) + _toy_pos(self, result, absolute = absolute)
+def _armtoys_pos(self, before, after, absolute = True):
+    return np.hstack((_arm_pos(self, before, after, absolute = absolute),
+                      _toy_pos(self, before, after, absolute = absolute)))
 
-def _joint_pos(self, result, absolute = True):
-    s_feats = []
-    for i in range(self.armsize):
-        s_feats.append(3*i)
-        s_feats.append(3*i+1)
-    return _extract_sfeat(result, s_feats, absolute = absolute)
+def _joint_pos(self, before, after, absolute = True):
+    return _extract_sfeat(before, after, self._joint_index, absolute = absolute)
 
-def _joint_angle(self, result, absolute = True):
-    s_feats = [3*i+2 for i in range(self.armsize)]
-    return _extract_sfeat(result, s_feats, absolute = absolute)
+def _joint_angle(self, before, after, absolute = True):
+    return _extract_sfeat(before, after, self._angle_index, absolute = absolute)
 
-def _fullarm_sensors(self, result, absolute = True):
-    return _joint_pos(self, result, absolute = absolute) + _joint_angle(self, result, absolute = absolute)
+def _fullarm_sensors(self, before, after, absolute = True):
+    return np.hstack((_joint_pos(self, before, after, absolute = absolute),
+                      _joint_angle(self, before, after, absolute = absolute)))
 
 
     ## Motor order conversion functions ##
+    # orders are arrays of shape (n, motor features)
 
-def _goto(self, order):
-    assert len(order) == self.armsize
-    init_pos = tuple(0.0 for _ in order)
-    vels     = tuple(self.cfg.max_speed for _ in order)
-    return init_pos + tuple(order) + vels
+def _goto(self, orders):
+    assert orders.shape[1] == self.armsize
+    n = len(orders)
+    return np.hstack((np.zeros((n, self.armsize)), orders, np.full((n, self.armsize), float(self.cfg.max_speed))))
 
-def _common_velocity(self, order):
-    assert len(order) == 2*self.armsize + 1
-    return tuple(order) + (self.armsize - 1)*(order[-1],)
+def _common_velocity(self, orders):
+    assert orders.shape[1] == 2*self.armsize + 1
+    return np.hstack((orders, np.repeat(orders[:, -1:], self.armsize - 1, axis = 1)))
 
-def _full_motor(self, order):
-    assert len(order) == 3*self.armsize
-    return order
+def _full_motor(self, orders):
+    assert orders.shape[1] == 3*self.armsize
+    return orders
 
     ## Class ##
 
@@ -282,8 +528,24 @@ class BoxSim(BoxSimBase):
 
         conf_vector = self._make_conf()
         self._send_conf(conf_vector)
+        self._setup_features()
+        self._setup_contact_filter()
+        self._setup_inverse_index()
+
+    def _setup_inverse_index(self):
+        self.inverse_index = None
+        if self.cfg.inverse_index:
+            self.inverse_index = inverse.InverseIndex(len(self.m_feats), len(self.s_feats))
+
+    def _setup_features(self):
+        """Compute the sensory and motor features and bounds from the configuration"""
 
         toy_n = len(self.cfg.toy_order)
+        self._arm_index   = np.array((-3 - 2*toy_n, -2 - 2*toy_n))
+        self._toy_index   = np.arange(-2*toy_n, 0)
+        self._joint_index = np.array([3*i + k for i in range(self.armsize) for k in (0, 1)], dtype = int)
+        self._angle_index = np.array([3*i + 2 for i in range(self.armsize)], dtype = int)
+
         sensors_dict = {'arm'     : ((0, 1),                        self._geo_bounds,                                         _arm_pos),
                         'toy'     : (tuple(range(3*toy_n)),        (self._geo_bounds + ((0., 1.),))*toy_n,                    _toy_pos),
                         'joints'  : (tuple(range(2*self.armsize)),  self.armsize*self._geo_bounds,                            _joint_pos),
@@ -301,25 +563,132 @@ class BoxSim(BoxSimBase):
                        'fullmotor'      : (tuple(range(-3*self.armsize, 0)),   2*self.armsize*jb + self.armsize*((0., self.cfg.max_speed),), _full_motor),
                       }
 
-        self.s_feats, self.s_bounds, self.s_f = sensors_dict[cfg.sensors]
-        self.m_feats, self.m_bounds, self.m_f =  motors_dict[cfg.motors]
+        self.s_feats, self.s_bounds, self.s_f = sensors_dict[self.cfg.sensors]
+        self.m_feats, self.m_bounds, self.m_f =  motors_dict[self.cfg.motors]
+
+    def reconfigure(self, cfg):
+        """Change the configuration of the simulation, without launching a new server.
+        The configuration is only sent if it changed."""
+        assert cfg.visu == self.cfg.visu, "the visualization can't be changed on a running server"
+        cfg.update(defaultcfg, overwrite = False)
+        assert cfg.supervise == self.cfg.supervise, "the supervision can't be changed by reconfiguration"
+        self._check_cfg(cfg)
 
-    def execute_order(self, order, verbose = True):
+        self.cfg = cfg
+        self.armsize = len(self.cfg.arm_lengths)
 
-        order = [float(oi) for oi in order]
-        long_order = self.m_f(self, order)
+        conf_vector = self._make_conf()
+        self._boxcom.bind(self)
+        self._geo_bounds = self._boxcom.send_conf(conf_vector)
+        self._setup_features()
+        self._setup_cache()
+        self._setup_contact_filter()
+        self._setup_inverse_index()
+
+    def _effects(self, results):
+        """Compute the effects from a list of raw results"""
+        before = np.array([result[0] for result in results], dtype = float)
+        after  = np.array([result[1] for result in results], dtype = float)
+        return self._effects_arrays(before, after)
+
+    def _effects_arrays(self, before, after):
+        effects = self.s_f(self, before, after)
+        assert effects.shape[1] == len(self.s_feats)
+        return effects
+
+    def _trajectory(self, before, history):
+        """Compute the effects at each step of the sensor history, of shape (steps, len(s_feats))"""
+        return self.s_f(self, np.repeat(np.array([before], dtype = float), len(history), axis = 0), history)
+
+    def execute_order(self, order, verbose = True, trajectory = False):
+        """Execute an order and return its effect.
+        If trajectory is True, return the effect and the array of the effects
+        at each step of the trial (downsampled by cfg.trajectory_every)."""
+
+        start = time.time()
+        long_order = self.m_f(self, np.array([order], dtype = float))[0]
         if self.cfg.verbose:
             print('{}sim{}: ({}) -> ...\r'.format(prefixcolor, gfx.end,
                                                   ', '.join('{}{:+3.2f}{}'.format(gfx.cyan, o_i, gfx.end) for o_i in long_order))),
             sys.stdout.flush()
 
-        result = self._execute_raw(long_order)
-        effect = self.s_f(self, result)
-        assert len(effect) == len(self.s_feats)
+        if trajectory:
+            before, after, history = self._execute_raw_trajectories([long_order])[0]
+            result = before, after
+        else:
+            result = self._execute_raw(long_order)
+        effect = tuple(self._effects([result])[0].tolist())
 
         if self.cfg.verbose and verbose:
             print('{}sim{}: ({}) -> ({}){}'.format(prefixcolor, gfx.end,
                                                    ', '.join('{}{:+3.2f}{}'.format(gfx.cyan, o_i, gfx.end) for o_i in long_order),
                                                    ', '.join('{}{:+3.0f}{}'.format(gfx.green, e_i, gfx.end) for e_i in effect), '\033[K'))
+        if self.inverse_index is not None:
+            self.inverse_index.add(order, effect)
+        if self.metrics is not None:
+            self.metrics.record('sim.execute_order', time.time() - start)
+            self.metrics.count('sim.orders')
+        if trajectory:
+            return effect, self._trajectory(before, history)
         return effect
 
+    def execute_orders(self, orders, trajectory = False):
+        """Execute an array of orders of shape (n, len(m_feats)), with one round trip
+        per batch of orders, and return the array of effects, of shape (n, len(s_feats)).
+        If trajectory is True, also return the list of the trajectories of each order."""
+        start = time.time()
+        orders = np.asarray(orders, dtype = float)
+        if len(orders) == 0:
+            effects = np.zeros((0, len(self.s_feats)))
+            return (effects, []) if trajectory else effects
+        long_orders = self.m_f(self, orders)
+
+        if not trajectory:
+            effects = self._effects_arrays(*self._execute_raw_arrays(long_orders))
+        else:
+            results = self._execute_raw_trajectories(long_orders)
+            effects = self._effects([(before, after) for before, after, history in results])
+            trajectories = [self._trajectory(before, history) for before, after, history in results]
+
+        if self.inverse_index is not None:
+            self.inverse_index.add(orders, effects)
+        if self.metrics is not None:
+            self.metrics.record('sim.execute_orders', time.time() - start)
+            self.metrics.count('sim.orders', len(orders))
+        return (effects, trajectories) if trajectory else effects
+
+    def execute_order_async(self, order):
+        """Execute an order without waiting for its effect, and return a
+        concurrent.futures.Future of the effect. Several orders can be queued
+        on the server, so that the next order starts as soon as the previous
+        one ends. Under python 3, asyncio.wrap_future() makes it awaitable."""
+        long_order = self.m_f(self, np.array([order], dtype = float))[0]
+
+        def effect(result):
+            effect = tuple(self._effects([result])[0].tolist())
+            if self.inverse_index is not None:
+                self.inverse_index.add(order, effect)
+            return effect
+
+        return _chain(self._execute_raw_async(long_order), effect)
+
+    def inverse(self, effect, k = 1, feats = None):
+        """Return the k orders whose effects are the nearest to effect, their
+        effects, and the distances to effect, by increasing distance. If feats
+        is not None, effect holds the values of the effect features of indexes
+        feats, and only those are compared. Requires cfg.inverse_index."""
+        assert self.inverse_index is not None, "the inverse index is disabled (cfg.inverse_index)"
+        return self.inverse_index.inverse(effect, k = k, feats = feats)
+
+    def serve_inverse(self, n_requests = None):
+        """Answer the inverse requests of the visualization, sent when the
+        mouse moves, with the order of the nearest known effect, which is then
+        executed. Return after n_requests requests, or never if None."""
+        served = 0
+        while n_requests is None or served < n_requests:
+            feats, values = self._boxcom.receive_inverse_request()
+            orders, effects, distances = self.inverse(values, k = 1, feats = feats)
+            if len(orders) > 0:
+                # executed without adding it again to the index
+                self._execute_raw(self.m_f(self, orders[:1])[0])
+            served += 1
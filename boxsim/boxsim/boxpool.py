@@ -0,0 +1,178 @@
+import sys
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+from toolbox import gfx
+
+import boxctrl
+
+prefixcolor = gfx.purple
+
+class BoxSimPool(object):
+    """Run several simulation servers at once, and dispatch orders to whichever is free
+
+    All servers receive the same configuration, so the pool exposes the same
+    m_feats, m_bounds, s_feats and s_bounds as a single BoxSim, and can be
+    wrapped by UniformizeSim and FilterSim.
+    """
+
+    def __init__(self, cfg, n_workers):
+        assert n_workers >= 1
+        self.cfg = cfg
+        self.cfg.update(boxctrl.defaultcfg, overwrite = False)
+        self.n_workers = n_workers
+
+        self.sims = self._launch_sims(n_workers)
+
+        self.m_feats  = self.sims[0].m_feats
+        self.m_bounds = self.sims[0].m_bounds
+        self.s_feats  = self.sims[0].s_feats
+        self.s_bounds = self.sims[0].s_bounds
+
+        self._idle = queue.Queue()
+        for sim in self.sims:
+            self._idle.put(sim)
+        self._executor = None
+
+    def _launch_sims(self, n_workers):
+        """Launch the servers in parallel, to pay the JVM startup only once"""
+        sims, errors = [None]*n_workers, []
+
+        def launch(i):
+            try:
+                worker_cfg = self.cfg.copy(deep = True)
+                worker_cfg.verbose = False
+                sims[i] = boxctrl.BoxSim(worker_cfg)
+            except Exception:
+                errors.append(sys.exc_info())
+
+        threads = [threading.Thread(target = launch, args = (i,)) for i in range(n_workers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        if len(errors) > 0:
+            for sim in sims:
+                if sim is not None:
+                    sim.close()
+            raise errors[0][1]
+        return sims
+
+    def _execute_one(self, order):
+        sim = self._idle.get()
+        try:
+            return sim.execute_order(order, verbose = False)
+        finally:
+            self._idle.put(sim)
+
+    def execute_order(self, order, verbose = False):
+        effect = self._execute_one(order)
+
+        if verbose and self.cfg.verbose:
+            print("{}sim{}: ({}) -> ({}){}".format(prefixcolor, gfx.end,
+                                                 ", ".join("{}{:+3.2f}{}".format(gfx.cyan, o_i, gfx.end) for o_i in order),
+                                                 ", ".join("{}{:+3.2f}{}".format(gfx.green, e_i, gfx.end) for e_i in effect), '\033[K'))
+        return effect
+
+    def execute_order_async(self, order):
+        """Execute an order on the first available server, and return a future of the effect"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.n_workers)
+        return self._executor.submit(self.execute_order, order)
+
+    def _execute_chunk(self, orders):
+        sim = self._idle.get()
+        try:
+            return sim.execute_orders(orders)
+        finally:
+            self._idle.put(sim)
+
+    @staticmethod
+    def _chunks(orders, chunksize):
+        chunk = []
+        for i, order in enumerate(orders):
+            chunk.append((i, order))
+            if len(chunk) == chunksize:
+                yield chunk
+                chunk = []
+        if len(chunk) > 0:
+            yield chunk
+
+    def imap(self, orders, chunksize = 1):
+        """Execute orders on the first available server, and yield (index, effect)
+        pairs as soon as they are available, regardless of the orders' order.
+
+        orders may be any iterable; it is consumed lazily. Orders are sent to
+        the servers in batches of chunksize orders.
+        """
+        tasks, results = queue.Queue(), queue.Queue()
+
+        def work():
+            while True:
+                chunk = tasks.get()
+                if chunk is None:
+                    return
+                try:
+                    effects = self._execute_chunk([order for _, order in chunk])
+                    results.put(([i for i, _ in chunk], effects, None))
+                except Exception:
+                    results.put((None, None, sys.exc_info()))
+
+        workers = [threading.Thread(target = work) for _ in range(self.n_workers)]
+        for w in workers:
+            w.daemon = True
+            w.start()
+
+        try:
+            # keep at most two chunks queued per server
+            pending = 0
+            chunk_it = self._chunks(orders, chunksize)
+            for chunk in chunk_it:
+                tasks.put(chunk)
+                pending += 1
+                if pending >= 2*self.n_workers:
+                    break
+
+            while pending > 0:
+                indexes, effects, error = results.get()
+                pending -= 1
+                if error is not None:
+                    raise error[1]
+                for chunk in chunk_it:
+                    tasks.put(chunk)
+                    pending += 1
+                    break
+                for i, effect in zip(indexes, effects):
+                    yield i, effect
+
+        finally:
+            for _ in workers:
+                tasks.put(None)
+
+    def execute_orders(self, orders):
+        """Execute an array of orders in parallel, and return the array of effects,
+        in the orders' order"""
+        orders = np.asarray(orders, dtype = float)
+        if len(orders) == 0:
+            return np.zeros((0, len(self.s_feats)))
+        # a few chunks per server, so that slow chunks don't hold up the others.
+        chunksize = max(1, min(self.cfg.batch_size, len(orders)//(4*self.n_workers)))
+
+        effects = np.empty((len(orders), len(self.s_feats)))
+        for i, effect in self.imap(orders, chunksize = chunksize):
+            effects[i] = effect
+        return effects
+
+    map = execute_orders
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+        for sim in self.sims:
+            sim.close()
@@ -0,0 +1,177 @@
+"""Conservative detection of the trials in which the arm can't touch any toy.
+
+During a trial, each joint stays between its initial angle and the angle it
+reaches moving at its maximum velocity (widened by a margin, for the
+overshoot of the controller), whatever the lag of the PID controller.
+Interval arithmetic on the cumulative angles bounds the position of each
+joint by a box, and each link by the bounding box of its two joints. If no
+link box, widened by the width of the arm, intersects the bounding disk of a
+toy, the toys can't move, and the result of the trial is known without
+simulation: the arm ends in its final pose, and the toys where they started.
+
+The course of the joints can also be split in time segments, assuming that
+they all move at their maximum velocity until they reach their targets. The
+bound is then tighter, but the PID controller lags behind that schedule, so
+it is not conservative anymore: use it with `verify`.
+"""
+from __future__ import division
+
+import math
+import warnings
+
+import numpy as np
+
+import boxcom
+import kinematics
+
+TWO_PI = 2*math.pi
+
+
+def _contains(lo, hi, c):
+    """For each interval [lo, hi], return True if it contains c modulo 2pi"""
+    return c + TWO_PI*np.floor((hi - c)/TWO_PI) >= lo
+
+def sin_interval(lo, hi):
+    """Bounds of sin over the intervals [lo, hi]"""
+    s_lo, s_hi = np.sin(lo), np.sin(hi)
+    s_min = np.where(_contains(lo, hi, -math.pi/2), -1.0, np.minimum(s_lo, s_hi))
+    s_max = np.where(_contains(lo, hi,  math.pi/2),  1.0, np.maximum(s_lo, s_hi))
+    return s_min, s_max
+
+def cos_interval(lo, hi):
+    """Bounds of cos over the intervals [lo, hi]"""
+    return sin_interval(lo + math.pi/2, hi + math.pi/2)
+
+
+class ContactFilter(object):
+    """Skip the simulation of the trials in which the arm can't touch any toy.
+
+    Only the toy sensors are supported, as the arm readings of skipped trials
+    are computed by the kinematic engine. A fraction `verify` of the skipped
+    trials is still simulated, to check that the toys indeed did not move;
+    the trials in which they did are counted in `errors`.
+    """
+
+    def __init__(self, cfg, margin = 10.0, angle_margin = 0.05, segments = 1, verify = 0.0):
+        assert cfg.sensors == 'toy', "the contact filter only supports the toy sensors"
+        self.cfg = cfg
+        self.margin       = margin
+        self.angle_margin = angle_margin
+        self.segments     = segments
+        self.verify       = verify
+        self.duration     = cfg.steps/boxcom.solver_conf(cfg)[0]
+
+        self.lengths = np.array(cfg.arm_lengths, dtype = float)
+        toys = [cfg.toys[toyname] for toyname in cfg.toy_order]
+        self.toy_pos    = np.array([toy.pos for toy in toys], dtype = float).reshape(-1, 2)
+        # bounding disks; the size of cubes may be a half-width.
+        self.toy_radius = np.array([toy.width/2 if toy.type == 'ball' else toy.width*math.sqrt(2)
+                                    for toy in toys], dtype = float)
+
+        self.rest = None # toy readings at rest, learned from the first simulated trial
+
+        self.trials   = 0
+        self.skipped  = 0
+        self.verified = 0
+        self.errors   = 0
+
+    def may_touch(self, orders):
+        """Return, for each full motor order, False if the arm can't touch any toy"""
+        orders = np.asarray(orders, dtype = float)
+        armsize = len(self.lengths)
+        init_pos = np.clip(orders[:, :armsize], -self.cfg.angle_limit, self.cfg.angle_limit)
+        if self.segments == 1:
+            # the course of the joints, whatever their timing.
+            final_pos = kinematics.final_angles(orders, self.cfg.angle_limit, self.duration)
+            return self._boxes_touch(np.minimum(init_pos, final_pos), np.maximum(init_pos, final_pos))
+
+        # not conservative: the joints are assumed to move in lockstep, at
+        # their maximum velocity, until they all reached their target
+        travel = np.abs(np.clip(orders[:, armsize:2*armsize], -self.cfg.angle_limit, self.cfg.angle_limit) - init_pos)
+        velocity = np.maximum(0.0, orders[:, 2*armsize:])
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            end = np.nan_to_num(np.max(np.where(travel > 0, travel/velocity, 0.0), axis = 1))
+        end = np.minimum(self.duration, end)
+
+        angles = [kinematics.final_angles(orders, self.cfg.angle_limit, end*k/self.segments)
+                  for k in range(self.segments + 1)]
+        touch = np.zeros(len(orders), dtype = bool)
+        for start_pos, end_pos in zip(angles[:-1], angles[1:]):
+            touch |= self._boxes_touch(np.minimum(start_pos, end_pos), np.maximum(start_pos, end_pos))
+        return touch
+
+    def _boxes_touch(self, angles_lo, angles_hi):
+        """Return, for each range of joint angles, True if the arm may touch a toy"""
+        theta_lo = np.cumsum(angles_lo - self.angle_margin, axis = 1)
+        theta_hi = np.cumsum(angles_hi + self.angle_margin, axis = 1)
+        sin_min, sin_max = sin_interval(theta_lo, theta_hi)
+        cos_min, cos_max = cos_interval(theta_lo, theta_hi)
+
+        # boxes of the joints, from the base to the tip: x = base_x - sum(l*sin), y = base_y + sum(l*cos)
+        n = len(angles_lo)
+        zeros = np.zeros((n, 1))
+        x_lo = self.cfg.base_pos[0] + np.hstack((zeros, np.cumsum(-self.lengths*sin_max, axis = 1)))
+        x_hi = self.cfg.base_pos[0] + np.hstack((zeros, np.cumsum(-self.lengths*sin_min, axis = 1)))
+        y_lo = self.cfg.base_pos[1] + np.hstack((zeros, np.cumsum( self.lengths*cos_min, axis = 1)))
+        y_hi = self.cfg.base_pos[1] + np.hstack((zeros, np.cumsum( self.lengths*cos_max, axis = 1)))
+
+        # boxes of the links, of shape (n, armsize, 1), against toys on the last axis
+        lx_lo = np.minimum(x_lo[:, :-1], x_lo[:, 1:])[:, :, None]
+        lx_hi = np.maximum(x_hi[:, :-1], x_hi[:, 1:])[:, :, None]
+        ly_lo = np.minimum(y_lo[:, :-1], y_lo[:, 1:])[:, :, None]
+        ly_hi = np.maximum(y_hi[:, :-1], y_hi[:, 1:])[:, :, None]
+
+        dx = self.toy_pos[:, 0] - np.clip(self.toy_pos[:, 0], lx_lo, lx_hi)
+        dy = self.toy_pos[:, 1] - np.clip(self.toy_pos[:, 1], ly_lo, ly_hi)
+        reach = (self.toy_radius + self.margin)**2
+        return np.any(dx**2 + dy**2 <= reach, axis = (1, 2))
+
+    def _known_results(self, orders):
+        """Results of trials without contact: arm from the kinematic engine, toys at rest"""
+        armsize = len(self.lengths)
+        init_pos  = np.clip(orders[:, :armsize], -self.cfg.angle_limit, self.cfg.angle_limit)
+        final_pos = kinematics.final_angles(orders, self.cfg.angle_limit, self.duration)
+        before = kinematics.forward(init_pos,  self.cfg.arm_lengths, self.cfg.base_pos).tolist()
+        after  = kinematics.forward(final_pos, self.cfg.arm_lengths, self.cfg.base_pos).tolist()
+        return [(tuple(b) + self.rest, tuple(a) + self.rest) for b, a in zip(before, after)]
+
+    def _learn_rest(self, result):
+        n_toys = len(self.toy_pos)
+        self.rest = tuple(float(r_i) for r_i in result[0][len(result[0]) - 2*n_toys:])
+
+    def execute(self, orders, execute):
+        """Execute full motor orders, calling execute(orders) only for those in
+        which the arm may touch a toy, or that are verified"""
+        orders = np.asarray(orders, dtype = float)
+        if self.rest is None:
+            if len(orders) == 0:
+                return []
+            first = execute(orders[:1])
+            self.trials += 1
+            self._learn_rest(first[0])
+            return list(first) + self.execute(orders[1:], execute)
+        self.trials += len(orders)
+
+        skip = ~self.may_touch(orders)
+        verify = skip & (np.random.random_sample(len(orders)) < self.verify)
+        simulate = ~skip | verify
+        self.skipped  += int(np.sum(skip & ~verify))
+        self.verified += int(np.sum(verify))
+
+        results = [None]*len(orders)
+        if np.any(simulate):
+            for i, result in zip(np.flatnonzero(simulate), execute(orders[simulate])):
+                results[i] = result
+        for i in np.flatnonzero(verify):
+            if not np.allclose(results[i][1][len(results[i][1]) - len(self.rest):], self.rest):
+                self.errors += 1
+                warnings.warn('the contact filter would have skipped a trial in which toys moved')
+
+        known = np.flatnonzero(skip & ~verify)
+        for i, result in zip(known, self._known_results(orders[known])):
+            results[i] = result
+        return results
+
+    def stats(self):
+        return {'trials': self.trials, 'skipped': self.skipped,
+                'verified': self.verified, 'errors': self.errors}
@@ -0,0 +1,163 @@
+"""Incremental nearest-neighbour index of the effects, for inverse queries.
+
+The effects are split into leaves of at most leaf_size points by median
+cuts along their widest dimension, as in a kd-tree, and the bounding box of
+each leaf is kept. A query computes, with numpy, a lower bound of the
+distance to every leaf from their boxes, and scans the leaves by increasing
+bound, until the bound exceeds the distance of the k-th nearest effect found.
+
+New effects are kept in a buffer, scanned linearly. Once it holds
+batch_size effects, the buffer is split into leaves of its own, and added to
+the existing ones without rebuilding them. All the leaves are rebuilt when
+the number of effects doubles, so that the leaves stay tight; the cost of
+the rebuilds is amortized over the additions.
+
+Queries can restrict the distance to some of the effect features: the
+projections of the boxes are still valid bounds.
+"""
+from __future__ import division
+
+import numpy as np
+
+
+class InverseIndex(object):
+    """Orders and their effects, indexed by effect"""
+
+    FIRST_LEAVES = 8 # leaves scanned before the others are filtered by their bound
+
+    def __init__(self, m_dim, s_dim, leaf_size = 64, batch_size = 4096):
+        self.m_dim, self.s_dim = m_dim, s_dim
+        self.leaf_size  = leaf_size
+        self.batch_size = batch_size
+
+        self._orders  = np.empty((0, m_dim))
+        self._effects = np.empty((0, s_dim))
+        self._n = 0
+
+        self._leaves = []                 # arrays of the indexes of the effects of each leaf
+        self._lo = np.empty((0, s_dim))   # bounding box of each leaf
+        self._hi = np.empty((0, s_dim))
+        self._indexed = 0                 # effects before are in leaves, the others in the buffer
+        self._built   = 0                 # number of effects at the last rebuild
+        self.scanned  = 0                 # number of effects compared by the last query
+
+    def __len__(self):
+        return self._n
+
+    @property
+    def orders(self):
+        return self._orders[:self._n]
+
+    @property
+    def effects(self):
+        return self._effects[:self._n]
+
+    def add(self, orders, effects):
+        """Add orders and their effects, arrays of shape (n, m_dim) and (n, s_dim)"""
+        orders  = np.asarray(orders,  dtype = float).reshape(-1, self.m_dim)
+        effects = np.asarray(effects, dtype = float).reshape(-1, self.s_dim)
+        end = self._n + len(effects)
+        if end > len(self._effects):
+            capacity = max(end, 2*len(self._effects), 1024)
+            self._orders  = np.resize(self._orders,  (capacity, self.m_dim))
+            self._effects = np.resize(self._effects, (capacity, self.s_dim))
+        self._orders[self._n:end]  = orders
+        self._effects[self._n:end] = effects
+        self._n = end
+
+        if self._n >= 2*self._built + self.batch_size:
+            self._rebuild()
+        elif self._n - self._indexed >= self.batch_size:
+            self._split(np.arange(self._indexed, self._n))
+            self._indexed = self._n
+
+    def _rebuild(self):
+        self._leaves = []
+        self._lo = np.empty((0, self.s_dim))
+        self._hi = np.empty((0, self.s_dim))
+        self._split(np.arange(self._n))
+        self._indexed = self._built = self._n
+
+    def _split(self, indexes):
+        """Split effects into leaves, by median cuts along their widest dimension"""
+        leaves, los, his = [], [], []
+        stack = [indexes]
+        while len(stack) > 0:
+            indexes = stack.pop()
+            points = self._effects[indexes]
+            lo, hi = points.min(axis = 0), points.max(axis = 0)
+            if len(indexes) <= self.leaf_size:
+                leaves.append(indexes)
+                los.append(lo)
+                his.append(hi)
+                continue
+            half = len(indexes)//2
+            order = np.argpartition(points[:, np.argmax(hi - lo)], half)
+            stack.append(indexes[order[:half]])
+            stack.append(indexes[order[half:]])
+        self._leaves += leaves
+        self._lo = np.vstack([self._lo] + los)
+        self._hi = np.vstack([self._hi] + his)
+
+    def nearest(self, effect, k = 1, feats = None):
+        """Return the indexes of the k effects nearest to effect, and their
+        distances, by increasing distance. If feats is not None, effect holds
+        the values of the features of index feats, and only those count."""
+        effect = np.asarray(effect, dtype = float)
+        if feats is not None:
+            feats = np.asarray(feats, dtype = int)
+
+        def distances(indexes):
+            # only the rows scanned are copied
+            points = self._effects[indexes]
+            if feats is not None:
+                points = points[:, feats]
+            self.scanned += len(indexes)
+            return np.sum((points - effect)**2, axis = 1)
+
+        # the buffer, scanned linearly
+        self.scanned = 0
+        best = np.arange(self._indexed, self._n)
+        best, best_d = self._top(best, distances(best), k)
+
+        if len(self._leaves) > 0:
+            lo, hi = (self._lo, self._hi) if feats is None else (self._lo[:, feats], self._hi[:, feats])
+            bounds = np.sum(np.maximum(0.0, np.maximum(lo - effect, effect - hi))**2, axis = 1)
+            # the nearest leaves are scanned first; then only the leaves that
+            # can still hold a nearer effect are sorted, rather than all of them
+            first = np.argsort(bounds) if len(bounds) <= self.FIRST_LEAVES else \
+                    np.argpartition(bounds, self.FIRST_LEAVES)[:self.FIRST_LEAVES]
+            first = first[np.argsort(bounds[first])]
+            for leaves in (first, None):
+                if leaves is None:
+                    if len(first) == len(bounds):
+                        break
+                    candidates = np.ones(len(bounds), dtype = bool)
+                    candidates[first] = False
+                    if len(best) == k:
+                        candidates &= bounds <= best_d[-1]
+                    leaves = np.flatnonzero(candidates)
+                    leaves = leaves[np.argsort(bounds[leaves])]
+                for leaf in leaves:
+                    if len(best) == k and bounds[leaf] > best_d[-1]:
+                        break
+                    indexes = self._leaves[leaf]
+                    d = distances(indexes)
+                    best, best_d = self._top(np.concatenate((best, indexes)), np.concatenate((best_d, d)), k)
+
+        return best, np.sqrt(best_d)
+
+    @staticmethod
+    def _top(indexes, distances, k):
+        """Return the k indexes of smallest distance, sorted"""
+        if len(distances) > k:
+            keep = np.argpartition(distances, k - 1)[:k]
+            indexes, distances = indexes[keep], distances[keep]
+        order = np.argsort(distances)
+        return indexes[order], distances[order]
+
+    def inverse(self, effect, k = 1, feats = None):
+        """Return the orders of the k effects nearest to effect, the effects,
+        and their distances"""
+        indexes, distances = self.nearest(effect, k = k, feats = feats)
+        return self._orders[indexes], self._effects[indexes], distances
@@ -0,0 +1,114 @@
+"""Analytic forward kinematics of the arm, computed in batch with numpy.
+
+When no toys are present, the final pose of the arm is set by the orders:
+each joint moves from its initial angle toward its target angle, at its
+maximum velocity, within the angle limits. The raw sensor readings are then
+those of the server: for each link, the position of its end and its
+absolute angle, from the base to the tip.
+
+The engine ignores the dynamics of the PID controller and of the solver;
+validate() measures the resulting error against the server.
+
+The engine is experimental, and BoxSim does not use it: the angle
+convention of forward() was written to match the python stand-in server,
+that was itself written to match, and it has not been checked against the
+java server yet. Against the stand-in, validate() is circular: run it with
+cfg.server = 'java' before relying on the engine.
+"""
+from __future__ import division
+
+import numpy as np
+
+import boxcom
+
+# the area of the java server, and the width of its walls (see InteractExp)
+AREA_SIZE = 800.0
+WALL_SIZE = 50.0
+
+ARM_SENSORS = ('arm', 'joints', 'angles', 'fullarm')
+
+
+def final_angles(orders, angle_limit, duration):
+    """Compute the angles of the joints at the end of the trials.
+
+    :param orders:    full motor orders, of shape (n, 3*armsize): initial
+                      angles, target angles and maximum velocities.
+    :param duration:  duration of the trials, in s, or array of the duration
+                      of each trial.
+    """
+    armsize = orders.shape[1]//3
+    init_pos    = np.clip(orders[:, :armsize], -angle_limit, angle_limit)
+    target_pos  = np.clip(orders[:, armsize:2*armsize], -angle_limit, angle_limit)
+    max_travel  = np.maximum(0.0, orders[:, 2*armsize:])*np.reshape(duration, (-1, 1))
+    return init_pos + np.clip(target_pos - init_pos, -max_travel, max_travel)
+
+def reachable_space(cfg):
+    """Return the bounds ((x_min, x_max), (y_min, y_max)) of the space the tip
+    of the arm can reach: the disk of the arm around its base, within the walls"""
+    reach = float(sum(cfg.arm_lengths))
+    return tuple((max(WALL_SIZE, base - reach), min(AREA_SIZE - WALL_SIZE, base + reach))
+                 for base in cfg.base_pos)
+
+def forward(angles, arm_lengths, base_pos):
+    """Compute the raw sensor readings of the arm, of shape (n, 3*armsize),
+    from the angles of the joints, of shape (n, armsize).
+    An angle of zero points the link upward, along +y."""
+    theta = np.cumsum(angles, axis = 1)
+    x = base_pos[0] - np.cumsum(np.asarray(arm_lengths)*np.sin(theta), axis = 1)
+    y = base_pos[1] + np.cumsum(np.asarray(arm_lengths)*np.cos(theta), axis = 1)
+
+    readings = np.empty((len(angles), 3*angles.shape[1]))
+    readings[:, 0::3] = x
+    readings[:, 1::3] = y
+    readings[:, 2::3] = np.arctan2(np.sin(theta), np.cos(theta))
+    return readings
+
+
+class KinematicEngine(object):
+    """Stand-in for the server, for arm-only sensors and configurations without toys"""
+
+    def __init__(self, cfg):
+        assert len(cfg.toy_order) == 0, "the kinematic engine can't simulate toys"
+        assert cfg.sensors in ARM_SENSORS, "the kinematic engine only provides {} sensors".format(', '.join(ARM_SENSORS))
+        self.cfg = cfg
+        self.duration = cfg.steps/boxcom.solver_conf(cfg)[0]
+        self.reachable_space = reachable_space(cfg)
+
+    def execute(self, orders):
+        """Return the raw sensor readings before and after each full motor order"""
+        orders = np.asarray(orders, dtype = float)
+        armsize = orders.shape[1]//3
+        init_pos = np.clip(orders[:, :armsize], -self.cfg.angle_limit, self.cfg.angle_limit)
+        end_pos  = final_angles(orders, self.cfg.angle_limit, self.duration)
+        return (forward(init_pos, self.cfg.arm_lengths, self.cfg.base_pos),
+                forward(end_pos,  self.cfg.arm_lengths, self.cfg.base_pos))
+
+
+def validate(cfg, n_orders = 100, seed = None):
+    """Compare the kinematic engine to the server on random orders.
+
+    Return a dict with the mean, max and 99th percentile of the absolute error
+    of each sensory feature, and of the euclidean distance between effects.
+    """
+    import boxctrl
+
+    server_sim = boxctrl.BoxSim(cfg.copy(deep = True))
+    try:
+        engine = KinematicEngine(server_sim.cfg)
+        random_state = np.random.RandomState(seed)
+        bounds = np.array(server_sim.m_bounds, dtype = float)
+        orders = bounds[:, 0] + random_state.random_sample((n_orders, len(bounds)))*(bounds[:, 1] - bounds[:, 0])
+        long_orders = server_sim.m_f(server_sim, orders)
+
+        effects = server_sim._effects_arrays(*engine.execute(long_orders))
+        error = np.abs(effects - server_sim.execute_orders(orders))
+    finally:
+        server_sim.close()
+
+    distance = np.sqrt(np.sum(error**2, axis = 1))
+    return {'n_orders'      : n_orders,
+            'mean_error'    : error.mean(axis = 0).tolist(),
+            'max_error'     : error.max(axis = 0).tolist(),
+            'mean_distance' : float(distance.mean()),
+            'p99_distance'  : float(np.percentile(distance, 99)),
+            'max_distance'  : float(distance.max())}
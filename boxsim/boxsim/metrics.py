@@ -0,0 +1,91 @@
+"""Counters and latency histograms of the simulation.
+
+Latencies are kept in histograms with logarithmic buckets, four per octave
+of microseconds, so that recording costs a few operations and no memory
+growth; percentiles are approximated by the upper bound of their bucket.
+"""
+from __future__ import division
+import math
+import time
+import json
+import threading
+
+N_BUCKETS = 4*40 # up to ~2**40 us, about 12 days
+
+
+class Histogram(object):
+
+    def __init__(self):
+        self.count   = 0
+        self.total   = 0.0
+        self.max     = 0.0
+        self.buckets = [0]*N_BUCKETS
+
+    def record(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        us = seconds*1e6
+        b = int(4*math.log(us, 2)) + 1 if us >= 1.0 else 0
+        self.buckets[min(b, N_BUCKETS - 1)] += 1
+
+    def percentile(self, q):
+        """Approximate q-th percentile, in s"""
+        if self.count == 0:
+            return None
+        rank, seen = q/100.0*self.count, 0
+        for b, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank and n > 0:
+                return min(self.max, 2**(b/4.0)*1e-6)
+        return self.max
+
+    def summary(self):
+        return {'count': self.count,
+                'total': self.total,
+                'mean' : self.total/self.count if self.count > 0 else None,
+                'p50'  : self.percentile(50),
+                'p99'  : self.percentile(99),
+                'max'  : self.max}
+
+
+class Metrics(object):
+    """Counters and latency histograms, by name.
+
+    If `path` is not None, the summary is written as json to `path`, at
+    most every `every` seconds, when metrics are recorded.
+    """
+
+    def __init__(self, path = None, every = 60.0):
+        self.path  = path
+        self.every = every
+
+        self.counters   = {}
+        self.histograms = {}
+        self._lock      = threading.Lock()
+        self._last_dump = time.time()
+
+    def count(self, name, n = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def record(self, name, seconds):
+        with self._lock:
+            h = self.histograms.get(name)
+            if h is None:
+                h = self.histograms[name] = Histogram()
+            h.record(seconds)
+        if self.path is not None and time.time() - self._last_dump > self.every:
+            self.dump()
+
+    def summary(self):
+        with self._lock:
+            return {'counters'  : dict(self.counters),
+                    'latencies' : dict((name, h.summary()) for name, h in self.histograms.items())}
+
+    def dump(self, path = None):
+        """Write the summary as json"""
+        self._last_dump = time.time()
+        with open(path or self.path, 'w') as f:
+            json.dump(self.summary(), f, indent = 2, sort_keys = True)
@@ -0,0 +1,382 @@
+# Dispatch of orders to simulations hosted on other machines.
+#
+# A worker hosts up to `capacity` simulations, one for each client
+# connection. RemoteBoxSim opens as many connections as the workers have
+# free capacity, and dispatches orders to whichever is free, as BoxSimPool
+# does with local servers. When a worker drops out or stops replying, its
+# connections are closed, and their orders are executed by the others.
+#
+# Usage: python remote.py PORT [--host HOST] [--capacity N]
+#
+# Messages use the sockit wire format (see wire.py):
+#   MSG_HELLO   out     int capacity, or MSG_ERROR if the worker is full
+#   MSG_CONF    in      int n, n bytes of utf-8 json of the configuration (see plain_cfg)
+#               out     int n, n bytes of utf-8 json of (m_feats, m_bounds, s_feats, s_bounds)
+#   MSG_ORDERS  in/out  int n, int width, block of n*width little-endian doubles
+#   MSG_ERROR   out     string, the error of the simulation
+#   MSG_BYE     in/out  void
+#
+# Only plain data is exchanged, so clients can't run code on the workers.
+# Workers listen on localhost by default; with --host, any client that
+# reaches the port can still run simulations on the worker.
+from __future__ import print_function, division
+import sys
+import socket
+import signal
+import json
+import argparse
+import threading
+import traceback
+import multiprocessing
+
+import numpy as np
+import treedict
+
+import wire
+import boxctrl
+import boxpool
+
+MSG_HELLO  = 0
+MSG_BYE    = 1
+MSG_ERROR  = 2
+MSG_CONF   = 4
+MSG_ORDERS = 12
+
+defaultcfg = treedict.TreeDict()
+defaultcfg.remote_timeout = 1000.0
+defaultcfg.remote_timeout_desc = 'maximum time (in s) to wait for a worker to execute an order, before it is dropped'
+defaultcfg.remote_launch_timeout = 120.0
+defaultcfg.remote_launch_timeout_desc = 'maximum time (in s) to wait for a worker to connect and launch its simulation'
+
+# Errors of a connection that mean the worker dropped out
+WORKER_ERRORS = (EOFError, EnvironmentError)
+
+_DOUBLES = np.dtype('<f8')
+
+
+class RemoteError(Exception):
+    """A worker could not execute a request, or no worker is available"""
+    pass
+
+
+def parse_address(address):
+    """Return the (host, port) of 'host:port' strings or (host, port) pairs"""
+    if isinstance(address, str):
+        host, port = address.rsplit(':', 1)
+        return host, int(port)
+    host, port = address
+    return host, int(port)
+
+def append_array(msg, array):
+    array = np.asarray(array, dtype = _DOUBLES)
+    msg.appendInt(array.shape[0])
+    msg.appendInt(array.shape[1])
+    msg.appendBytes(array.tobytes())
+
+def read_array(msg):
+    n, width = msg.readInt(), msg.readInt()
+    return np.frombuffer(msg.readBytes(n*width*_DOUBLES.itemsize), dtype = _DOUBLES).reshape(n, width)
+
+def to_plain(value):
+    """Return value as json data; tuples are tagged, to be restored as such"""
+    if isinstance(value, tuple):
+        return {'tuple': [to_plain(v) for v in value]}
+    if isinstance(value, list):
+        return [to_plain(v) for v in value]
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if value is None or isinstance(value, (bool, int, float, str)) or type(value).__name__ in ('unicode', 'long'):
+        return value
+    raise TypeError('{!r} can not be sent to a worker'.format(value))
+
+def from_plain(value):
+    if isinstance(value, dict):
+        return tuple(from_plain(v) for v in value['tuple'])
+    if isinstance(value, list):
+        return [from_plain(v) for v in value]
+    return value
+
+def plain_cfg(cfg):
+    """Return the json of the leaves of a configuration"""
+    return json.dumps(dict((key, to_plain(value)) for key, value in cfg.items()))
+
+def read_cfg(raw):
+    cfg = treedict.TreeDict()
+    for key, value in json.loads(raw).items():
+        cfg[str(key)] = from_plain(value)
+    return cfg
+
+def append_text(msg, text):
+    raw = text.encode('utf-8')
+    msg.appendInt(len(raw))
+    msg.appendBytes(raw)
+
+def read_text(msg):
+    return msg.readBytes(msg.readInt()).tobytes().decode('utf-8')
+
+def append_json(msg, obj):
+    append_text(msg, json.dumps(to_plain(obj)))
+
+def read_json(msg):
+    return from_plain(json.loads(read_text(msg)))
+
+
+    ## Worker ##
+
+class Worker(object):
+    """Host simulations for remote clients, one for each connection"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._slots = threading.Semaphore(capacity)
+        self._sims  = set()
+        self._lock  = threading.Lock()
+        self._stop  = threading.Event()
+
+    def stop(self):
+        """Make serve() return, closing the simulations; it can be called from a signal handler"""
+        self._stop.set()
+
+    def serve(self, port, host = '', poll = 0.2):
+        """Accept connections until stop() is called. accept() times out every
+        poll seconds to check for it, because a signal delivered to another
+        thread does not interrupt it."""
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind((host, port))
+        server.listen(socket.SOMAXCONN)
+        server.settimeout(poll)
+        print('READY {}'.format(port))
+        sys.stdout.flush()
+
+        try:
+            while not self._stop.is_set():
+                try:
+                    conn, addr = server.accept()
+                except socket.timeout:
+                    continue
+                conn.settimeout(None)
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                handler = threading.Thread(target = self.handle, args = (conn,))
+                handler.daemon = True
+                handler.start()
+        finally:
+            server.close()
+            with self._lock:
+                for sim in self._sims:
+                    sim.close()
+
+    def handle(self, conn):
+        """Serve a connection, hosting its simulation"""
+        if not self._slots.acquire(False):
+            reply = wire.OutboundMessage(MSG_ERROR)
+            reply.appendString('the worker is full ({} simulations)'.format(self.capacity))
+            wire.send(conn, reply)
+            conn.close()
+            return
+
+        sim = None
+        try:
+            while True:
+                msg = wire.receive(conn)
+                if msg.type == MSG_BYE:
+                    wire.send(conn, wire.OutboundMessage(MSG_BYE))
+                    return
+                try:
+                    reply, sim = self.process_message(msg, sim)
+                except Exception:
+                    reply = wire.OutboundMessage(MSG_ERROR)
+                    reply.appendString(traceback.format_exc()[-4000:])
+                wire.send(conn, reply)
+        except WORKER_ERRORS: # the client dropped out
+            pass
+        finally:
+            conn.close()
+            if sim is not None:
+                self._close_sim(sim)
+            self._slots.release()
+
+    def _close_sim(self, sim):
+        with self._lock:
+            self._sims.discard(sim)
+        sim.close()
+
+    def process_message(self, msg, sim):
+        """Process a message, and return the reply and the simulation of the connection"""
+        if msg.type == MSG_HELLO:
+            reply = wire.OutboundMessage(MSG_HELLO)
+            reply.appendInt(self.capacity)
+        elif msg.type == MSG_CONF:
+            if sim is not None:
+                self._close_sim(sim)
+                sim = None
+            cfg = read_cfg(read_text(msg))
+            cfg.verbose = False
+            sim = boxctrl.BoxSim(cfg)
+            with self._lock:
+                self._sims.add(sim)
+            reply = wire.OutboundMessage(MSG_CONF)
+            append_json(reply, (tuple(sim.m_feats), tuple(sim.m_bounds), tuple(sim.s_feats), tuple(sim.s_bounds)))
+        elif msg.type == MSG_ORDERS:
+            assert sim is not None, 'the simulation is not configured'
+            reply = wire.OutboundMessage(MSG_ORDERS)
+            append_array(reply, sim.execute_orders(read_array(msg)))
+        else:
+            raise ValueError('unrecognized message type ({})'.format(msg.type))
+        return reply, sim
+
+
+    ## Client ##
+
+class WorkerSlot(object):
+    """A connection to a worker, and the simulation it hosts for it"""
+
+    def __init__(self, address, timeout):
+        self.address = address
+        self.sock = socket.create_connection(address, timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            self.capacity = self._request(wire.OutboundMessage(MSG_HELLO), MSG_HELLO, timeout).readInt()
+        except Exception:
+            self.sock.close()
+            raise
+
+    def _request(self, msg, type_msg, timeout):
+        self.sock.settimeout(timeout)
+        wire.send(self.sock, msg)
+        reply = wire.receive(self.sock)
+        if reply.type == MSG_ERROR:
+            raise RemoteError('worker {}:{}: {}'.format(self.address[0], self.address[1], reply.readString()))
+        assert reply.type == type_msg
+        return reply
+
+    def configure(self, cfg, timeout):
+        msg = wire.OutboundMessage(MSG_CONF)
+        append_text(msg, plain_cfg(cfg))
+        self.m_feats, self.m_bounds, self.s_feats, self.s_bounds = read_json(self._request(msg, MSG_CONF, timeout))
+
+    def execute_orders(self, orders, timeout):
+        msg = wire.OutboundMessage(MSG_ORDERS)
+        append_array(msg, orders)
+        return read_array(self._request(msg, MSG_ORDERS, timeout*max(1, len(orders))))
+
+    def close(self):
+        try:
+            self.sock.settimeout(1.0)
+            wire.send(self.sock, wire.OutboundMessage(MSG_BYE))
+            wire.receive(self.sock)
+        except WORKER_ERRORS:
+            pass
+        self.sock.close()
+
+
+class RemoteBoxSim(boxpool.BoxSimPool):
+    """Dispatch orders to simulations hosted by workers on other machines
+
+    Workers are given as 'host:port' strings or (host, port) pairs. All
+    simulations receive the same configuration, so, as a BoxSimPool, it can
+    be wrapped by UniformizeSim and FilterSim. Orders are executed by the
+    first free simulation; those of a worker that drops out, or doesn't
+    reply within cfg.remote_timeout per order, are executed by the others.
+    """
+
+    def __init__(self, cfg, addresses):
+        assert len(addresses) >= 1
+        cfg.update(defaultcfg, overwrite = False)
+        self.addresses = [parse_address(address) for address in addresses]
+        self._lock = threading.Lock()
+
+        boxpool.BoxSimPool.__init__(self, cfg, len(self.addresses))
+        self.n_workers = len(self.sims)
+
+    def _launch_sims(self, n_workers):
+        """Open a connection for each free simulation of the workers, and
+        configure them in parallel"""
+        timeout = self.cfg.remote_launch_timeout
+        slots = []
+        for address in self.addresses:
+            try:
+                slot = WorkerSlot(address, timeout)
+                slots.append(slot)
+                for _ in range(slot.capacity - 1):
+                    slots.append(WorkerSlot(address, timeout))
+            except (RemoteError,) + WORKER_ERRORS as e: # full or unreachable
+                self._print_status("worker {}:{} unavailable: {}".format(address[0], address[1], e))
+
+        sims = []
+        def configure(slot):
+            try:
+                slot.configure(self.cfg, timeout)
+                with self._lock:
+                    sims.append(slot)
+            except Exception as e:
+                self._print_status("worker {}:{} could not be configured: {}".format(slot.address[0], slot.address[1], e))
+                slot.close()
+
+        threads = [threading.Thread(target = configure, args = (slot,)) for slot in slots]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        if len(sims) == 0:
+            raise RemoteError('no worker available among {}'.format(', '.join('{}:{}'.format(*a) for a in self.addresses)))
+        return sims
+
+    def _print_status(self, s):
+        if self.cfg.verbose:
+            print("{}sim{}: {}{}".format(boxpool.prefixcolor, boxpool.gfx.end, s, '\033[K'))
+
+    def _acquire(self):
+        """Return a free simulation, waiting for one if needed"""
+        while True:
+            with self._lock:
+                if len(self.sims) == 0:
+                    raise RemoteError('all the workers dropped out')
+            try:
+                return self._idle.get(timeout = 1.0)
+            except boxpool.queue.Empty:
+                pass
+
+    def _drop(self, slot, error):
+        with self._lock:
+            self.sims.remove(slot)
+        self._print_status("worker {}:{} dropped out ({}: {})".format(slot.address[0], slot.address[1],
+                                                                      type(error).__name__, error))
+        slot.sock.close()
+
+    def _execute_chunk(self, orders):
+        """Execute orders on the first free simulation, and on the next one if its worker drops out"""
+        orders = np.asarray(orders, dtype = float)
+        while True:
+            slot = self._acquire()
+            try:
+                effects = slot.execute_orders(orders, self.cfg.remote_timeout)
+            except WORKER_ERRORS as e:
+                self._drop(slot, e)
+                continue
+            except Exception:
+                self._idle.put(slot)
+                raise
+            self._idle.put(slot)
+            return effects
+
+    def _execute_one(self, order):
+        return tuple(self._execute_chunk([order])[0].tolist())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'host boxsim simulations for remote clients')
+    parser.add_argument('port', type = int)
+    parser.add_argument('--host', default = 'localhost',
+                        help = "interface to listen on; localhost by default, '' for all")
+    parser.add_argument('--capacity', type = int, default = multiprocessing.cpu_count(),
+                        help = 'maximum number of simulations hosted at once; the number of cpus by default')
+    args = parser.parse_args()
+
+    # close the simulations on termination
+    worker = Worker(args.capacity)
+    signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+    worker.serve(args.port, host = args.host)
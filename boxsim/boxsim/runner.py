@@ -0,0 +1,162 @@
+"""Streaming execution of orders into an append-only store on disk.
+
+A ResultStore is a directory holding the orders and the effects, each in a
+preallocated, memory-mapped file of float64 rows, and a json header. The
+header records the features and bounds of the simulation, and the number of
+committed rows; it is replaced atomically once the rows are flushed to disk,
+so that an interrupted run loses at most the rows of its last chunk. The
+configuration is pickled next to the header.
+
+run_orders() executes orders from any iterable, by chunks, with a BoxSim or
+any of its wrappers, and appends them to a store. Given a store with rows,
+it resumes the run: the orders already executed are skipped, and checked
+against the stored ones, so the iterable must yield the same orders again.
+"""
+from __future__ import division
+import os
+import json
+import pickle
+import itertools
+
+import numpy as np
+
+HEADER_FILE  = 'header.json'
+CFG_FILE     = 'cfg.pickle'
+ORDERS_FILE  = 'orders.f64'
+EFFECTS_FILE = 'effects.f64'
+
+_DOUBLES = np.dtype('<f8')
+
+
+class ResultStore(object):
+    """Orders and effects of a run, stored in memory-mapped files.
+
+    :param path:      directory of the store. If it holds a store, it is
+                      opened, and must match the features of the simulation.
+    :param sim:       a BoxSim or a wrapper; required to create a store.
+    :param capacity:  number of rows preallocated on creation; the files
+                      double in size when full.
+    """
+
+    def __init__(self, path, sim = None, capacity = 10000):
+        self.path = path
+        header_path = os.path.join(path, HEADER_FILE)
+        if os.path.exists(header_path):
+            with open(header_path) as f:
+                self.header = json.load(f)
+            if sim is not None and any(self.header[k] != v for k, v in self._sim_header(sim).items()):
+                raise ValueError('the store {} was created by a simulation with other features or bounds'.format(path))
+        else:
+            assert sim is not None, 'a simulation is needed to create the store {}'.format(path)
+            if not os.path.exists(path):
+                os.makedirs(path)
+            self.header = self._sim_header(sim)
+            self.header.update({'rows': 0, 'capacity': 0})
+            with open(os.path.join(path, CFG_FILE), 'wb') as f:
+                pickle.dump(sim.cfg, f, 2)
+        self.m_dim = len(self.header['m_feats'])
+        self.s_dim = len(self.header['s_feats'])
+
+        self.rows = self.header['rows']
+        self._orders = self._effects = None
+        self._map(self.header['capacity'] or max(1, capacity))
+        self.commit()
+
+    @staticmethod
+    def _sim_header(sim):
+        # through json, so that tuples compare equal to the lists of a loaded header
+        return json.loads(json.dumps({'m_feats' : sim.m_feats, 'm_bounds' : sim.m_bounds,
+                                      's_feats' : sim.s_feats, 's_bounds' : sim.s_bounds}))
+
+    def _map(self, capacity):
+        """Memory-map the files, extended to capacity rows if needed"""
+        for filename, dim in ((ORDERS_FILE, self.m_dim), (EFFECTS_FILE, self.s_dim)):
+            filepath = os.path.join(self.path, filename)
+            if not os.path.exists(filepath):
+                open(filepath, 'wb').close()
+            if os.path.getsize(filepath) < capacity*dim*_DOUBLES.itemsize:
+                with open(filepath, 'r+b') as f:
+                    f.truncate(capacity*dim*_DOUBLES.itemsize)
+        self._orders  = np.memmap(os.path.join(self.path, ORDERS_FILE),  dtype = _DOUBLES, mode = 'r+', shape = (capacity, self.m_dim))
+        self._effects = np.memmap(os.path.join(self.path, EFFECTS_FILE), dtype = _DOUBLES, mode = 'r+', shape = (capacity, self.s_dim))
+        self.header['capacity'] = capacity
+
+    @property
+    def capacity(self):
+        return self.header['capacity']
+
+    @property
+    def cfg(self):
+        """The configuration of the simulation that created the store"""
+        with open(os.path.join(self.path, CFG_FILE), 'rb') as f:
+            return pickle.load(f)
+
+    @property
+    def orders(self):
+        """Array of the committed orders; a view of the file, without copy"""
+        return self._orders[:self.header['rows']]
+
+    @property
+    def effects(self):
+        """Array of the committed effects; a view of the file, without copy"""
+        return self._effects[:self.header['rows']]
+
+    def append(self, orders, effects):
+        """Append rows to the store; they are saved by the next commit()"""
+        orders, effects = np.asarray(orders, dtype = float), np.asarray(effects, dtype = float)
+        assert len(orders) == len(effects)
+        end = self.rows + len(orders)
+        if end > self.capacity:
+            self._orders.flush()
+            self._effects.flush()
+            self._map(max(end, 2*self.capacity))
+        self._orders[self.rows:end]  = orders
+        self._effects[self.rows:end] = effects
+        self.rows = end
+
+    def commit(self):
+        """Flush the appended rows to disk, then record them in the header"""
+        self._orders.flush()
+        self._effects.flush()
+        self.header['rows'] = self.rows
+        header_path = os.path.join(self.path, HEADER_FILE)
+        with open(header_path + '.tmp', 'w') as f:
+            json.dump(self.header, f, indent = 2, sort_keys = True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(header_path + '.tmp', header_path)
+
+    def close(self):
+        self.commit()
+        self._orders = self._effects = None
+
+
+def run_orders(sim, orders, store, chunk_size = 100, verbose = False):
+    """Execute orders with the simulation, and append them and their effects
+    to the store, committing every chunk_size orders.
+
+    :param orders:  iterable of orders, consumed lazily. If the store already
+                    holds rows, the run is resumed: the first orders are
+                    skipped, and must equal the stored ones.
+    :param store:   a ResultStore, or the path of one, created if needed.
+    Return the store.
+    """
+    if not isinstance(store, ResultStore):
+        store = ResultStore(store, sim = sim)
+    orders = iter(orders)
+
+    done = store.orders
+    for start in range(0, len(done), chunk_size):
+        skipped = np.array(list(itertools.islice(orders, chunk_size)), dtype = float)
+        if not np.array_equal(skipped, done[start:start + chunk_size]):
+            raise ValueError('the orders differ from the {} orders already in the store; can\'t resume'.format(len(done)))
+
+    while True:
+        chunk = list(itertools.islice(orders, chunk_size))
+        if len(chunk) == 0:
+            break
+        store.append(chunk, sim.execute_orders(chunk))
+        store.commit()
+        if verbose:
+            print('{} orders executed'.format(store.rows))
+    return store
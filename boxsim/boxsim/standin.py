@@ -0,0 +1,311 @@
+# A python stand-in for the java simulation server, speaking the same protocol.
+# The physics is faked: the arm joints move toward their targets at their
+# maximum velocity, and toys don't move. Each step can be made to last a
+# given time, to emulate the cost of the physics.
+#
+# Like the java server, it hosts several worlds, addressed by the high bits of
+# the message types; the worlds are processed in turn, by a single thread.
+#
+# It listens on a TCP port (0 for any free port), or on a unix domain socket,
+# given an address unix:PATH, and prints the address on its READY line.
+#
+# Usage: python standin.py ADDRESS [THREADS] [--step-latency SECONDS]
+from __future__ import print_function, division
+import sys
+import math
+import time
+import struct
+import socket
+import argparse
+
+import wire
+
+MSG_HELLO     = 0
+MSG_BYE       = 1
+MSG_ERROR     = 2
+MSG_EXIT      = 3
+MSG_CONF      = 4
+MSG_RESET     = 5
+MSG_SENSOR    = 6
+MSG_ORDER     = 7
+MSG_STEP      = 8
+MSG_RESULT    = 9
+MSG_INVERSE   = 10
+MSG_DISPLAY   = 11
+MSG_BATCH     = 12
+
+UNIX_PREFIX = 'unix:'
+
+LOG_OFF, LOG_EVERY, LOG_RING = 0, 1, 2
+
+WORLD_SHIFT = 8
+TYPE_MASK   = (1 << WORLD_SHIFT) - 1
+
+AREA_SIZE = 800
+WALL_SIZE = 50
+
+
+class StandInExp(object):
+
+    def __init__(self, step_latency = 0.0, world = 0):
+        self.step_latency = step_latency
+        self.world        = world
+
+        self.step_freq    = 60.0
+        self.lengths      = [52.0]*6
+        self.angle_limit  = 2.0
+        self.base         = (AREA_SIZE/2, 80)
+        self.toys         = []
+        self.sensor_width = 8
+        self.settle_threshold = 0.0
+        self.settle_window    = 30
+        self.steps_run        = 0
+        self.step_time        = 0.0
+        self.log_mode         = LOG_EVERY
+        self.log_param        = 1
+
+        self.reset([0.0]*6)
+
+    def process_conf(self, msg):
+        self.step_freq = msg.readDouble()
+        msg.readInt(), msg.readInt(), msg.readInt() # solver iterations
+        n = msg.readInt()
+        self.lengths = [msg.readDouble() for _ in range(n)]
+        self.angle_limit = msg.readDouble()
+        self.base = (msg.readInt(), msg.readInt())
+        self.toys = []
+        for _ in range(msg.readInt()):
+            toy_type, x, y = msg.readInt(), msg.readInt(), msg.readInt()
+            width, friction, restitution, density = [msg.readDouble() for _ in range(4)]
+            self.toys.append((float(x), float(y)))
+        self.sensor_width = msg.readInt()
+        self.settle_threshold = msg.readDouble()
+        self.settle_window    = msg.readInt()
+        msg.readInt() # reset mode; resets are cheap here
+        self.log_mode  = msg.readInt()
+        self.log_param = max(1, msg.readInt())
+
+        reply = wire.OutboundMessage(MSG_CONF)
+        for v in (WALL_SIZE, AREA_SIZE - WALL_SIZE, WALL_SIZE, AREA_SIZE - WALL_SIZE):
+            reply.appendDouble(float(v))
+        return reply
+
+    def reset(self, init_pos):
+        self.angles  = [max(-self.angle_limit, min(self.angle_limit, a)) for a in init_pos]
+        self.targets = list(self.angles)
+        self.vels    = [0.0]*len(self.angles)
+        self.history = []
+        self.steps   = 0
+        self.rest_pos     = list(self.angles) # None once an order moved the joints
+        self.settle_after = 0
+
+    def log_sensors(self):
+        """Log the readings of the current step, following the logging policy"""
+        if self.log_mode == LOG_OFF or (self.log_mode == LOG_EVERY and self.steps % self.log_param != 0):
+            return
+        self.history.append(self.sensors())
+        if self.log_mode == LOG_RING and len(self.history) >= 2*self.log_param:
+            del self.history[:-self.log_param]
+
+    def sensors(self):
+        readings = []
+        x, y = self.base
+        theta = 0.0
+        for l_i, a_i in zip(self.lengths, self.angles):
+            theta += a_i
+            x, y = x - l_i*math.sin(theta), y + l_i*math.cos(theta)
+            readings += [x, y, math.atan2(math.sin(theta), math.cos(theta))]
+        for toy in self.toys:
+            readings += list(toy)
+        return readings
+
+    def step(self, n):
+        """Run at most n steps, stopping once the scene is at rest"""
+        start = time.time()
+        dt = 1.0/self.step_freq
+        max_delta = self.settle_threshold*dt
+        previous, still = None, 0
+
+        self.steps_run = 0
+        for _ in range(n):
+            self.log_sensors()
+            self.steps += 1
+            for i, (a_i, t_i, v_i) in enumerate(zip(self.angles, self.targets, self.vels)):
+                self.angles[i] = a_i + max(-v_i*dt, min(v_i*dt, t_i - a_i))
+            self.steps_run += 1
+
+            if self.settle_threshold > 0:
+                current = self.sensors()
+                if previous is not None and all(abs(c - p) <= max_delta for c, p in zip(current, previous)):
+                    still += 1
+                else:
+                    still = 0
+                previous = current
+                if still >= self.settle_window and self.steps >= self.settle_after:
+                    break
+        if self.step_latency > 0:
+            time.sleep(self.steps_run*self.step_latency)
+        self.step_time = time.time() - start
+
+    def append_block(self, msg, values):
+        fmt = '<{}{}'.format(len(values), 'f' if self.sensor_width == 4 else 'd')
+        msg.appendBytes(struct.pack(fmt, *values))
+
+    def append_sensors(self, msg):
+        readings = self.sensors()
+        msg.appendInt(len(readings))
+        msg.appendInt(self.sensor_width)
+        self.append_block(msg, readings)
+
+    def process_reset(self, msg):
+        n = msg.readInt()
+        self.reset([msg.readDouble() for _ in range(n)])
+
+    def process_order(self, msg):
+        n = msg.readInt()
+        order = [msg.readDouble() for _ in range(n)]
+        self.targets = [max(-self.angle_limit, min(self.angle_limit, t)) for t in order[0::2]]
+        self.vels    = order[1::2]
+        self.settle_after = self.steps + self.travel_steps()
+        self.rest_pos = None
+
+    def travel_steps(self):
+        """Number of steps the joints need to reach their targets at their
+        maximum velocities, as InteractExp.travelSteps"""
+        time_ = 0.0
+        for j, (t_j, v_j) in enumerate(zip(self.targets, self.vels)):
+            travel = self.angle_limit + abs(t_j) if self.rest_pos is None else abs(t_j - self.rest_pos[j])
+            if v_j > 0:
+                time_ = max(time_, travel/v_j)
+        return int(min(2**31 - 1, math.ceil(time_*self.step_freq)))
+
+    def send_legacy_result(self, conn):
+        """Send the whole history in a single message, as doubles, each row
+        preceded by its length, after the number and indices of the features"""
+        n_feats = len(self.sensors())
+        reply = wire.OutboundMessage(MSG_RESULT)
+        reply.appendInt(n_feats)
+        for i in range(n_feats):
+            reply.appendInt(i)
+        for row in self.history:
+            reply.appendInt(n_feats)
+            for v in row:
+                reply.appendDouble(v)
+        self.send(conn, reply)
+
+    def send_result(self, conn, msg):
+        if msg.length == 0:
+            return self.send_legacy_result(conn)
+        every, chunk_rows = max(1, msg.readInt()), max(1, msg.readInt())
+        history = self.history[-self.log_param:] if self.log_mode == LOG_RING else self.history
+        rows = history[::every]
+        n_feats = len(rows[0]) if len(rows) > 0 else len(self.sensors())
+        start = 0
+        while True:
+            n = min(chunk_rows, len(rows) - start)
+            chunk = wire.OutboundMessage(MSG_RESULT)
+            for v in (len(rows), start, n, n_feats, self.sensor_width):
+                chunk.appendInt(v)
+            for row in rows[start:start + n]:
+                self.append_block(chunk, row)
+            self.send(conn, chunk)
+            start += n
+            if start >= len(rows):
+                return
+
+    def send(self, conn, msg):
+        msg.type |= self.world << WORLD_SHIFT
+        wire.send(conn, msg)
+
+    def process_message(self, conn, msg):
+        """Process a message, and return False if the connection should be closed"""
+        if msg.type in (MSG_HELLO, MSG_BYE):
+            self.send(conn, wire.OutboundMessage(msg.type))
+            return msg.type != MSG_BYE
+        elif msg.type == MSG_EXIT:
+            self.send(conn, wire.OutboundMessage(MSG_EXIT))
+            sys.exit(0)
+        elif msg.type == MSG_CONF:
+            self.send(conn, self.process_conf(msg))
+        elif msg.type == MSG_RESET:
+            self.process_reset(msg)
+            reply = wire.OutboundMessage(MSG_SENSOR)
+            self.append_sensors(reply)
+            self.send(conn, reply)
+        elif msg.type == MSG_ORDER:
+            self.process_order(msg)
+            self.send(conn, wire.OutboundMessage(MSG_ORDER))
+        elif msg.type == MSG_STEP:
+            self.step(msg.readInt())
+            reply = wire.OutboundMessage(MSG_STEP)
+            reply.appendInt(self.steps_run)
+            reply.appendDouble(self.step_time)
+            self.send(conn, reply)
+        elif msg.type == MSG_SENSOR:
+            reply = wire.OutboundMessage(MSG_SENSOR)
+            self.append_sensors(reply)
+            self.send(conn, reply)
+        elif msg.type == MSG_RESULT:
+            self.send_result(conn, msg)
+        elif msg.type == MSG_INVERSE:
+            msg.readBoolean() # there is no mouse, so no inverse requests
+        elif msg.type == MSG_BATCH:
+            reply = wire.OutboundMessage(MSG_BATCH)
+            n = msg.readInt()
+            reply.appendInt(n)
+            for _ in range(n):
+                self.process_reset(msg)
+                self.append_sensors(reply)
+                self.process_order(msg)
+                self.step(msg.readInt())
+                self.append_sensors(reply)
+                reply.appendInt(self.steps_run)
+                reply.appendDouble(self.step_time)
+            self.send(conn, reply)
+        else:
+            print('ERROR : Unrecognized message type ({}).'.format(msg.type))
+        return True
+
+    def serve(self, address):
+        if address.startswith(UNIX_PREFIX):
+            server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            server.bind(address[len(UNIX_PREFIX):])
+        else:
+            server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            server.bind(('localhost', int(address)))
+            address = server.getsockname()[1]
+        server.listen(1)
+        print('READY {}'.format(address))
+        sys.stdout.flush()
+
+        while True:
+            conn, addr = server.accept()
+            if server.family == socket.AF_INET:
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            worlds = {0: self}
+            try:
+                while len(worlds) > 0:
+                    msg = wire.receive(conn)
+                    world = msg.type >> WORLD_SHIFT
+                    msg.type &= TYPE_MASK
+                    if world not in worlds:
+                        worlds[world] = StandInExp(self.step_latency, world)
+                    if not worlds[world].process_message(conn, msg):
+                        del worlds[world]
+            except EOFError:
+                pass
+            finally:
+                conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'python stand-in for the java simulation server')
+    parser.add_argument('address', help = 'port to listen on, 0 for any free port, or unix:PATH')
+    parser.add_argument('threads', type = int, nargs = '?', default = 1,
+                        help = 'accepted for compatibility with the java server; the worlds share one thread')
+    parser.add_argument('--step-latency', type = float, default = 0.0,
+                        help = 'duration of each simulation step, in seconds')
+    args = parser.parse_args()
+
+    StandInExp(step_latency = args.step_latency).serve(args.address)
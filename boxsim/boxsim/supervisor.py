@@ -0,0 +1,227 @@
+"""Supervision of the simulation servers, for long runs.
+
+A Supervisor stands in for the BoxCom of a simulation. When a request fails
+because the server exited, closed the connection, replied out of protocol
+or did not reply within cfg.reply_timeout, the server is killed, a fresh one
+is launched and configured, and the request is run again, up to
+cfg.max_restarts times in a row. Between requests, the server process is
+polled, and, if cfg.max_server_memory is set, servers whose memory grew past
+it are replaced by fresh ones.
+"""
+from __future__ import division
+import os
+import time
+import threading
+
+import treedict
+from concurrent.futures import Future
+
+import boxcom
+
+defaultcfg = treedict.TreeDict()
+defaultcfg.max_restarts = 3
+defaultcfg.max_restarts_desc = 'maximum number of consecutive server restarts for a single request, before its error is raised'
+defaultcfg.max_server_memory = None
+defaultcfg.max_server_memory_desc = ('if not None, servers whose resident memory exceeds this many MB are replaced by '
+                                     'fresh ones between requests')
+defaultcfg.memory_check_every = 10.0
+defaultcfg.memory_check_every_desc = 'minimum duration (in s) between two measures of the memory of the server'
+
+COUNTERS = ('trials_run', 'steps_requested', 'steps_run')
+
+
+def group_memory(pgid):
+    """Return the resident memory (in bytes) of the processes of a process
+    group, or None if it can't be measured (no /proc filesystem)"""
+    try:
+        pids = [pid for pid in os.listdir('/proc') if pid.isdigit()]
+    except OSError:
+        return None
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    total = 0
+    for pid in pids:
+        try:
+            with open('/proc/{}/stat'.format(pid)) as f:
+                # fields after the command name, that may contain spaces
+                fields = f.read().rsplit(')', 1)[1].split()
+        except (IOError, OSError, IndexError): # the process exited
+            continue
+        if int(fields[2]) == pgid:
+            total += int(fields[21])*page_size
+    return total
+
+
+class Supervisor(object):
+    """Run the requests of a simulation on a server, replacing the server when
+    it crashes, stalls, or uses too much memory"""
+
+    def __init__(self, sim):
+        self.bind(sim)
+
+        self.conf = None
+        self.restarts = 0
+        self.recycles = 0
+        self._retired = dict((name, 0) for name in COUNTERS)
+        self._lock = threading.RLock()
+        self._last_check = time.time()
+
+        self.com = boxcom.acquire(sim)
+
+    def bind(self, sim):
+        """Attach the supervisor, and its server, to a simulation"""
+        self.sim = sim
+        self.cfg = sim.cfg
+        self.cfg.update(defaultcfg, overwrite = False)
+        self.metrics = getattr(sim, 'metrics', None)
+        if getattr(self, 'com', None) is not None:
+            self.com.bind(sim)
+
+    @property
+    def launch_time(self):
+        return self.com.launch_time
+
+    @property
+    def trials_run(self):
+        return self._retired['trials_run'] + self.com.trials_run
+
+    @property
+    def steps_requested(self):
+        return self._retired['steps_requested'] + self.com.steps_requested
+
+    @property
+    def steps_run(self):
+        return self._retired['steps_run'] + self.com.steps_run
+
+    def stats(self):
+        return {'restarts': self.restarts, 'recycles': self.recycles}
+
+
+    ## Replacement of the server ##
+
+    def _replace(self, com):
+        """Launch a fresh server, configured as the one it replaces"""
+        new_com = boxcom.launch(self.sim)
+        if self.conf is not None:
+            new_com.send_conf(self.conf)
+        for name in COUNTERS:
+            self._retired[name] += getattr(com, name)
+        self.com = new_com
+
+    def _restart(self, com, error, attempt):
+        """Replace a failed server, unless it was already replaced, or the
+        request failed too many times"""
+        with self._lock:
+            if com is not self.com:
+                return
+            com.kill()
+            if attempt >= self.cfg.max_restarts:
+                raise error
+            com.print_status("server failed ({}: {}), restarting it".format(type(error).__name__, error))
+            self._replace(com)
+            self.restarts += 1
+            if self.metrics is not None:
+                self.metrics.count('server.restarts')
+
+    def _recycle(self, com, memory):
+        """Replace a server that uses too much memory, once its pending requests are done"""
+        with self._lock:
+            if com is not self.com:
+                return
+            com.print_status("server uses {:.0f}MB, replacing it".format(memory/2**20))
+            self._replace(com)
+            self.recycles += 1
+            if self.metrics is not None:
+                self.metrics.count('server.recycles')
+        closing = threading.Thread(target = com.close)
+        closing.daemon = True
+        closing.start()
+
+    def _checked_com(self):
+        """Return the current server, after replacing it if it exited or uses too much memory"""
+        com = self.com
+        if com.simproc.poll() is not None:
+            self._restart(com, boxcom.ServerError("the server exited (return code {})".format(com.simproc.returncode)), 0)
+        elif self.cfg.max_server_memory is not None and time.time() - self._last_check >= self.cfg.memory_check_every:
+            self._last_check = time.time()
+            memory = group_memory(com.simproc.pid)
+            if memory is not None and memory > self.cfg.max_server_memory*2**20:
+                self._recycle(com, memory)
+        return self.com
+
+
+    ## Requests ##
+
+    def _call(self, name, *args):
+        """Run a request, restarting the server and running it again when the server fails"""
+        attempt = 0
+        while True:
+            com = self._checked_com()
+            try:
+                return getattr(com, name)(*args)
+            except boxcom.SERVER_ERRORS as e:
+                self._restart(com, e, attempt)
+                attempt += 1
+
+    def _call_async(self, name, args, attempt = 0):
+        """Submit an asynchronous request, and return a future of its result,
+        that is submitted again to a fresh server if the server fails"""
+        com = self._checked_com()
+        future = Future()
+
+        def copy(retry):
+            try:
+                future.set_result(retry.result())
+            except Exception as e:
+                future.set_exception(e)
+
+        def done(submitted):
+            try:
+                future.set_result(submitted.result())
+            except boxcom.SERVER_ERRORS as e:
+                # called by the pipeline thread of the failed server.
+                try:
+                    self._restart(com, e, attempt)
+                    retry = self._call_async(name, args, attempt + 1)
+                except Exception as e:
+                    future.set_exception(e)
+                else:
+                    retry.add_done_callback(copy)
+            except Exception as e:
+                future.set_exception(e)
+
+        getattr(com, name)(*args).add_done_callback(done)
+        return future
+
+    def conf_message(self, conf):
+        return self.com.conf_message(conf)
+
+    def send_conf(self, conf):
+        self.conf = list(conf)
+        return self._call('send_conf', conf)
+
+    def send_order(self, init_pos, order, nsteps, conf):
+        return self._call('send_order', init_pos, order, nsteps, conf)
+
+    def send_orders(self, trials):
+        return self._call('send_orders', trials)
+
+    def send_order_trajectory(self, init_pos, order, nsteps, conf, every = 1, chunk_rows = 1000):
+        return self._call('send_order_trajectory', init_pos, order, nsteps, conf, every, chunk_rows)
+
+    def send_order_async(self, init_pos, order, nsteps, conf):
+        return self._call_async('send_order_async', (init_pos, order, nsteps, conf))
+
+    def send_order_trajectory_async(self, init_pos, order, nsteps, conf, every = 1, chunk_rows = 1000):
+        return self._call_async('send_order_trajectory_async', (init_pos, order, nsteps, conf, every, chunk_rows))
+
+    def receive_inverse_request(self):
+        return self.com.receive_inverse_request()
+
+    def ping(self):
+        return self._call('ping')
+
+    def close(self):
+        if self.cfg.reuse_server:
+            boxcom.release(self.com)
+        else:
+            self.com.close()
@@ -0,0 +1,189 @@
+"""Encoding and decoding of the sockit wire format.
+
+A message is a header of two big-endian int32, the total length of the
+message (header included) and the message type, followed by the content.
+The content is a sequence of big-endian values, written and read in an
+order agreed upon by both sides: int32, float64 (double), boolean (one
+byte), and strings (java's writeUTF: uint16 length + utf-8 bytes).
+
+TCPClient and UnixClient speak it on TCP and unix domain sockets. Their
+messages hand back blocks of their content without copy (readBytes), that
+sockit's messages can't.
+"""
+import socket
+import struct
+
+HEADER_SIZE = 8
+
+_INT    = struct.Struct('>i')
+_LONG   = struct.Struct('>q')
+_DOUBLE = struct.Struct('>d')
+_FLOAT  = struct.Struct('>f')
+_HEADER = struct.Struct('>ii')
+
+
+class InboundMessage(object):
+    """A received message, read sequentially"""
+
+    def __init__(self, type, content):
+        self.type    = type
+        self.content = content
+        self.length  = len(content)
+        self.cursor  = 0
+
+    def _read(self, fmt):
+        value, = fmt.unpack_from(self.content, self.cursor)
+        self.cursor += fmt.size
+        return value
+
+    def readInt(self):
+        return self._read(_INT)
+
+    def readLong(self):
+        return self._read(_LONG)
+
+    def readDouble(self):
+        return self._read(_DOUBLE)
+
+    def readFloat(self):
+        return self._read(_FLOAT)
+
+    def readBoolean(self):
+        value = self.content[self.cursor:self.cursor + 1] != b'\x00'
+        self.cursor += 1
+        return value
+
+    def readString(self):
+        n = self._read(struct.Struct('>H'))
+        value = self.content[self.cursor:self.cursor + n].decode('utf-8')
+        self.cursor += n
+        return value
+
+    def readBytes(self, n):
+        """Return the next n bytes of the content, without copy"""
+        value = memoryview(self.content)[self.cursor:self.cursor + n]
+        self.cursor += n
+        return value
+
+    def resetCursor(self):
+        self.cursor = 0
+
+    def remaining(self):
+        return self.length - self.cursor
+
+
+class OutboundMessage(object):
+    """A message to send, written sequentially"""
+
+    def __init__(self, type):
+        self.type = type
+        self._parts = []
+
+    def appendInt(self, value):
+        self._parts.append(_INT.pack(value))
+
+    def appendLong(self, value):
+        self._parts.append(_LONG.pack(value))
+
+    def appendDouble(self, value):
+        self._parts.append(_DOUBLE.pack(value))
+
+    def appendFloat(self, value):
+        self._parts.append(_FLOAT.pack(value))
+
+    def appendBoolean(self, value):
+        self._parts.append(b'\x01' if value else b'\x00')
+
+    def appendString(self, value):
+        raw = value.encode('utf-8')
+        self._parts.append(struct.pack('>H', len(raw)) + raw)
+
+    def appendBytes(self, raw):
+        self._parts.append(bytes(raw))
+
+    def getBytes(self):
+        content = b''.join(self._parts)
+        return _HEADER.pack(HEADER_SIZE + len(content), self.type) + content
+
+
+def _recv_exactly(sock, n):
+    buf = bytearray(n)
+    view = memoryview(buf)
+    received = 0
+    while received < n:
+        k = sock.recv_into(view[received:], n - received)
+        if k == 0:
+            raise EOFError('connection closed')
+        received += k
+    return buf
+
+
+def receive(sock):
+    """Receive a message from a socket"""
+    length, type = _HEADER.unpack(bytes(_recv_exactly(sock, HEADER_SIZE)))
+    content = _recv_exactly(sock, length - HEADER_SIZE)
+    return InboundMessage(type, bytes(content))
+
+
+def send(sock, msg):
+    sock.sendall(msg.getBytes())
+
+
+class SocketClient(object):
+    """A client with the interface of sockit's Client; subclasses connect it"""
+
+    def __init__(self):
+        self.sock = None
+        self.port = None # the port or path, for messages
+
+    def _connect(self, family, address):
+        try:
+            self.sock = socket.socket(family, socket.SOCK_STREAM)
+            self.sock.connect(address)
+            return True
+        except socket.error:
+            self.disconnect()
+            return False
+
+    def disconnect(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def send(self, msg):
+        if self.sock is None:
+            raise EOFError("not connected")
+        send(self.sock, msg)
+
+    def receive(self, timeout = None):
+        """Return the next message, or None after timeout seconds"""
+        if self.sock is None:
+            raise EOFError("not connected")
+        self.sock.settimeout(timeout)
+        try:
+            return receive(self.sock)
+        except socket.timeout:
+            return None
+
+    def sendAndReceive(self, msg, timeout = None):
+        self.send(msg)
+        return self.receive(timeout)
+
+
+class TCPClient(SocketClient):
+    """A client on a TCP connection"""
+
+    def connect(self, host, port):
+        self.port = port
+        if not self._connect(socket.AF_INET, (host, port)):
+            return False
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return True
+
+
+class UnixClient(SocketClient):
+    """A client on a unix domain socket"""
+
+    def connect(self, path):
+        self.port = path
+        return self._connect(socket.AF_UNIX, path)
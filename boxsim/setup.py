@@ -1,4 +1,5 @@
 import os
+import sys
 from setuptools import setup
 
 # Utility function to read the README file.
@@ -18,6 +19,8 @@ setup(
     keywords = "simulation java",
     url = "flowers.inria.fr",
     packages=['boxsim'],
+    # concurrent.futures is in the standard library from python 3.2
+    install_requires=['futures'] if sys.version_info[0] < 3 else [],
     classifiers=[],
     package_data={'boxsim': ['interact.jar']},
 )
\ No newline at end of file
@@ -0,0 +1,43 @@
+"""Query time of the inverse index as it grows.
+
+For each size, random effects are added to the index, and the mean time of
+nearest-neighbour queries is reported, with the mean number of effects they
+compared. Both should grow much slower than the size of the index.
+
+    python bench_inverse.py --dim 18 --sizes 10000 100000 1000000
+"""
+from __future__ import print_function, division
+import testenv
+import time
+import argparse
+
+import numpy as np
+
+from boxsim import inverse
+
+
+def run(args):
+    np.random.seed(args.seed)
+    index = inverse.InverseIndex(2, args.dim)
+    print('{:>10} {:>12} {:>12}'.format('size', 'ms/query', 'scanned'))
+    for size in args.sizes:
+        n = size - len(index)
+        index.add(np.random.uniform(size = (n, 2)), np.random.uniform(0.0, 800.0, (n, args.dim)))
+        targets = np.random.uniform(0.0, 800.0, (args.queries, args.dim))
+        scanned = 0
+        start = time.time()
+        for target in targets:
+            index.nearest(target, k = args.k)
+            scanned += index.scanned
+        elapsed = time.time() - start
+        print('{:>10} {:>12.3f} {:>12.0f}'.format(size, 1000*elapsed/args.queries, scanned/args.queries))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'query time of the inverse index as it grows')
+    parser.add_argument('--dim', type = int, default = 2, help = 'number of effect features')
+    parser.add_argument('--sizes', type = int, nargs = '+', default = [10000, 100000, 1000000])
+    parser.add_argument('--queries', type = int, default = 200)
+    parser.add_argument('--k', type = int, default = 1)
+    parser.add_argument('--seed', type = int, default = 0)
+    run(parser.parse_args())
@@ -0,0 +1,196 @@
+"""Protocol-level benchmarks: startup time, message latency, and orders
+throughput of BoxSim, the wrappers, and the batched and parallel modes.
+
+The real server is used when the jar exists, the python stand-in otherwise
+(or as chosen by --server). Results are printed, and written as json with
+--output; --compare prints the change relative to a previous output.
+
+    python bench_protocol.py --output before.json
+    python bench_protocol.py --compare before.json
+"""
+from __future__ import print_function, division
+import testenv
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import subprocess
+
+import numpy as np
+
+import boxsim
+from boxsim import boxcom
+from common import cfg
+
+
+def percentiles(latencies):
+    """Return p50 and p99 of a list of latencies, in ms"""
+    if len(latencies) == 0:
+        return None, None
+    return (1000*float(np.percentile(latencies, 50)),
+            1000*float(np.percentile(latencies, 99)))
+
+def record(n, total, latencies):
+    p50, p99 = percentiles(latencies)
+    return {'n': n, 'total': total, 'throughput': n/total if total > 0 else None,
+            'p50_ms': p50, 'p99_ms': p99}
+
+def random_orders(sim, n):
+    return [[random.uniform(b_min, b_max) for b_min, b_max in sim.m_bounds] for _ in range(n)]
+
+def timed_calls(f, args):
+    latencies = []
+    start = time.time()
+    for a in args:
+        t = time.time()
+        f(a)
+        latencies.append(time.time() - t)
+    return time.time() - start, latencies
+
+
+def bench_startup(bench_cfg, repeat):
+    latencies = []
+    for _ in range(repeat):
+        box = boxsim.BoxSim(bench_cfg.copy(deep = True))
+        latencies.append(box._boxcom.launch_time)
+        box.close()
+    return record(repeat, sum(latencies), latencies)
+
+def bench_hello(box, n):
+    total, latencies = timed_calls(lambda _: box._boxcom.ping(), range(n))
+    return record(n, total, latencies)
+
+def bench_send_order(box, n, nsteps):
+    """Round trips of BoxCom.send_order: four messages, and nsteps steps"""
+    a = box.armsize
+    orders = [box._split_order([0.0]*a + [random.uniform(-1.0, 1.0) for _ in range(a)] + [1.0]*a)
+              for _ in range(n)]
+    total, latencies = timed_calls(lambda order: box._boxcom.send_order(order[0], order[1], nsteps, box.conf), orders)
+    return record(n, total, latencies)
+
+def bench_execute_order(sim, n):
+    orders = random_orders(sim, n)
+    total, latencies = timed_calls(lambda order: sim.execute_order(order, verbose = False), orders)
+    return record(n, total, latencies)
+
+def bench_trajectory(sim, n):
+    """Orders with their trajectory: the decoding of the sensor history"""
+    orders = random_orders(sim, n)
+    total, latencies = timed_calls(lambda order: sim.execute_order(order, verbose = False, trajectory = True), orders)
+    return record(n, total, latencies)
+
+def bench_execute_orders(sim, n, batch_size):
+    batches = [random_orders(sim, batch_size) for _ in range(max(1, n//batch_size))]
+    total, latencies = timed_calls(sim.execute_orders, batches)
+    return record(batch_size*len(batches), total, latencies)
+
+def bench_async(sim, n):
+    orders = random_orders(sim, n)
+    latencies, lock = [], threading.Lock()
+
+    def done(t):
+        def callback(future):
+            with lock:
+                latencies.append(time.time() - t)
+        return callback
+
+    start = time.time()
+    futures = []
+    for order in orders:
+        future = sim.execute_order_async(order)
+        future.add_done_callback(done(time.time()))
+        futures.append(future)
+    for future in futures:
+        future.result()
+    return record(n, time.time() - start, latencies)
+
+
+def commit_hash():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd = os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def server_type(choice):
+    if choice != 'auto':
+        return choice
+    jar_file = os.path.join(os.path.dirname(boxcom.__file__), 'interact.jar')
+    return 'java' if os.path.isfile(jar_file) else 'standin'
+
+
+def run(args):
+    bench_cfg = cfg.copy(deep = True)
+    bench_cfg.verbose = False
+    bench_cfg.server  = server_type(args.server)
+    bench_cfg.transport = args.transport
+    bench_cfg.standin_step_latency = args.step_latency
+
+    results = {}
+    def report(name, r):
+        results[name] = r
+        print('{:<24} {:>9.1f} calls/s   p50 {:>8.2f} ms   p99 {:>8.2f} ms'.format(
+              name, r['throughput'] or 0.0, r['p50_ms'] or 0.0, r['p99_ms'] or 0.0))
+        sys.stdout.flush()
+
+    report('startup', bench_startup(bench_cfg, args.startups))
+
+    box = boxsim.BoxSim(bench_cfg.copy(deep = True))
+    try:
+        report('hello', bench_hello(box, 10*args.orders))
+        report('send_order_1step', bench_send_order(box, args.orders, 1))
+        report('execute_order', bench_execute_order(box, args.orders))
+        report('trajectory', bench_trajectory(box, args.orders))
+        report('uniformize_filter', bench_execute_order(
+               boxsim.UniformizeSim(boxsim.FilterSim(box, s_feats = box.s_feats)), args.orders))
+        report('execute_orders', bench_execute_orders(box, args.orders, box.cfg.batch_size))
+        report('execute_order_async', bench_async(box, args.orders))
+    finally:
+        box.close()
+
+    if args.workers > 1:
+        pool = boxsim.BoxSimPool(bench_cfg.copy(deep = True), args.workers)
+        try:
+            report('pool_execute_orders', bench_execute_orders(pool, args.orders, args.orders))
+        finally:
+            pool.close()
+
+    return {'commit': commit_hash(), 'server': bench_cfg.server, 'transport': bench_cfg.transport,
+            'step_latency': args.step_latency, 'steps': bench_cfg.steps,
+            'workers': args.workers, 'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'results': results}
+
+def compare(previous, current):
+    print('\nchange relative to {} ({} server):'.format(previous['commit'], previous['server']))
+    for name, r in sorted(current['results'].items()):
+        p = previous['results'].get(name)
+        if p is None or not p['throughput'] or not r['throughput']:
+            continue
+        print('{:<24} throughput {:+6.1f}%   p50 {:+6.1f}%'.format(name,
+              100*(r['throughput']/p['throughput'] - 1),
+              100*(r['p50_ms']/p['p50_ms'] - 1) if p['p50_ms'] else 0.0))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'protocol-level benchmarks of boxsim')
+    parser.add_argument('--server', choices = ('auto', 'java', 'standin'), default = 'auto')
+    parser.add_argument('--transport', choices = ('tcp', 'unix'), default = 'tcp')
+    parser.add_argument('--step-latency', type = float, default = 0.0,
+                        help = 'duration of a step of the stand-in server, in seconds')
+    parser.add_argument('--orders', type = int, default = 200)
+    parser.add_argument('--startups', type = int, default = 3)
+    parser.add_argument('--workers', type = int, default = 4)
+    parser.add_argument('--output', help = 'write the results as json to this file')
+    parser.add_argument('--compare', help = 'json file of previous results to compare to')
+    args = parser.parse_args()
+
+    current = run(args)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent = 2, sort_keys = True)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            compare(json.load(f), current)
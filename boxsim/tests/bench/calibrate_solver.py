@@ -0,0 +1,95 @@
+"""Speed and accuracy of the solver presets (cfg.solver).
+
+The same random orders are run with each preset. For each, the wall time
+per order is reported, and the error of the effects relative to the effects
+of the 'precise' preset: the distance between the effect vectors, and the
+largest difference of any feature, relative to its range.
+
+    python calibrate_solver.py --orders 200 --output solver.json
+"""
+from __future__ import print_function, division
+import testenv
+import sys
+import json
+import time
+import random
+import argparse
+
+import numpy as np
+
+import boxsim
+from boxsim import boxcom
+from common import cfg
+from bench_protocol import server_type, commit_hash
+
+REFERENCE = 'precise'
+
+
+def run_preset(preset_cfg, orders):
+    """Return the effects of the orders, and the wall time taken"""
+    box = boxsim.BoxSim(preset_cfg)
+    try:
+        start = time.time()
+        effects = box.execute_orders(orders)
+        return np.asarray(effects, dtype = float), time.time() - start, box.s_bounds
+    finally:
+        box.close()
+
+def errors(effects, reference, s_bounds):
+    distances = np.sqrt(np.sum((effects - reference)**2, axis = 1))
+    ranges = np.array([b_max - b_min for b_min, b_max in s_bounds], dtype = float)
+    relative = np.max(np.abs(effects - reference)/np.where(ranges > 0, ranges, 1.0), axis = 1)
+    return {'mean': float(np.mean(distances)), 'p99': float(np.percentile(distances, 99)),
+            'max': float(np.max(distances)), 'max_relative': float(np.max(relative))}
+
+def run(args):
+    calib_cfg = cfg.copy(deep = True)
+    calib_cfg.verbose = False
+    calib_cfg.server  = server_type(args.server)
+    if args.steps is not None:
+        calib_cfg.steps = args.steps
+
+    random.seed(args.seed)
+    box = boxsim.BoxSim(calib_cfg.copy(deep = True))
+    orders = [[random.uniform(b_min, b_max) for b_min, b_max in box.m_bounds] for _ in range(args.orders)]
+    box.close()
+
+    presets = sorted(boxcom.SOLVER_PRESETS, key = lambda name: boxcom.SOLVER_PRESETS[name][1:])
+    runs = {}
+    for preset in presets:
+        preset_cfg = calib_cfg.copy(deep = True)
+        preset_cfg.solver = preset
+        runs[preset] = run_preset(preset_cfg, orders)
+
+    reference, ref_time, s_bounds = runs[REFERENCE]
+    results = {}
+    print('{:<10} {:>14} {:>9} {:>12} {:>12} {:>12} {:>10}'.format(
+          'preset', 'ms/order', 'speedup', 'err mean', 'err p99', 'err max', 'rel max'))
+    for preset in presets:
+        effects, total, _ = runs[preset]
+        r = errors(effects, reference, s_bounds)
+        r.update({'solver': boxcom.SOLVER_PRESETS[preset], 'ms_per_order': 1000*total/len(orders),
+                  'speedup': ref_time/total if total > 0 else None})
+        results[preset] = r
+        print('{:<10} {:>14.2f} {:>8.1f}x {:>12.3f} {:>12.3f} {:>12.3f} {:>9.1f}%'.format(
+              preset, r['ms_per_order'], r['speedup'] or 0.0, r['mean'], r['p99'], r['max'], 100*r['max_relative']))
+        sys.stdout.flush()
+
+    return {'commit': commit_hash(), 'server': calib_cfg.server, 'steps': calib_cfg.steps,
+            'orders': len(orders), 'seed': args.seed, 'reference': REFERENCE,
+            'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'results': results}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'speed and accuracy of the solver presets')
+    parser.add_argument('--server', choices = ('auto', 'java', 'standin'), default = 'auto')
+    parser.add_argument('--orders', type = int, default = 100)
+    parser.add_argument('--steps', type = int, default = None, help = 'steps per order; cfg.steps by default')
+    parser.add_argument('--seed', type = int, default = 0, help = 'seed of the random orders')
+    parser.add_argument('--output', help = 'write the results as json to this file')
+    args = parser.parse_args()
+
+    results = run(args)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent = 2, sort_keys = True)
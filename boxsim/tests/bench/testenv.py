@@ -0,0 +1,6 @@
+# Create an environment for the benchmarks.
+
+# Adjusting paths.
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(__file__, '../../..')))
+sys.path.insert(0, os.path.abspath(os.path.join(__file__, '../..')))
@@ -1,8 +1,14 @@
 import testenv
+import os
+import signal
+import time
 import random
 import traceback
 
+import numpy as np
+
 import boxsim
+from boxsim import boxcom, wire
 from common import cfg
 
 def test_unibox():
@@ -35,8 +41,508 @@ def test_unibox():
 
     return check
 
+def test_batch():
+    """Test that batched orders produce the same results as single orders"""
+    check = True
+
+    cfg_ = cfg.copy(deep = True)
+    cfg_.verbose    = False
+    cfg_.batch_size = 4
+    box = boxsim.BoxSim(cfg_)
+
+    try:
+        orders = [[random.uniform(b_min, b_max) for b_min, b_max in box.m_bounds] for _ in range(10)]
+        effects = box.execute_orders(orders)
+        check *= len(effects) == len(orders)
+        for order, effect in zip(orders, effects):
+            check *= box.execute_order(order) == tuple(effect)
+
+    except Exception as e:
+        traceback.print_exc()
+        check = False
+
+    box.close()
+
+    return check
+
+def test_reconfigure():
+    """Test that a reconfigured sim behaves as a new one"""
+    check = True
+
+    cfg_ = cfg.copy(deep = True)
+    cfg_.verbose = False
+    box = boxsim.BoxSim(cfg_.copy(deep = True))
+
+    cfg2 = cfg_.copy(deep = True)
+    cfg2.toys.ball.pos = (450, 300)
+    box2 = boxsim.BoxSim(cfg2.copy(deep = True))
+
+    try:
+        box.reconfigure(cfg2.copy(deep = True))
+        check *= box.s_bounds == box2.s_bounds
+        for _ in range(5):
+            order = [random.uniform(b_min, b_max) for b_min, b_max in box.m_bounds]
+            check *= box.execute_order(order) == box2.execute_order(order)
+
+    except Exception as e:
+        traceback.print_exc()
+        check = False
+
+    box.close()
+    box2.close()
+
+    return check
+
+def test_settle():
+    """Test that trials stopped once the scene is at rest have the same effects"""
+    check = True
+
+    cfg_ = cfg.copy(deep = True)
+    cfg_.verbose = False
+    cfg_.sensors = 'armtoys'
+    cfg_.motors  = 'goto'
+    box = boxsim.BoxSim(cfg_.copy(deep = True))
+    cfg_.settle_threshold = 0.1
+    sbox = boxsim.BoxSim(cfg_)
+
+    try:
+        orders = [[random.uniform(b_min, b_max) for b_min, b_max in box.m_bounds] for _ in range(10)]
+        check *= np.allclose(box.execute_orders(orders), sbox.execute_orders(orders), atol = 1.0)
+        check *= sbox._boxcom.trials_run == 10
+        check *= sbox._boxcom.steps_run < sbox._boxcom.steps_requested == 10*cfg_.steps
+        check *= box._boxcom.steps_run == box._boxcom.steps_requested
+
+    except Exception as e:
+        traceback.print_exc()
+        check = False
+
+    box.close()
+    sbox.close()
+
+    return check
+
+def test_settle_creep():
+    """Test that a joint creeping slower than the settle threshold does not stop a trial early"""
+    check = True
+
+    cfg_ = cfg.copy(deep = True)
+    cfg_.verbose = False
+    cfg_.sensors = 'fullarm'
+    cfg_.motors  = 'fullmotor'
+    cfg_.toy_order = []
+    box = boxsim.BoxSim(cfg_.copy(deep = True))
+    cfg_.settle_threshold = 0.1
+    sbox = boxsim.BoxSim(cfg_)
+
+    try:
+        # the tip moves by 300*0.0002/60 = 0.001 per step, under 0.1/60
+        order = [0.0]*6 + [1.0] + [0.0]*5 + [0.0002] + [0.0]*5
+        effect, s_effect = np.array(box.execute_order(order)), np.array(sbox.execute_order(order))
+        duration = cfg_.steps/60.0
+        check *= np.all(np.abs(effect - s_effect) <= cfg_.settle_threshold*duration)
+        check *= sbox._boxcom.steps_run == cfg_.steps
+        check *= np.allclose(effect, s_effect)
+
+    except Exception as e:
+        traceback.print_exc()
+        check = False
+
+    box.close()
+    sbox.close()
+
+    return check
+
+def test_reset_mode():
+    """Test that restoring snapshots of the world gives the same effects as rebuilding it"""
+    check = True
+
+    cfg_ = cfg.copy(deep = True)
+    cfg_.verbose = False
+    cfg_.sensors = 'armtoys'
+    cfg_.motors  = 'goto'
+    box = boxsim.BoxSim(cfg_.copy(deep = True))
+    cfg_.reset_mode = 'restore'
+    rbox = boxsim.BoxSim(cfg_)
+
+    try:
+        orders = [[random.uniform(b_min, b_max) for b_min, b_max in box.m_bounds] for _ in range(10)]
+        check *= np.allclose(box.execute_orders(orders), rbox.execute_orders(orders), atol = 1.0)
+
+        # the same trial, run after different ones, gives the effects of a fresh world
+        probe = orders[0]
+        effect = box.execute_order(probe)
+        for order in orders[1:]:
+            box.execute_order(order)
+            rbox.execute_order(order)
+            check *= box.execute_order(probe) == effect
+            check *= rbox.execute_order(probe) == effect
+
+    except Exception as e:
+        traceback.print_exc()
+        check = False
+
+    box.close()
+    rbox.close()
+
+    return check
+
+def test_stats():
+    """Test that the metrics account for the messages and trials"""
+    check = True
+
+    cfg_ = cfg.copy(deep = True)
+    cfg_.verbose = False
+    cfg_.metrics = True
+    box = boxsim.BoxSim(cfg_)
+
+    try:
+        orders = [[random.uniform(b_min, b_max) for b_min, b_max in box.m_bounds] for _ in range(3)]
+        box.execute_order(orders[0])
+        box.execute_orders(orders)
+
+        stats = box.stats()
+        check *= stats['server']['trials_run'] == 4
+        check *= stats['counters']['sim.orders'] == 4
+        check *= stats['latencies']['msg.RESET']['count'] == 1
+        check *= stats['latencies']['msg.BATCH']['count'] == 1
+        check *= stats['latencies']['server.step']['count'] == 4
+        check *= stats['latencies']['sim.execute_order']['p99'] > 0.0
+
+    except Exception as e:
+        traceback.print_exc()
+        check = False
+
+    box.close()
+
+    return check
+
+def test_supervise():
+    """Test that supervised simulations survive crashed, stalled and bloated servers"""
+    check = True
+
+    cfg_ = cfg.copy(deep = True)
+    cfg_.verbose = False
+    cfg_.motors  = 'goto'
+    box = boxsim.BoxSim(cfg_.copy(deep = True))
+    cfg_.supervise     = True
+    cfg_.reply_timeout = 2.0
+    sbox = boxsim.BoxSim(cfg_)
+
+    try:
+        orders = [[random.uniform(b_min, b_max) for b_min, b_max in box.m_bounds] for _ in range(5)]
+        effects = box.execute_orders(orders)
+
+        os.killpg(sbox._boxcom.com.simproc.pid, signal.SIGKILL) # crash
+        check *= np.allclose(sbox.execute_orders(orders), effects)
+        os.killpg(sbox._boxcom.com.simproc.pid, signal.SIGSTOP) # stall
+        futures = [sbox.execute_order_async(order) for order in orders]
+        check *= np.allclose([future.result() for future in futures], effects)
+        check *= sbox.stats()['server']['restarts'] == 2
+
+        sbox.cfg.max_server_memory  = 1
+        sbox.cfg.memory_check_every = 0.0
+        check *= np.allclose(sbox.execute_orders(orders), effects)
+        check *= sbox.stats()['server']['recycles'] == 1
+
+    except Exception as e:
+        traceback.print_exc()
+        check = False
+
+    box.close()
+    sbox.close()
+
+    return check
+
+def test_async():
+    """Test that pipelined orders produce the same results as blocking ones"""
+    check = True
+
+    cfg_ = cfg.copy(deep = True)
+    cfg_.verbose = False
+    box = boxsim.UniformizeSim(boxsim.BoxSim(cfg_))
+
+    try:
+        orders  = [[random.random() for _ in range(13)] for _ in range(10)]
+        futures = [box.execute_order_async(order) for order in orders]
+        effects = [future.result() for future in futures]
+        for order, effect in zip(orders, effects):
+            check *= box.execute_order(order) == effect
+
+    except Exception as e:
+        traceback.print_exc()
+        check = False
+
+    box.close()
+
+    return check
+
+def test_trajectory():
+    """Test that trajectories are coherent with the effects"""
+    check = True
+
+    cfg_ = cfg.copy(deep = True)
+    cfg_.verbose = False
+    cfg_.trajectory_every = 10
+    cfg_.trajectory_chunk = 16
+    box = boxsim.BoxSim(cfg_)
+
+    try:
+        order = [random.uniform(b_min, b_max) for b_min, b_max in box.m_bounds]
+        effect, trajectory = box.execute_order(order, trajectory = True)
+        check *= effect == box.execute_order(order)
+        check *= trajectory.shape == ((cfg_.steps + 9)//10, len(box.s_feats))
+
+        effects, trajectories = box.execute_orders([order, order], trajectory = True)
+        check *= len(trajectories) == 2
+        check *= tuple(effects[1]) == effect
+
+    except Exception as e:
+        traceback.print_exc()
+        check = False
+
+    box.close()
+
+    return check
+
+def test_legacy_result():
+    """Test that an empty RESULT request gets the whole history in the legacy format"""
+    check = True
+
+    cfg_ = cfg.copy(deep = True)
+    cfg_.verbose = False
+    box = boxsim.BoxSim(cfg_)
+
+    try:
+        order = [random.uniform(b_min, b_max) for b_min, b_max in box.m_bounds]
+        box.execute_order(order, trajectory = True)
+        com = box._boxcom
+        history = com._exchange([com._trajectory_request(1, 1000)], com.process_trajectory, com._more_chunks)
+        msg = com._exchange([com._request(boxcom.MSG_RESULT, timeout = cfg_.reply_timeout)], lambda replies: replies[0])
+        boxcom.expect(msg, boxcom.MSG_RESULT)
+
+        n_feats = msg.readInt()
+        check *= n_feats == history.shape[1]
+        check *= [msg.readInt() for _ in range(n_feats)] == list(range(n_feats))
+        rows = []
+        for _ in range(len(history)):
+            check *= msg.readInt() == n_feats
+            rows.append([msg.readDouble() for _ in range(n_feats)])
+        check *= np.allclose(rows, history)
+
+    except Exception as e:
+        traceback.print_exc()
+        check = False
+
+    box.close()
+
+    return check
+
+def test_error_reply():
+    """Test that an error reply of the server raises a ServerError with its reason"""
+    check = True
+
+    error = wire.OutboundMessage(boxcom.MSG_ERROR | (1 << boxcom.WORLD_SHIFT))
+    error.appendString('the sensor histories have different lengths (1000 to 2000)')
+    msg = wire.InboundMessage(error.type, error.getBytes()[wire.HEADER_SIZE:])
+    try:
+        boxcom.expect(msg, boxcom.MSG_RESULT)
+        check = False
+    except boxcom.ServerError as e:
+        check *= 'RESULT' in str(e) and 'different lengths' in str(e)
+
+    return check
+
+def test_sensor_log():
+    """Test the logging policies of the sensor history"""
+    check = True
+
+    cfg_ = cfg.copy(deep = True)
+    cfg_.verbose = False
+    cfg_.steps   = 120
+    cfg_.trajectory_every = 1
+
+    boxes = []
+    try:
+        order = None
+        for policy, rows in [(('off', 1), 0), (('every', 1), 120), (('every', 10), 12),
+                             (('ring', 50), 50), (('ring', 500), 120)]:
+            cfg_.sensor_log = policy[0]
+            cfg_.sensor_log_period = policy[1]
+            cfg_.sensor_log_size   = policy[1]
+            box = boxsim.BoxSim(cfg_.copy(deep = True))
+            boxes.append(box)
+            if order is None:
+                order = [random.uniform(b_min, b_max) for b_min, b_max in box.m_bounds]
+                effect = box.execute_order(order)
+            e, trajectory = box.execute_order(order, trajectory = True)
+            check *= e == effect
+            check *= trajectory.shape[0] == rows
+
+        # the history is logged from the first trajectory on, and the effects are not affected
+        cfg_.sensor_log = 'auto'
+        cfg_.sensor_log_period = 1
+        box = boxsim.BoxSim(cfg_.copy(deep = True))
+        boxes.append(box)
+        check *= box._boxcom.log_policy() == [boxcom.LOG_MODES['off'], 1]
+        check *= box.execute_order(order) == effect
+        e, trajectory = box.execute_order(order, trajectory = True)
+        check *= e == effect
+        check *= trajectory.shape[0] == 120
+        check *= box._boxcom.log_policy() == [boxcom.LOG_MODES['every'], 1]
+        check *= box._boxcom.conf_message(box.conf) == boxes[0]._boxcom.conf_message(box.conf)
+
+    except Exception as e:
+        traceback.print_exc()
+        check = False
+
+    for box in boxes:
+        box.close()
+
+    return check
+
+def test_unix_transport():
+    """Test that a server reached through a unix socket produces the same results as through TCP"""
+    check = True
+
+    cfg_ = cfg.copy(deep = True)
+    cfg_.verbose = False
+    box = boxsim.BoxSim(cfg_.copy(deep = True))
+    cfg_.transport = 'unix'
+    unix_box = boxsim.BoxSim(cfg_)
+
+    try:
+        path = unix_box._boxcom.address[len('unix:'):]
+        check *= os.path.exists(path)
+
+        orders = [[random.uniform(b_min, b_max) for b_min, b_max in box.m_bounds] for _ in range(10)]
+        check *= np.array_equal(unix_box.execute_orders(orders), box.execute_orders(orders))
+        check *= unix_box.execute_order(orders[0]) == box.execute_order(orders[0])
+        check *= np.array_equal(unix_box.execute_order_async(orders[1]).result(), box.execute_order(orders[1]))
+
+    except Exception as e:
+        traceback.print_exc()
+        check = False
+
+    box.close()
+    unix_box.close()
+    check *= not os.path.exists(path)
+
+    return check
+
+def test_reuse():
+    """Test that closed servers are only reused by simulations with the same server options"""
+    check = True
+
+    cfg_ = cfg.copy(deep = True)
+    cfg_.verbose = False
+    cfg_.reuse_server = True
+    boxes = []
+
+    try:
+        box = boxsim.BoxSim(cfg_.copy(deep = True))
+        pid = box._boxcom.simproc.pid
+        box.close()
+
+        unix_cfg = cfg_.copy(deep = True)
+        unix_cfg.transport = 'unix'
+        boxes.append(boxsim.BoxSim(unix_cfg))
+        check *= boxes[-1]._boxcom.simproc.pid != pid
+        boxes.append(boxsim.BoxSim(cfg_.copy(deep = True)))
+        check *= boxes[-1]._boxcom.simproc.pid == pid
+
+    except Exception as e:
+        traceback.print_exc()
+        check = False
+
+    for box in boxes:
+        box.cfg.reuse_server = False
+        box.close()
+
+    return check
+
+def test_spare():
+    """Test that sims take warmed-up spare servers, and get the same results as from their own"""
+    check = True
+
+    cfg_ = cfg.copy(deep = True)
+    cfg_.verbose = False
+    box = boxsim.BoxSim(cfg_.copy(deep = True))
+    cfg_.spare_servers = 2
+    spare_box = boxsim.BoxSim(cfg_.copy(deep = True))
+
+    try:
+        pool = boxcom.spare_pool(spare_box)
+        deadline = time.time() + 30.0
+        while pool._ready.qsize() < 2 and time.time() < deadline:
+            time.sleep(0.05)
+        spares = [com.simproc.pid for com in list(pool._ready.queue)]
+        check *= len(spares) == 2
+
+        spare_box2 = boxsim.BoxSim(cfg_.copy(deep = True))
+        check *= spare_box2._boxcom.simproc.pid in spares
+        check *= spare_box2.stats()['server']['trials_run'] == 0
+
+        orders = [[random.uniform(b_min, b_max) for b_min, b_max in box.m_bounds] for _ in range(5)]
+        check *= np.array_equal(spare_box2.execute_orders(orders), box.execute_orders(orders))
+        spare_box2.close()
+
+    except Exception as e:
+        traceback.print_exc()
+        check = False
+
+    box.close()
+    spare_box.close()
+
+    return check
+
+def test_solver():
+    """Test that the solver presets and their overrides are sent to the server"""
+    check = True
+
+    cfg_ = cfg.copy(deep = True)
+    cfg_.verbose  = False
+    cfg_.solver   = 'fast'
+    cfg_.iter_vel = 10
+    box = boxsim.BoxSim(cfg_)
+
+    try:
+        check *= box._boxcom.conf_message(box.conf)[:4] == [60.0, 1, 10, 3]
+        order = [random.uniform(b_min, b_max) for b_min, b_max in box.m_bounds]
+        effect = box.execute_order(order)
+
+        cfg_ = cfg_.copy(deep = True)
+        cfg_.solver   = 'precise'
+        cfg_.iter_vel = None
+        box.reconfigure(cfg_)
+        check *= box._boxcom.conf_message(box.conf)[:4] == boxcom.SOLVER_PRESETS['precise']
+        check *= len(box.execute_order(order)) == len(effect)
+
+    except Exception as e:
+        traceback.print_exc()
+        check = False
+
+    box.close()
+
+    return check
+
 
-tests = [test_unibox]
+tests = [test_unibox,
+         test_batch,
+         test_reconfigure,
+         test_settle,
+         test_settle_creep,
+         test_reset_mode,
+         test_stats,
+         test_supervise,
+         test_async,
+         test_trajectory,
+         test_legacy_result,
+         test_error_reply,
+         test_sensor_log,
+         test_unix_transport,
+         test_reuse,
+         test_spare,
+         test_solver]
 
 if __name__ == "__main__":
     print("\033[1m%s\033[0m" % (__file__,))
@@ -0,0 +1,66 @@
+import testenv
+import os
+import tempfile
+
+from boxsim import boxcache
+
+result = ((0.0, 1.0, 2.0), (3.0, 4.0, 5.0))
+
+def test_lru():
+    """Test that the in-memory cache evicts the least recently used results"""
+    check = True
+
+    cache = boxcache.ResultCache(size = 2)
+    keys = [cache.key([1, 2.0], 10, [0.0], [float(i), 1.0]) for i in range(3)]
+    check *= len(set(keys)) == 3
+
+    cache.put(keys[0], result)
+    cache.put(keys[1], result)
+    check *= cache.get(keys[0]) == result
+    cache.put(keys[2], result)
+    check *= cache.get(keys[1]) is None
+    check *= cache.get(keys[0]) == result
+    check *= cache.stats()['hits'] == 2 and cache.stats()['misses'] == 1
+
+    return check
+
+def test_key():
+    """Test that cache keys cover the configuration, steps and quantized orders"""
+    check = True
+
+    cache = boxcache.ResultCache(precision = 0.01)
+    key = cache.key([1, 2.0], 10, [0.0], [0.5, 1.0])
+    check *= key == cache.key([1, 2.0], 10, [0.0], [0.501, 1.0])
+    check *= key != cache.key([1, 2.0], 10, [0.0], [0.52, 1.0])
+    check *= key != cache.key([1, 2.0], 11, [0.0], [0.5, 1.0])
+    check *= key != cache.key([1, 2.5], 10, [0.0], [0.5, 1.0])
+    check *= key != cache.key([1, 2.0], 10, [0.1], [0.5, 1.0])
+
+    return check
+
+def test_disk():
+    """Test that results stored on disk are shared between caches"""
+    check = True
+
+    path = os.path.join(tempfile.mkdtemp(), 'cache.db')
+    cache1 = boxcache.ResultCache(size = 0, path = path)
+    key = cache1.key([1, 2.0], 10, [0.0], [0.5, 1.0])
+    cache1.put(key, result)
+    cache1.close()
+
+    cache2 = boxcache.ResultCache(size = 10, path = path)
+    check *= cache2.get(key) == result
+    cache2.close()
+
+    return check
+
+
+tests = [test_lru,
+         test_key,
+         test_disk]
+
+if __name__ == "__main__":
+    print("\033[1m%s\033[0m" % (__file__,))
+    for t in tests:
+        print('%s %s' % ('\033[1;32mPASS\033[0m' if t() else
+                         '\033[1;31mFAIL\033[0m', t.__doc__))
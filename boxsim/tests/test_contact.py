@@ -0,0 +1,91 @@
+import testenv
+import random
+import traceback
+
+import numpy as np
+
+import boxsim
+from boxsim import contact, kinematics
+from common import cfg
+
+def full_orders(targets):
+    """goto orders from the rest pose"""
+    targets = np.asarray(targets, dtype = float)
+    return np.hstack((np.zeros(targets.shape), targets, np.full(targets.shape, cfg.max_speed)))
+
+def test_may_touch():
+    """Test that the contact filter detects the orders that can touch the toy"""
+    check = True
+
+    cfg_ = cfg.copy(deep = True)
+    cfilter = contact.ContactFilter(cfg_)
+
+    touch = cfilter.may_touch(full_orders([[-0.507] + [0.0]*5,   # toward the ball
+                                           [ 1.5  ] + [0.0]*5,   # away on the left
+                                           [ 0.5  ] + [0.0]*5,   # stays up
+                                           [-1.5  ] + [0.0]*5])) # sweeps through the ball
+    check *= list(touch) == [True, False, False, True]
+
+    # random orders: the filter is conservative with regard to the final pose.
+    targets = np.random.uniform(-cfg_.angle_limit, cfg_.angle_limit, (1000, 6))
+    final = kinematics.forward(targets, cfg_.arm_lengths, cfg_.base_pos)
+    distances = np.sqrt(np.min((final[:, 0::3] - 550.0)**2 + (final[:, 1::3] - 350.0)**2, axis = 1))
+    check *= np.all(cfilter.may_touch(full_orders(targets))[distances <= 20.0])
+
+    return check
+
+def test_lag():
+    """Test that the contact filter is conservative whatever the lag of each joint"""
+    check = True
+
+    cfg_ = cfg.copy(deep = True)
+    cfilter = contact.ContactFilter(cfg_)
+
+    # poses along the course of the joints, each joint at its own fraction of it
+    targets = np.random.uniform(-cfg_.angle_limit, cfg_.angle_limit, (1000, 6))
+    fractions = np.random.random_sample(targets.shape)
+    poses = kinematics.forward(fractions*targets, cfg_.arm_lengths, cfg_.base_pos)
+    distances = np.sqrt(np.min((poses[:, 0::3] - 550.0)**2 + (poses[:, 1::3] - 350.0)**2, axis = 1))
+    check *= np.all(cfilter.may_touch(full_orders(targets))[distances <= 20.0])
+
+    return check
+
+def test_filtered_sim():
+    """Test that the contact filter does not change the effects"""
+    check = True
+
+    cfg_ = cfg.copy(deep = True)
+    cfg_.verbose = False
+    cfg_.motors  = 'goto'
+    box = boxsim.BoxSim(cfg_.copy(deep = True))
+    cfg_.contact_filter = True
+    cfg_.contact_verify = 0.1
+    fbox = boxsim.BoxSim(cfg_)
+
+    try:
+        orders = [[random.uniform(b_min, b_max) for b_min, b_max in box.m_bounds] for _ in range(45)]
+        orders += [[random.uniform(0.5, 1.5)] + [0.0]*5 for _ in range(5)] # away from the ball
+        check *= np.allclose(box.execute_orders(orders), fbox.execute_orders(orders))
+        check *= box.execute_order(orders[0]) == fbox.execute_order(orders[0])
+
+        stats = fbox.contact_filter.stats()
+        check *= stats['trials'] == 51 and stats['skipped'] > 0 and stats['errors'] == 0
+    except Exception:
+        traceback.print_exc()
+        check = False
+
+    box.close()
+    fbox.close()
+
+    return check
+
+
+tests = [test_may_touch,
+         test_lag,
+         test_filtered_sim]
+
+if __name__ == "__main__":
+    print("\033[1m%s\033[0m" % (__file__,))
+    for t in tests:
+        print('%s %s' % ('\033[1;32mPASS\033[0m' if t() else
+                         '\033[1;31mFAIL\033[0m', t.__doc__))
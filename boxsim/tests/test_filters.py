@@ -2,6 +2,7 @@ import testenv
 import random
 import traceback
 
+import numpy as np
 import treedict
 import boxsim
 from common import cfg
@@ -19,6 +20,9 @@ class MockSim(object):
     def execute_order(self, effect, **kwargs):
         return tuple(random.uniform(si_min, si_max) for si_min, si_max in self.s_bounds)
 
+    def execute_orders(self, orders, **kwargs):
+        return np.array([self.execute_order(order) for order in orders])
+
 def test_filterbox1():
     """Test that filtered sim produces coherent attributes"""
     check = True
@@ -58,10 +62,26 @@ def test_filterbox3():
 
     return check
 
+def test_filterbox4():
+    """Test that filtered and uniformized sims process arrays of orders"""
+    check = True
+
+    sim = MockSim()
+    fsim = boxsim.UniformizeSim(boxsim.FilterSim(sim, s_feats = range(2, 5)))
+
+    orders = np.random.random((1000, 1))
+    effects = fsim.execute_orders(orders)
+
+    check *= effects.shape == (1000, 3)
+    check *= np.all((0.0 <= effects) & (effects <= 1.0))
+
+    return check
+
 
 tests = [test_filterbox1,
          test_filterbox2,
-         test_filterbox3]
+         test_filterbox3,
+         test_filterbox4]
 
 if __name__ == "__main__":
     print("\033[1m%s\033[0m" % (__file__,))
@@ -0,0 +1,90 @@
+import testenv
+import random
+import traceback
+
+import numpy as np
+
+import boxsim
+from boxsim import inverse
+from common import cfg
+
+def test_index():
+    """Test that the inverse index finds the same neighbours as a linear scan"""
+    check = True
+
+    index = inverse.InverseIndex(2, 3, leaf_size = 8, batch_size = 100)
+    for n in (50, 150, 30, 400):
+        index.add(np.random.uniform(size = (n, 2)), np.random.uniform(0.0, 800.0, (n, 3)))
+    check *= len(index) == 630
+
+    for _ in range(20):
+        target = np.random.uniform(0.0, 800.0, 3)
+        indexes, distances = index.nearest(target, k = 5)
+        scan = np.sqrt(np.sum((index.effects - target)**2, axis = 1))
+        check *= np.array_equal(indexes, np.argsort(scan)[:5])
+        check *= np.allclose(distances, np.sort(scan)[:5])
+
+        indexes, distances = index.nearest(target[1:], k = 3, feats = [1, 2])
+        scan = np.sqrt(np.sum((index.effects[:, 1:] - target[1:])**2, axis = 1))
+        check *= np.allclose(distances, np.sort(scan)[:3])
+
+    return check
+
+def test_scaling():
+    """Test that queries compare a number of effects that grows sub-linearly with the index"""
+    check = True
+
+    np.random.seed(0)
+    index = inverse.InverseIndex(2, 3)
+    scanned = []
+    for n in (10000, 100000):
+        index.add(np.random.uniform(size = (n - len(index), 2)), np.random.uniform(0.0, 800.0, (n - len(index), 3)))
+        counts = []
+        for _ in range(20):
+            index.nearest(np.random.uniform(0.0, 800.0, 3), k = 5)
+            counts.append(index.scanned)
+        scanned.append(np.mean(counts))
+    check *= scanned[1] < 0.02*len(index)
+    check *= scanned[1] < 3*scanned[0]
+
+    return check
+
+def test_inverse():
+    """Test that a sim finds back the orders of the effects it produced"""
+    check = True
+
+    cfg_ = cfg.copy(deep = True)
+    cfg_.verbose = False
+    cfg_.sensors = 'arm'
+    cfg_.motors  = 'goto'
+    cfg_.inverse_index = True
+    box = boxsim.BoxSim(cfg_)
+
+    try:
+        orders = [[random.uniform(b_min, b_max) for b_min, b_max in box.m_bounds] for _ in range(20)]
+        effects = box.execute_orders(orders[:19])
+        effect = box.execute_order(orders[19])
+
+        inv_orders, inv_effects, distances = box.inverse(effects[3], k = 2)
+        check *= np.allclose(inv_orders[0], orders[3]) and distances[0] == 0.0
+        inv_orders, inv_effects, distances = box.inverse(effect)
+        check *= np.allclose(inv_orders[0], orders[19]) and distances[0] == 0.0
+
+    except Exception as e:
+        traceback.print_exc()
+        check = False
+
+    box.close()
+
+    return check
+
+
+tests = [test_index,
+         test_scaling,
+         test_inverse]
+
+if __name__ == "__main__":
+    print("\033[1m%s\033[0m" % (__file__,))
+    for t in tests:
+        print('%s %s' % ('\033[1;32mPASS\033[0m' if t() else
+                         '\033[1;31mFAIL\033[0m', t.__doc__))
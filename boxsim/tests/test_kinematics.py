@@ -0,0 +1,76 @@
+import testenv
+import math
+import traceback
+
+import numpy as np
+
+from boxsim import boxctrl, kinematics
+from common import cfg
+
+def arm_cfg():
+    cfg_ = cfg.copy(deep = True)
+    cfg_.verbose   = False
+    cfg_.sensors   = 'fullarm'
+    cfg_.motors    = 'goto'
+    cfg_.toy_order = []
+    return cfg_
+
+def test_pose():
+    """Test that the kinematic engine computes the pose of the arm without server"""
+    check = True
+
+    cfg_ = arm_cfg()
+    cfg_.update(boxctrl.defaultcfg, overwrite = False)
+    engine = kinematics.KinematicEngine(cfg_)
+
+    goto = np.array([[0.0]*6, [math.pi/2] + [0.0]*5, [3.0]*6])
+    orders = np.hstack((np.zeros((3, 6)), goto, np.full((3, 6), cfg_.max_speed)))
+    before, after = engine.execute(orders)
+    check *= before.shape == after.shape == (3, 18)
+    # straight up
+    check *= np.allclose(after[0, 15:17], (400.0, 380.0))
+    # straight left
+    check *= np.allclose(after[1, 15:17], (100.0, 80.0))
+    # angles beyond the limits are clipped
+    check *= np.allclose(after[2], kinematics.forward(np.full((1, 6), 2.0), cfg_.arm_lengths, cfg_.base_pos)[0])
+
+    return check
+
+def test_reachable_space():
+    """Test that the reachable space is derived from the arm, within the walls"""
+    check = True
+
+    cfg_ = arm_cfg()
+    check *= kinematics.reachable_space(cfg_) == ((100.0, 700.0), (50.0, 380.0))
+    cfg_.arm_lengths = (100.0,)*6
+    check *= kinematics.reachable_space(cfg_) == ((50.0, 750.0), (50.0, 680.0))
+
+    return check
+
+def test_validate():
+    """Test that the kinematic engine agrees with the server"""
+    # with the stand-in server, that uses the same convention, this only
+    # checks the plumbing; the convention is checked with the java server.
+    check = True
+
+    try:
+        report = kinematics.validate(arm_cfg(), n_orders = 20, seed = 0)
+        print('kinematic engine error: mean {mean_distance:.2f}, p99 {p99_distance:.2f}, max {max_distance:.2f}'.format(**report))
+        check *= report['n_orders'] == 20
+        check *= report['p99_distance'] < 10.0
+    except Exception:
+        traceback.print_exc()
+        check = False
+
+    return check
+
+
+tests = [test_pose,
+         test_reachable_space,
+         test_validate]
+
+if __name__ == "__main__":
+    print("\033[1m%s\033[0m" % (__file__,))
+    for t in tests:
+        print('%s %s' % ('\033[1;32mPASS\033[0m' if t() else
+                         '\033[1;31mFAIL\033[0m', t.__doc__))
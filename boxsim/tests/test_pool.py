@@ -0,0 +1,85 @@
+import testenv
+import random
+import traceback
+
+import numpy as np
+
+import boxsim
+from common import cfg
+
+def test_pool():
+    """Test that a pool of sims produce the same results as a single sim"""
+    check = True
+
+    cfg_ = cfg.copy(deep = True)
+    cfg_.verbose = False
+    box  = boxsim.UniformizeSim(boxsim.BoxSim(cfg_.copy(deep = True)))
+    pool = boxsim.UniformizeSim(boxsim.BoxSimPool(cfg_.copy(deep = True), 3))
+
+    try:
+        check *= box.m_bounds == pool.m_bounds
+        check *= box.s_bounds == pool.s_bounds
+
+        orders = [[random.random() for _ in range(13)] for _ in range(12)]
+        effects = pool.sim.execute_orders([pool._uni2sim(order) for order in orders])
+        check *= len(effects) == len(orders)
+        for order, effect in zip(orders, effects):
+            check *= box.execute_order(order) == pool._sim2uni(effect)
+
+        indexes = sorted(i for i, _ in pool.sim.imap(pool._uni2sim(order) for order in orders))
+        check *= indexes == list(range(len(orders)))
+
+    except Exception as e:
+        traceback.print_exc()
+        check = False
+
+    box.close()
+    pool.close()
+
+    return check
+
+def test_worlds():
+    """Test that sims sharing a server, each in its own world, produce the same results as separate sims"""
+    check = True
+
+    cfg_ = cfg.copy(deep = True)
+    cfg_.verbose = False
+    box  = boxsim.BoxSim(cfg_.copy(deep = True))
+    cfg_.worlds_per_server = 2
+    pool = boxsim.BoxSimPool(cfg_, 3)
+
+    try:
+        check *= len(set(sim._boxcom.simproc.pid for sim in pool.sims)) == 2
+
+        orders = [[random.uniform(b_min, b_max) for b_min, b_max in box.m_bounds] for _ in range(12)]
+        check *= np.array_equal(pool.execute_orders(orders), box.execute_orders(orders))
+        futures = [sim.execute_order_async(order) for sim, order in zip(pool.sims, orders)]
+        check *= np.array_equal([f.result() for f in futures], box.execute_orders(orders[:3]))
+
+        # a world opened right after one closed gets a new id, and none of its replies
+        closed = boxsim.BoxSim(cfg_.copy(deep = True))
+        world = closed._boxcom.world
+        closed.close()
+        sim = boxsim.BoxSim(cfg_.copy(deep = True))
+        check *= sim._boxcom.world > world
+        check *= np.array_equal(sim.execute_orders(orders[:3]), box.execute_orders(orders[:3]))
+        sim.close()
+
+    except Exception as e:
+        traceback.print_exc()
+        check = False
+
+    box.close()
+    pool.close()
+
+    return check
+
+
+tests = [test_pool,
+         test_worlds]
+
+if __name__ == "__main__":
+    print("\033[1m%s\033[0m" % (__file__,))
+    for t in tests:
+        print('%s %s' % ('\033[1;32mPASS\033[0m' if t() else
+                         '\033[1;31mFAIL\033[0m', t.__doc__))
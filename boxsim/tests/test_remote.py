@@ -0,0 +1,110 @@
+import testenv
+import os
+import sys
+import signal
+import socket
+import time
+import random
+import traceback
+import subprocess
+
+import numpy as np
+
+import boxsim
+from boxsim import boxcom
+from boxsim import remote
+from common import cfg
+
+def launch_worker(capacity):
+    """Launch a worker on localhost, and return its process and address"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('localhost', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+
+    remote_file = os.path.join(os.path.dirname(boxcom.__file__), 'remote.py')
+    proc = subprocess.Popen([sys.executable, remote_file, str(port), '--host', 'localhost', '--capacity', str(capacity)],
+                            stdout = subprocess.PIPE)
+    assert proc.stdout.readline().startswith(b'READY')
+    return proc, 'localhost:{}'.format(port)
+
+def stop_worker(proc, timeout = 10.0):
+    """Terminate a worker, and return True if it exited before the timeout;
+    otherwise, kill it"""
+    proc.send_signal(signal.SIGCONT)
+    proc.terminate()
+    deadline = time.time() + timeout
+    while proc.poll() is None and time.time() < deadline:
+        time.sleep(0.05)
+    if proc.poll() is None:
+        proc.kill()
+        proc.wait()
+        return False
+    return True
+
+def test_remote():
+    """Test that remote workers produce the same results as a local sim, even when one drops out"""
+    check = True
+
+    cfg_ = cfg.copy(deep = True)
+    cfg_.verbose = False
+    cfg_.remote_timeout = 1.0
+    box = boxsim.UniformizeSim(boxsim.BoxSim(cfg_.copy(deep = True)))
+    workers = [launch_worker(2), launch_worker(2)]
+    remote = boxsim.UniformizeSim(boxsim.RemoteBoxSim(cfg_.copy(deep = True), [address for _, address in workers]))
+
+    try:
+        check *= box.m_bounds == remote.m_bounds
+        check *= box.s_bounds == remote.s_bounds
+        check *= remote.sim.n_workers == 4
+
+        orders = [[random.random() for _ in range(13)] for _ in range(12)]
+        effects = [box.execute_order(order) for order in orders]
+        check *= [remote.execute_order(order) for order in orders] == effects
+
+        workers[1][0].send_signal(signal.SIGSTOP) # the worker stalls, and is dropped
+        check *= np.allclose(remote.execute_orders(orders), effects)
+        check *= len(remote.sim.sims) == 2
+
+    except Exception as e:
+        traceback.print_exc()
+        check = False
+
+    box.close()
+    remote.close()
+    for proc, _ in workers:
+        check *= stop_worker(proc)
+
+    return check
+
+def test_plain_cfg():
+    """Test that configurations are sent to workers as plain data"""
+    check = True
+
+    try:
+        cfg_ = cfg.copy(deep = True)
+        sent = remote.read_cfg(remote.plain_cfg(cfg_))
+        check *= sorted(sent.items()) == sorted(cfg_.items())
+        check *= isinstance(sent.arm_lengths, tuple)
+
+        cfg_.motors = object() # not data: refused
+        try:
+            remote.plain_cfg(cfg_)
+            check = False
+        except TypeError:
+            pass
+    except Exception:
+        traceback.print_exc()
+        check = False
+
+    return check
+
+
+tests = [test_remote,
+         test_plain_cfg]
+
+if __name__ == "__main__":
+    print("\033[1m%s\033[0m" % (__file__,))
+    for t in tests:
+        print('%s %s' % ('\033[1;32mPASS\033[0m' if t() else
+                         '\033[1;31mFAIL\033[0m', t.__doc__))
@@ -0,0 +1,64 @@
+import testenv
+import random
+import shutil
+import tempfile
+import traceback
+
+import numpy as np
+
+import boxsim
+from common import cfg
+
+def test_resume():
+    """Test that an interrupted run resumes from its last committed chunk"""
+    check = True
+
+    cfg_ = cfg.copy(deep = True)
+    cfg_.verbose = False
+    box = boxsim.UniformizeSim(boxsim.BoxSim(cfg_))
+    path = tempfile.mkdtemp()
+
+    try:
+        orders = [[random.random() for _ in range(13)] for _ in range(25)]
+
+        def interrupted():
+            for order in orders[:15]:
+                yield order
+            raise KeyboardInterrupt
+
+        try:
+            boxsim.run_orders(box, interrupted(), boxsim.ResultStore(path, sim = box, capacity = 8), chunk_size = 10)
+            check = False
+        except KeyboardInterrupt:
+            pass
+        check *= boxsim.ResultStore(path).rows == 10
+
+        store = boxsim.run_orders(box, iter(orders), path, chunk_size = 10)
+        check *= store.rows == 25 and store.capacity == 32
+        check *= np.array_equal(store.orders, orders)
+        check *= np.allclose(store.effects, box.execute_orders(orders))
+        check *= isinstance(store.effects.base, np.memmap) or isinstance(store.effects, np.memmap)
+
+        try:
+            boxsim.run_orders(box, iter(orders[1:]), store)
+            check = False
+        except ValueError:
+            pass
+
+    except Exception as e:
+        traceback.print_exc()
+        check = False
+
+    box.close()
+    shutil.rmtree(path)
+
+    return check
+
+
+tests = [test_resume]
+
+if __name__ == "__main__":
+    print("\033[1m%s\033[0m" % (__file__,))
+    for t in tests:
+        print('%s %s' % ('\033[1;32mPASS\033[0m' if t() else
+                         '\033[1;31mFAIL\033[0m', t.__doc__))
@@ -7,11 +7,12 @@ package experiments.interact;
 import java.io.IOException;
 import java.util.zip.DataFormatException;
 import java.util.ArrayList;
+import java.util.List;
 
 import playground.Playground;
+import playground.sensors.LogSensor;
 import sockit.InboundMessage;
-//import sockit.OutboundMessage;
-import sockit.Server;
+import sockit.OutboundMessage;
 
 public abstract class Exp {
 
@@ -21,8 +22,20 @@ public abstract class Exp {
 	public Playground playground;
 
     /* Server */
-    protected Server server;
-    protected int port;
+    protected MessageServer server;
+    /* Address listened on: a port, or unix:PATH (see MessageServer) */
+    protected String address;
+
+    /** Print a status line for every message processed; set with -Dinteract.log_messages=true **/
+    public static boolean logMessages = Boolean.getBoolean("interact.log_messages");
+
+    /* Worlds: a server can host several experiments, each with its own
+       playground, addressed by the world id carried in the high bits of the
+       message types. The id is 0 when the server hosts a single world. */
+    public static final int
+        WORLD_SHIFT = 8,
+        TYPE_MASK   = (1 << WORLD_SHIFT) - 1;
+    public int worldId = 0;
 
     // FIXME Have a class protocol reading from a config file
 
@@ -36,30 +49,79 @@ public abstract class Exp {
     /** Number of constraint solver position phase per iteration **/
     public int   ITER_POS  = 3;
 
+    // Settle detection
+    /** Velocity (per second) under which the sensors readings are considered still; 0 disables the detection **/
+    public float settleThreshold = 0.0f;
+    /** Number of consecutive still steps after which the scene is at rest, and the steps are stopped **/
+    public int   settleWindow    = 30;
+    /** Step before which the joints can't have reached the targets of the last order, and the scene is not at rest **/
+    public int   settleAfter     = 0;
+
+    // Logging of the sensor history, read by RESULT requests
+    public static final int
+        LOG_OFF   = 0,  // no history
+        LOG_EVERY = 1,  // one step every logParam steps
+        LOG_RING  = 2;  // the last logParam steps
+    public int logMode  = LOG_EVERY;
+    public int logParam = 1;
+    /** Number of rows the sensors keep in LOG_OFF and LOG_EVERY modes **/
+    public static final int HISTORY_CAPACITY = 10000;
+
+    /** Number of steps actually run by the last call to registerSteps **/
+    public int   stepsRun        = 0;
+    /** Duration in seconds of the last call to registerSteps **/
+    public double stepTime       = 0.0;
+
     /* Time in seconds since the last reset */
     protected float date  = 0.0f;
     /* the number of steps sinc the last reset */
     protected int   steps = 0;
 
     /** Scafolding experiment constructor */
-    public Exp(int port, RunController rc) {
+    public Exp(String address, RunController rc) {
         this.rc = rc;
 
-        server = new Server();
-        server.start(port);
-        this.port = port;
+        server = MessageServer.listen(address);
+        this.address = server.getAddress();
+
+        this.createPlayground();
+    }
+
+    /** Constructor of one of the worlds of a server */
+    public Exp(MessageServer server, int worldId, RunController rc) {
+        this.rc = rc;
+        this.server = server;
+        this.address = server.getAddress();
+        this.worldId = worldId;
 
         this.createPlayground();
     }
 
+    /** Create a message of this world */
+    protected OutboundMessage newMessage(int type) {
+        return new OutboundMessage(type | (worldId << WORLD_SHIFT));
+    }
+
+    /** Send a message; the worlds of a server share its connection */
+    protected void send(OutboundMessage msg) {
+        server.send(msg);
+    }
+
     /**
      * If the main class does not run the main loop, call this method.
      */
     void mainLoop() {
+        serve();
+    }
 
-    	while(true) {
-        	update();
-    	}
+    /**
+     * Process the messages as they arrive. The loop waits for the messages
+     * on the server queue, rather than polling it.
+     */
+    public void serve() {
+        while (true) {
+            this.handleMessage(server.take());
+        }
     }
 
     /**
@@ -69,6 +131,7 @@ public abstract class Exp {
 
     	this.date  = 0.0f;
     	this.steps = 0;
+    	this.settleAfter = 0;
 
     	createPlayground();
     }
@@ -80,6 +143,7 @@ public abstract class Exp {
 
         this.date  = 0.0f;
         this.steps = 0;
+        this.settleAfter = 0;
 
         createPlayground(init_pos);
     }
@@ -89,19 +153,8 @@ public abstract class Exp {
     public abstract void createPlayground(ArrayList<Float> init_pos);
 
     /**
-     * Update the communications, and launch event.
-     * This should be called at every couple of simulation steps.
-     * @param steps  the number of steps since the start of the simulation.
-     * @param date   the time elapsed in seconds since the start of the simulation.
-     */
-    public void update() {
-
-    	this.updateMessages();
-    	try { Thread.sleep(1); } catch (Exception e) {}
-    }
-
-    /**
-     * Get new messages and launch their execution.
+     * Get the pending messages and launch their execution, without waiting.
+     * This is for loops that have other work, like the display; otherwise, use serve().
      */
     public void updateMessages() {
         int n = server.getNumberOfMessages();
@@ -111,23 +164,92 @@ public abstract class Exp {
                 if (in_msg == null) {
                     System.out.println("Fuck");
                 }
-                try {
-                    this.processMessage(in_msg);
-                }
-                catch (DataFormatException e) {
-                    System.out.println("    -> The message was not processed succesfully due to an message format error.");
-                    e.printStackTrace();
-                    //server.send(new OutboundMessage(ERROR_TYPE));
-                }
-                catch (IOException e) {
-                    System.out.println("    -> The message was not processed succesfully due to an IO error.");
-                    e.printStackTrace();
-                    //server.send(new OutboundMessage(ERROR_TYPE));
+                this.handleMessage(in_msg);
+            }
+        }
+    }
+
+    /**
+     * Process a message, reporting errors.
+     */
+    public void handleMessage(InboundMessage in_msg) {
+        try {
+            this.processMessage(in_msg);
+        }
+        catch (DataFormatException e) {
+            System.out.println("    -> The message was not processed succesfully due to an message format error.");
+            e.printStackTrace();
+            //server.send(new OutboundMessage(ERROR_TYPE));
+        }
+        catch (IOException e) {
+            System.out.println("    -> The message was not processed succesfully due to an IO error.");
+            e.printStackTrace();
+            //server.send(new OutboundMessage(ERROR_TYPE));
+        }
+    }
+
+    /**
+     * Log the readings of the sensors for the current step, following the
+     * logging policy. In LOG_RING mode, the oldest rows are dropped once the
+     * history holds 2*logParam rows, so that the cost of the drop is amortized.
+     */
+    public void logSensors() {
+        if (logMode == LOG_OFF || (logMode == LOG_EVERY && steps % logParam != 0)) {
+            return;
+        }
+        playground.cc.logSensors(steps);
+        if (logMode == LOG_RING) {
+            for (LogSensor s : playground.cc.logSensors) {
+                List<?> history = s.history();
+                if (history.size() >= 2*logParam) {
+                    history.subList(0, history.size() - logParam).clear();
                 }
             }
         }
     }
 
+    /**
+     * Return the number of rows each sensor must be able to keep under the
+     * logging policy; all the sensors are created with it, so that their
+     * histories have the same length.
+     */
+    public int historyCapacity() {
+        return logMode == LOG_RING ? 2*logParam : HISTORY_CAPACITY;
+    }
+
+    /**
+     * Read the current values of all the sensors of the playground.
+     */
+    public float[] readSensors() {
+        int featSize = 0;
+        for (LogSensor s : playground.cc.logSensors) {
+            featSize += s.lenght();
+        }
+        float[] values = new float[featSize];
+        int i = 0;
+        for (LogSensor s : playground.cc.logSensors) {
+            for (Float f : s.bareRead()) {
+                values[i++] = f.floatValue();
+            }
+        }
+        return values;
+    }
+
+    /**
+     * Return true if no reading moved by more than the settle threshold
+     * allows in one step. A reading creeping slower than the threshold is
+     * still; see settleAfter.
+     */
+    public boolean isStill(float[] previous, float[] current) {
+        float maxDelta = settleThreshold/STEP_FREQ;
+        for (int i = 0; i < current.length; i++) {
+            if (Math.abs(current[i] - previous[i]) > maxDelta) {
+                return false;
+            }
+        }
+        return true;
+    }
+
     /**
      * Process messages, and take appropriate action (eventually sending replies)
      * Currently, the contract is that subsequent message do not change a message
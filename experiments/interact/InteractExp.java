@@ -6,7 +6,9 @@ package experiments.interact;
 
 import java.io.IOException;
 import java.util.ArrayList;
+import java.util.LinkedHashMap;
 import java.util.LinkedList;
+import java.util.Map;
 import java.util.zip.DataFormatException;
 
 import org.jbox2d.common.Vec2;
@@ -40,10 +42,34 @@ public class InteractExp extends Exp {
     public float angle_limit;
     public int base_x, base_y;
 
+    /* Angles of the joints at the last reset, or null once an order moved them */
+    protected ArrayList<Float> restPos; // no initializer: set by createPlayground, called by the Exp constructor
+
+    /* Width in bytes of the floats of sensor blocks: 8 (double) or 4 (float) */
+    public int sensorWidth = 8;
+
     public ArrayList<ArrayList<Number>> toy_vectors;
     public ArrayList<BodyEntity> toys;
     public ArrayList<PosSensor> toySensors;
 
+    /* Reset mode: RESET_REBUILD creates a new playground on every reset,
+       RESET_RESTORE builds it once per configuration and initial position,
+       and restores a snapshot of its bodies, joints, arm and controller on
+       later resets (see WorldSnapshot). */
+    public static final int
+        RESET_REBUILD = 0,
+        RESET_RESTORE = 1,
+        MAX_SNAPSHOTS = 256;
+    public int resetMode = RESET_REBUILD;
+
+    /* Snapshots of the freshly built world, by initial position of the arm */
+    protected Map<ArrayList<Float>, WorldSnapshot> snapshots = new LinkedHashMap<ArrayList<Float>, WorldSnapshot>(16, 0.75f, true) {
+        public static final long serialVersionUID = 1L;
+        protected boolean removeEldestEntry(Map.Entry<ArrayList<Float>, WorldSnapshot> eldest) {
+            return size() > MAX_SNAPSHOTS;
+        }
+    };
+
     // FIXME Have a class protocol reading from a config file
     /* Protocol         id    description                  dest  content */
     private static final int
@@ -56,17 +82,25 @@ public class InteractExp extends Exp {
         SENSOR_TYPE   = 6,  // Simulation sensors           out   list of floats
         ORDER_TYPE    = 7,  // Arm order                    in    list of floats
         STEP_TYPE     = 8,  // Run simulation steps         in    int
-        RESULT_TYPE   = 9,  // Simulation results          out   list of floats
+        RESULT_TYPE   = 9,  // Simulation results          out   list of floats, in chunks
         MSG_INVERSE   = 10, // Inverse request             out   list of floats
-        MSG_DISPLAY   = 11; // Overlay display request     out   list of floats
+        MSG_DISPLAY   = 11, // Overlay display request     out   list of floats
+        BATCH_TYPE    = 12; // Run a batch of trials       in    list of trials
 
     public static final int
         AREA_SIZE = 800,
         WALL_SIZE = 50;
 
     /* Interact experiment constructor */
-    public InteractExp(int port, RunController rc) {
-    	super(port, rc);
+    public InteractExp(String address, RunController rc) {
+    	super(address, rc);
+
+        lengths = new ArrayList<Float>();
+    }
+
+    /* Constructor of one of the worlds of a server */
+    public InteractExp(MessageServer server, int worldId, RunController rc) {
+    	super(server, worldId, rc);
 
         lengths = new ArrayList<Float>();
     }
@@ -157,6 +191,7 @@ public class InteractExp extends Exp {
         playground = new Playground(AREA_SIZE, AREA_SIZE, WALL_SIZE);
         playground.setGravity(0.0f, 0.0f);
         assert(init_pos.size() == lengths.size());
+        restPos = new ArrayList<Float>(init_pos);
 
             // Arm + control interface
         arm = (Arm) playground.add(new Arm(playground, lengths.size(), lengths, angle_limit, base_x, base_y, init_pos));
@@ -171,17 +206,18 @@ public class InteractExp extends Exp {
             toys.add(toy);
         }
 
-            // Sensors
+            // Sensors, all of the same capacity, so that their histories are aligned
+        int capacity = historyCapacity();
         for(int i = 0; i < arm.bodies.size()-1; i++) { // Sensors for intermediary joints
-        	playground.add(new PosSensor(arm.bodies.get(i), 10000, 1));
-        	playground.add(new AngSensor(arm.bodies.get(i), 10000, 1));
+        	playground.add(new PosSensor(arm.bodies.get(i), capacity, 1));
+        	playground.add(new AngSensor(arm.bodies.get(i), capacity, 1));
         }
-        armPos  = (PosSensor) playground.add(new PosSensor(arm, 10000, 1));
-        armAng  = (AngSensor) playground.add(new AngSensor(arm, 10000, 1));
+        armPos  = (PosSensor) playground.add(new PosSensor(arm, capacity, 1));
+        armAng  = (AngSensor) playground.add(new AngSensor(arm, capacity, 1));
 
         toySensors = new ArrayList<PosSensor>();
         for(BodyEntity toy : toys) {
-            PosSensor toyPos = (PosSensor) playground.add(new PosSensor(toy, 1000, 1));
+            PosSensor toyPos = (PosSensor) playground.add(new PosSensor(toy, capacity, 1));
             toySensors.add(toyPos);
         }
 
@@ -207,8 +243,25 @@ public class InteractExp extends Exp {
 
         this.date  = 0.0f;
         this.steps = 0;
+        this.settleAfter = 0;
+        this.restPos = new ArrayList<Float>(init_pos);
 
-        createPlayground(init_pos, lengths, base_x, base_y, toy_vectors);
+        WorldSnapshot snapshot = null;
+        if (resetMode == RESET_RESTORE && playground != null) {
+            snapshot = snapshots.get(init_pos);
+        }
+
+        if (snapshot != null && snapshot.matches(playground.world, arm, armc)) {
+            snapshot.restore(playground.world, arm, armc);
+            for (LogSensor s : playground.cc.logSensors) {
+                s.history().clear();
+            }
+        } else {
+            createPlayground(init_pos, lengths, base_x, base_y, toy_vectors);
+            if (resetMode == RESET_RESTORE) {
+                snapshots.put(new ArrayList<Float>(init_pos), new WorldSnapshot(playground.world, arm, armc));
+            }
+        }
     }
 
 
@@ -239,7 +292,21 @@ public class InteractExp extends Exp {
             toy_vectors.add(readToyVector(msg));
         }
 
-        OutboundMessage bound_msg = new OutboundMessage(MSG_CONF);
+        sensorWidth = msg.readInt();
+        if (sensorWidth != 4 && sensorWidth != 8) {
+            throw new IOException("sensor width must be 4 or 8, got " + sensorWidth);
+        }
+
+        settleThreshold = (float)msg.readDouble();
+        settleWindow    = msg.readInt();
+
+        resetMode = msg.readInt();
+        snapshots.clear(); // built with the previous configuration
+
+        logMode  = msg.readInt();
+        logParam = Math.max(1, msg.readInt());
+
+        OutboundMessage bound_msg = newMessage(MSG_CONF);
 
         // Reachable limits
         bound_msg.appendDouble((double) WALL_SIZE);
@@ -269,9 +336,34 @@ public class InteractExp extends Exp {
                 order.add(new Float(msg.readDouble()));
             }
             armc.execute(order);
+            settleAfter = steps + travelSteps(order);
+            restPos = null;
         }
     }
 
+    /**
+     * Return the number of steps the joints need to reach the targets of an
+     * order at their maximum velocities: from their angles at the last reset,
+     * or from anywhere within the angle limits if an order moved them since.
+     * @param order  the target angle and maximum velocity of each joint.
+     */
+    protected int travelSteps(ArrayList<Float> order) {
+        float time = 0.0f;
+        for (int j = 0; 2*j + 1 < order.size(); j++) {
+            float target   = Math.max(-angle_limit, Math.min(angle_limit, order.get(2*j).floatValue()));
+            float velocity = order.get(2*j + 1).floatValue();
+            float travel   = angle_limit + Math.abs(target);
+            if (restPos != null && j < restPos.size()) {
+                float start = Math.max(-angle_limit, Math.min(angle_limit, restPos.get(j).floatValue()));
+                travel = Math.abs(target - start);
+            }
+            if (velocity > 0.0f) {
+                time = Math.max(time, travel/velocity);
+            }
+        }
+        return (int) Math.min(Integer.MAX_VALUE, Math.ceil(time*STEP_FREQ));
+    }
+
     private void processReset(InboundMessage msg)
         throws DataFormatException, IOException
     {
@@ -292,7 +384,9 @@ public class InteractExp extends Exp {
 
 
     /**
-     * Run physics engine steps.
+     * Run physics engine steps. Fewer steps are run if the scene comes to
+     * rest; stepsRun holds the number of steps run, and stepTime their
+     * duration.
      * @param msg  message of type STEP_TYPE, containing an int describing
      * 		       the number of steps to run.
      * @throws IOException  if an error reading the message is encountered.
@@ -301,7 +395,9 @@ public class InteractExp extends Exp {
     	throws IOException
     {
     	int n = msg.readInt();
+    	long start = System.nanoTime();
     	this.rc.registerSteps(n);
+    	this.stepTime = (System.nanoTime() - start)/1e9;
     }
 
     /**
@@ -311,7 +407,7 @@ public class InteractExp extends Exp {
      */
     protected OutboundMessage getResult(InboundMessage msg) {
 
-    	OutboundMessage result = new OutboundMessage(RESULT_TYPE);
+    	OutboundMessage result = newMessage(RESULT_TYPE);
 
     	int featSize = 0;
     	int historySize = -1;
@@ -342,6 +438,69 @@ public class InteractExp extends Exp {
     	return result;
     }
 
+    /**
+     * Send the history of the sensors, downsampled and in chunks.
+     * Each chunk message contains the total number of rows, the index of the
+     * first row of the chunk, the number of rows in the chunk, the number of
+     * features per row, the width of the floats, and then the rows as a block
+     * of little-endian floats.
+     * @param msg  The message asking for the result, containing the
+     *             downsampling period and the maximum number of rows per chunk.
+     */
+    protected void sendResult(InboundMessage msg)
+        throws IOException
+    {
+        int every     = Math.max(1, msg.readInt());
+        int chunkRows = Math.max(1, msg.readInt());
+
+        int featSize = 0;
+        int historySize = Integer.MAX_VALUE;
+        int maxHistorySize = 0;
+        for (LogSensor s : playground.cc.logSensors) {
+            featSize += s.lenght();
+            historySize = Math.min(historySize, s.historySize());
+            maxHistorySize = Math.max(maxHistorySize, s.historySize());
+        }
+        if (historySize == Integer.MAX_VALUE) {
+            historySize = 0;
+        }
+        if (historySize != maxHistorySize) {
+            // the rows of the sensors are not aligned: reply an error rather than mixing steps
+            OutboundMessage error = newMessage(ERROR_TYPE);
+            error.appendString("the sensor histories have different lengths (" + historySize + " to " + maxHistorySize + ")");
+            send(error);
+            return;
+        }
+        // a ring keeps up to twice its size between trims; send the last logParam rows
+        int first = 0;
+        if (logMode == LOG_RING && historySize > logParam) {
+            first = historySize - logParam;
+            historySize = logParam;
+        }
+
+        int rows = (historySize + every - 1)/every;
+        int start = 0;
+        do {
+            int n = Math.min(chunkRows, rows - start);
+            OutboundMessage chunk = newMessage(RESULT_TYPE);
+            chunk.appendInt(rows);
+            chunk.appendInt(start);
+            chunk.appendInt(n);
+            chunk.appendInt(featSize);
+            chunk.appendInt(sensorWidth);
+            for (int r = start; r < start + n; r++) {
+                int k = first + r*every;
+                for (LogSensor s : playground.cc.logSensors) {
+                    for (Float f : s.history().get(k)) {
+                        this.appendValue(chunk, f.floatValue());
+                    }
+                }
+            }
+            send(chunk);
+            start += n;
+        } while (start < rows);
+    }
+
     /**
      * Get the readings from the sensors.
      * @param msg  The message asking for the readings.
@@ -349,29 +508,79 @@ public class InteractExp extends Exp {
      */
     protected OutboundMessage getSensors(InboundMessage msg) {
 
-    	OutboundMessage readings = new OutboundMessage(SENSOR_TYPE);
+    	OutboundMessage readings = newMessage(SENSOR_TYPE);
+    	this.appendSensors(readings);
+
+    	return readings;
+    }
+
+    /**
+     * Append the current readings of the sensors to a message.
+     * @param readings  the message to append the readings to.
+     */
+    protected void appendSensors(OutboundMessage readings) {
 
     	int featSize = 0;
-    	// We assume each sensor has the same history length
     	for (LogSensor s : playground.cc.logSensors) {
     		featSize += s.lenght();
     	}
 
     	readings.appendInt(featSize);
+    	readings.appendInt(sensorWidth);
 
     	for (LogSensor s : playground.cc.logSensors) {
     		for (Float f : s.bareRead()) {
-    			readings.appendDouble(f.doubleValue());
+    			this.appendValue(readings, f.floatValue());
     		}
     	}
+    }
 
-    	return readings;
+    /**
+     * Append a value to a block of little-endian floats, of sensorWidth bytes,
+     * so that the client can decode the block in one go.
+     */
+    protected void appendValue(OutboundMessage msg, float f) {
+        if (sensorWidth == 4) {
+            msg.appendInt(Integer.reverseBytes(Float.floatToRawIntBits(f)));
+        } else {
+            msg.appendLong(Long.reverseBytes(Double.doubleToRawLongBits(f)));
+        }
+    }
+
+    /**
+     * Run a batch of trials, one after the other.
+     * Each trial is encoded as a reset, an order and a step message would be,
+     * and the readings of the sensors before and after each trial, the
+     * number of steps run and their duration, are returned in a single message. The steps must be run synchronously by the run
+     * controller, which is the case for StandAlone, but not for ProcSketch.
+     * @param msg  message of type BATCH_TYPE, containing the number of trials
+     *             followed by the trials.
+     * @return  the message with the readings.
+     */
+    protected OutboundMessage processBatch(InboundMessage msg)
+        throws DataFormatException, IOException
+    {
+        OutboundMessage readings = newMessage(BATCH_TYPE);
+
+        int n = msg.readInt();
+        readings.appendInt(n);
+        for (int i = 0; i < n; i++) {
+            this.processReset(msg);
+            this.appendSensors(readings);
+            this.processOrder(msg);
+            this.doSteps(msg);
+            this.appendSensors(readings);
+            readings.appendInt(this.stepsRun);
+            readings.appendDouble(this.stepTime);
+        }
+
+        return readings;
     }
 
     /**
      * Prepare the request for the inverse model.
-     * Note that mouseX, mouseY is not the position we want to request,
-     * since it has to be relative to the rest position of the arm.
+     * The target is the position of the mouse, in the frame of the arm
+     * sensors (effect features 0 and 1 of the 'arm' sensors).
      * @param mouseX  the coordinate of the mouse in x.
      * @param mouseY  the coordinate of the mouse in y.
      */
@@ -385,14 +594,14 @@ public class InteractExp extends Exp {
         	feats.add(new Integer(0));
         	feats.add(new Integer(1));
         	ArrayList<Float> values = new ArrayList<Float>();
-        	values.add(new Float(mouseX-arm.origin.x));
-        	values.add(new Float(mouseY-arm.origin.y));
+        	values.add(new Float(mouseX));
+        	values.add(new Float(mouseY));
         	sendInverseRequest(feats, values);
     	}
     }
 
     public void sendInverseRequest(ArrayList<Integer> feats, ArrayList<Float> values) {
-    	OutboundMessage invreqmsg = new OutboundMessage(MSG_INVERSE);
+    	OutboundMessage invreqmsg = newMessage(MSG_INVERSE);
     	invreqmsg.appendInt(values.size());
     	for (Integer i: feats) {
         	invreqmsg.appendInt(i.intValue());
@@ -401,7 +610,7 @@ public class InteractExp extends Exp {
     	for (Float v: values) {
         	invreqmsg.appendDouble(v.floatValue());
     	}
-    	server.send(invreqmsg);
+    	send(invreqmsg);
     }
 
 	@SuppressWarnings("unchecked")
@@ -422,12 +631,12 @@ public class InteractExp extends Exp {
         		float py = (float)msg.readDouble();
         		((ArrayList<Vec2>) points).add(new Vec2(px+arm.origin.x, py+arm.origin.y));
     		}
-        	OutboundMessage resp = new OutboundMessage(MSG_DISPLAY);
+        	OutboundMessage resp = newMessage(MSG_DISPLAY);
     		resp.appendBoolean(true);
     		return resp;
     	}
     	else {
-        	OutboundMessage resp = new OutboundMessage(MSG_DISPLAY);
+        	OutboundMessage resp = newMessage(MSG_DISPLAY);
     		resp.appendBoolean(false);
     		return resp;
     	}
@@ -441,23 +650,29 @@ public class InteractExp extends Exp {
     protected void processMessage(InboundMessage msg)
          throws DataFormatException, IOException
     {
-        int type = msg.getType();
+        int type = msg.getType() & TYPE_MASK;
         String RED       = "\u001B[31m";
         String CLR_RESET = "\u001B[0m";
 
-        System.out.println("STATUS : received message of type ("+type+") and length ("+msg.getLength()+")");
+        if (logMessages) {
+            System.out.println("STATUS : received message of type ("+type+") and length ("+msg.getLength()+")");
+        }
 
         switch(type) {
             case HELLO_TYPE:
             {
-                server.send(new OutboundMessage(HELLO_TYPE));
-                System.out.println("STATUS : client connected and acknowledged on port "+this.port);
+                send(newMessage(HELLO_TYPE));
+                if (logMessages) {
+                    System.out.println("STATUS : client connected and acknowledged on "+this.address);
+                }
                 break;
             }
             case BYE_TYPE:
             {
-                server.send(new OutboundMessage(BYE_TYPE));
-                System.out.println("STATUS : client disconnected.");
+                send(newMessage(BYE_TYPE));
+                if (logMessages) {
+                    System.out.println("STATUS : client disconnected.");
+                }
                 break;
             }
             case ERROR_TYPE:
@@ -469,42 +684,50 @@ public class InteractExp extends Exp {
             case MSG_CONF:
             {
             	OutboundMessage bound_msg = this.processConf(msg);
-                server.send(bound_msg);
+                send(bound_msg);
                 break;
             }
             case RESET_TYPE:
             {
                 this.processReset(msg);
-                server.send(this.getSensors(msg));
+                send(this.getSensors(msg));
                 break;
             }
             case MSG_EXIT:
             {
-                server.send(new OutboundMessage(MSG_EXIT));
+                send(newMessage(MSG_EXIT));
                 System.exit(0);
             }
             case ORDER_TYPE:
             {
                 this.processOrder(msg);
-                server.send(new OutboundMessage(ORDER_TYPE));
+                send(newMessage(ORDER_TYPE));
                 break;
             }
             case STEP_TYPE:
             {
                 this.doSteps(msg);
-                server.send(new OutboundMessage(STEP_TYPE));
+                OutboundMessage stepped = newMessage(STEP_TYPE);
+                stepped.appendInt(this.stepsRun);
+                stepped.appendDouble(this.stepTime);
+                send(stepped);
             	break;
             }
             case RESULT_TYPE:
             {
-            	OutboundMessage result = this.getResult(msg);
-                server.send(result);
+                // the length counts the header; an empty request asks for the legacy format
+                if (msg.getLength() > MessageServer.HEADER_SIZE) {
+                    this.sendResult(msg);
+                } else {
+                    OutboundMessage result = this.getResult(msg);
+                    send(result);
+                }
             	break;
             }
             case SENSOR_TYPE:
             {
             	OutboundMessage sensors = this.getSensors(msg);
-                server.send(sensors);
+                send(sensors);
             	break;
             }
             case MSG_INVERSE:
@@ -515,9 +738,15 @@ public class InteractExp extends Exp {
             case MSG_DISPLAY:
             {
             	OutboundMessage display = this.handleDiplayRequest(msg);
-                server.send(display);
+                send(display);
             	break;
             }
+            case BATCH_TYPE:
+            {
+                OutboundMessage readings = this.processBatch(msg);
+                send(readings);
+                break;
+            }
             default:
             {
                 System.out.println(RED + "ERROR : Unrecognized message type ("+type+")." + CLR_RESET);
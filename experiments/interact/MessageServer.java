@@ -0,0 +1,199 @@
+package experiments.interact;
+
+import java.io.EOFException;
+import java.io.IOException;
+import java.net.InetSocketAddress;
+import java.net.ProtocolFamily;
+import java.net.SocketAddress;
+import java.net.StandardProtocolFamily;
+import java.net.StandardSocketOptions;
+import java.nio.ByteBuffer;
+import java.nio.channels.ServerSocketChannel;
+import java.nio.channels.SocketChannel;
+import java.util.concurrent.BlockingQueue;
+import java.util.concurrent.LinkedBlockingQueue;
+
+import sockit.InboundMessage;
+import sockit.OutboundMessage;
+
+/**
+ * A server speaking the sockit protocol, with the interface of sockit.Server,
+ * that can also wait for messages instead of being polled: take() blocks
+ * until a message arrives. A thread accepts one client at a time, and reads
+ * its messages into a queue; the replies are sent to the current client.
+ *
+ * The server listens on a TCP port, or, given an address "unix:PATH", on a
+ * unix domain socket, that needs java 16 or later. The TCP port can be 0,
+ * for the system to choose a free one; getAddress() returns the address
+ * actually listened on.
+ */
+public class MessageServer {
+
+    /** Length and type of a message, two big-endian ints */
+    public static final int HEADER_SIZE = 8;
+
+    public static final String UNIX_PREFIX = "unix:";
+
+    protected ServerSocketChannel serverChannel;
+    protected SocketChannel channel;
+    protected String address;
+    protected BlockingQueue<InboundMessage> queue = new LinkedBlockingQueue<InboundMessage>();
+
+    /** Return a server listening on address, or exit if it can't */
+    public static MessageServer listen(String address) {
+        MessageServer server = new MessageServer();
+        if (!server.start(address)) {
+            System.err.println("ERROR : can't listen on " + address);
+            System.exit(1);
+        }
+        return server;
+    }
+
+    public boolean start(int port) {
+        return start(Integer.toString(port));
+    }
+
+    public boolean start(String address) {
+        try {
+            if (address.startsWith(UNIX_PREFIX)) {
+                serverChannel = openUnix(address.substring(UNIX_PREFIX.length()));
+                this.address = address;
+            } else {
+                serverChannel = ServerSocketChannel.open();
+                serverChannel.bind(new InetSocketAddress(Integer.parseInt(address)));
+                this.address = Integer.toString(serverChannel.socket().getLocalPort());
+            }
+        } catch (IOException e) {
+            e.printStackTrace();
+            return false;
+        }
+
+        Thread reader = new Thread() {
+            public void run() {
+                acceptClients();
+            }
+        };
+        reader.setDaemon(true);
+        reader.start();
+        return true;
+    }
+
+    /**
+     * Open a server channel on a unix domain socket. The java 16 classes are
+     * looked up at runtime, so that the code still builds with older versions.
+     */
+    protected static ServerSocketChannel openUnix(String path) throws IOException {
+        try {
+            ProtocolFamily unix = StandardProtocolFamily.valueOf("UNIX");
+            ServerSocketChannel server = (ServerSocketChannel) ServerSocketChannel.class
+                .getMethod("open", ProtocolFamily.class).invoke(null, unix);
+            SocketAddress socketAddress = (SocketAddress) Class.forName("java.net.UnixDomainSocketAddress")
+                .getMethod("of", String.class).invoke(null, path);
+            server.bind(socketAddress);
+            return server;
+        } catch (IllegalArgumentException e) {
+            throw new IOException("unix domain sockets need java 16 or later", e);
+        } catch (ReflectiveOperationException e) {
+            throw new IOException("unix domain sockets need java 16 or later", e);
+        }
+    }
+
+    /** The address listened on: a port number, or "unix:PATH" */
+    public String getAddress() {
+        return address;
+    }
+
+    public void stop() {
+        try {
+            serverChannel.close();
+            synchronized (this) {
+                if (channel != null) {
+                    channel.close();
+                }
+            }
+        } catch (IOException e) {}
+    }
+
+    protected void acceptClients() {
+        while (serverChannel.isOpen()) {
+            SocketChannel client = null;
+            try {
+                client = serverChannel.accept();
+                if (!address.startsWith(UNIX_PREFIX)) {
+                    client.setOption(StandardSocketOptions.TCP_NODELAY, true);
+                }
+                synchronized (this) {
+                    channel = client;
+                }
+                readMessages(client);
+            } catch (IOException e) {
+                // the connection was closed
+            } finally {
+                synchronized (this) {
+                    channel = null;
+                }
+                try { if (client != null) client.close(); } catch (IOException e) {}
+            }
+        }
+    }
+
+    /** Read the messages of a client into the queue, until it disconnects */
+    protected void readMessages(SocketChannel client) throws IOException {
+        ByteBuffer header = ByteBuffer.allocate(HEADER_SIZE);
+        while (true) {
+            header.clear();
+            readFully(client, header);
+            int length = header.getInt(0);
+            int type   = header.getInt(4);
+            ByteBuffer content = ByteBuffer.allocate(length - HEADER_SIZE);
+            readFully(client, content);
+            queue.add(new InboundMessage(type, content.array()));
+        }
+    }
+
+    protected static void readFully(SocketChannel client, ByteBuffer buffer) throws IOException {
+        while (buffer.hasRemaining()) {
+            if (client.read(buffer) < 0) {
+                throw new EOFException();
+            }
+        }
+    }
+
+    /**
+     * Send a message to the current client; it can be called from any thread.
+     * The channel is written directly, so that sends never wait for the
+     * reading thread.
+     */
+    public synchronized boolean send(OutboundMessage msg) {
+        if (channel == null) {
+            return false;
+        }
+        try {
+            ByteBuffer bytes = ByteBuffer.wrap(msg.getBytes());
+            while (bytes.hasRemaining()) {
+                channel.write(bytes);
+            }
+            return true;
+        } catch (IOException e) {
+            return false;
+        }
+    }
+
+    /** Wait for the next message, and return it */
+    public InboundMessage take() {
+        while (true) {
+            try {
+                return queue.take();
+            } catch (InterruptedException e) {}
+        }
+    }
+
+    /** Return the next message, or null if there is none */
+    public InboundMessage receive() {
+        return queue.poll();
+    }
+
+    public int getNumberOfMessages() {
+        return queue.size();
+    }
+}
@@ -25,18 +25,20 @@ public class ProcSketch extends PApplet implements RunController {
     public void setup() {
 
     	// Treating cli args
-    	int port = 1989;
+    	String address = "1989";
         if (args.length >= 1) {
-        	try {
-        		port = Integer.parseInt(args[0]);
-        	} catch (NumberFormatException e) {
-        	    System.err.println("Usage: exp.java PORT (must be an integer)");
-        	    System.exit(1);
+        	address = args[0];
+        	if (!address.startsWith(MessageServer.UNIX_PREFIX)) {
+        		try {
+        			Integer.parseInt(address);
+        		} catch (NumberFormatException e) {
+        			System.err.println("Usage: ProcSketch PORT|unix:PATH (PORT must be an integer)");
+        			System.exit(1);
+        		}
         	}
-
         };
 
-    	exp = new InteractExp(port, this);
+    	exp = new InteractExp(address, this);
 
         size((int) exp.playground.w, (int) exp.playground.h);
         smooth();
@@ -47,6 +49,9 @@ public class ProcSketch extends PApplet implements RunController {
 
         remaining_steps = 0;
 
+        // Signal the python client that the server accepts connections.
+        System.out.println("READY " + exp.address);
+        System.out.flush();
     }
 
     public void draw() {
@@ -55,7 +60,7 @@ public class ProcSketch extends PApplet implements RunController {
             exp.updateMessages();
         } else {
             float timestep = 1.0f/(exp.STEP_ITER*exp.STEP_FREQ);
-            exp.playground.cc.logSensors(exp.steps);
+            exp.logSensors();
             exp.playground.cc.update();
             exp.date += timestep;
             exp.steps += 1;
@@ -88,7 +93,9 @@ public class ProcSketch extends PApplet implements RunController {
     }
 
     public void registerSteps(int n) {
+        // steps are run in real time, and never stopped early.
         remaining_steps += n;
+        exp.stepsRun = n;
     }
 
     public void reset() {
@@ -2,6 +2,10 @@ package experiments.interact;
 
 /** Run the experiment without any display feedback.
  *  Perfect for clusters.
+ *  Usage: StandAlone ADDRESS [THREADS]; ADDRESS is a port, 0 for any free
+ *  port, or unix:PATH for a unix domain socket. The address listened on is
+ *  printed on the READY line. With THREADS, the server hosts several worlds,
+ *  run on a pool of THREADS threads (see Worlds).
  */
 
 public class StandAlone implements RunController {
@@ -10,30 +14,47 @@ public class StandAlone implements RunController {
 
     public static void main (String[] args){
 
-    	int port = Integer.parseInt(args[0]);;
-   	    if (args.length >= 1) {
+    	String address = args[0];
+   	    if (!address.startsWith(MessageServer.UNIX_PREFIX)) {
    	    	try {
-        		port = Integer.parseInt(args[0]);
+        		Integer.parseInt(address);
         	} catch (NumberFormatException e) {
-        	    System.err.println("Usage: exp.java PORT (must be an integer)");
+        	    System.err.println("Usage: StandAlone PORT|unix:PATH [THREADS] (PORT must be an integer)");
         	    System.exit(1);
         	}
    	    }
 
-   	    StandAlone sa = new StandAlone();
-   	    sa.exp = new InteractExp(port, sa);
+   	    if (args.length >= 2) {
+   	        Worlds worlds = new Worlds(address, Integer.parseInt(args[1]));
+
+   	        System.out.println("READY " + worlds.getAddress());
+   	        System.out.flush();
 
-   	    while(true) {
-   	    	sa.exp.update();
+   	        worlds.serve();
    	    }
+
+   	    StandAlone sa = new StandAlone();
+   	    sa.exp = new InteractExp(address, sa);
+
+   	    // Signal the python client that the server accepts connections.
+   	    System.out.println("READY " + sa.exp.address);
+   	    System.out.flush();
+
+   	    sa.exp.serve();
     }
 
     public void registerSteps(int n) {
 
     	float timestep = 1.0f/(exp.STEP_ITER*exp.STEP_FREQ);
 
+    	// the steps stop once the scene stays still for settleWindow steps,
+    	// and the joints had the time to reach their targets.
+    	float[] previous = null;
+    	int still = 0;
+
+    	exp.stepsRun = 0;
     	for (int i = 0; i < n; i++) {
-    		exp.playground.cc.logSensors(exp.steps);
+    		exp.logSensors();
     		exp.playground.cc.update();
 
     		exp.date += timestep;
@@ -41,6 +62,16 @@ public class StandAlone implements RunController {
 
             for (int k = 0; k < exp.STEP_ITER; k++) {
             	exp.playground.step(timestep, exp.ITER_VEL, exp.ITER_POS);
+            }
+            exp.stepsRun += 1;
+
+            if (exp.settleThreshold > 0.0f) {
+                float[] current = exp.readSensors();
+                still = (previous != null && exp.isStill(previous, current)) ? still + 1 : 0;
+                previous = current;
+                if (still >= exp.settleWindow && exp.steps >= exp.settleAfter) {
+                    break;
+                }
             }
 		}
     }
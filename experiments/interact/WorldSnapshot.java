@@ -0,0 +1,189 @@
+package experiments.interact;
+
+import java.lang.reflect.Field;
+import java.lang.reflect.Modifier;
+import java.util.ArrayList;
+import java.util.List;
+
+import org.jbox2d.common.Vec2;
+import org.jbox2d.common.Vec3;
+import org.jbox2d.dynamics.Body;
+import org.jbox2d.dynamics.World;
+import org.jbox2d.dynamics.contacts.Contact;
+import org.jbox2d.dynamics.joints.Joint;
+
+/**
+ * The state of a freshly built world: positions, angles and velocities of
+ * its bodies, the solver state of its joints, and the state of objects
+ * stepped with it, like the arm controller. A snapshot can be restored in
+ * any world built the same way, bodies and joints being matched by their
+ * order in the lists of the world.
+ *
+ * Restoring also drops the contacts, and with them the warm-start impulses
+ * of the solver, so that a restored world steps as a freshly built one.
+ */
+public class WorldSnapshot {
+
+    private ArrayList<Vec2>  positions         = new ArrayList<Vec2>();
+    private ArrayList<Float> angles            = new ArrayList<Float>();
+    private ArrayList<Vec2>  linearVelocities  = new ArrayList<Vec2>();
+    private ArrayList<Float> angularVelocities = new ArrayList<Float>();
+    private ArrayList<FieldState> joints       = new ArrayList<FieldState>();
+    private ArrayList<FieldState> objects      = new ArrayList<FieldState>();
+
+    /** Save the state of a world, and of the objects stepped with it */
+    public WorldSnapshot(World world, Object... stepped) {
+        for (Body b = world.getBodyList(); b != null; b = b.getNext()) {
+            positions.add(b.getPosition().clone());
+            angles.add(new Float(b.getAngle()));
+            linearVelocities.add(b.getLinearVelocity().clone());
+            angularVelocities.add(new Float(b.getAngularVelocity()));
+        }
+        for (Joint j = world.getJointList(); j != null; j = j.getNext()) {
+            joints.add(new FieldState(j));
+        }
+        for (Object o : stepped) {
+            objects.add(new FieldState(o));
+        }
+    }
+
+    /** Return true if the snapshot can be restored in the world */
+    public boolean matches(World world, Object... stepped) {
+        int n = 0;
+        for (Body b = world.getBodyList(); b != null; b = b.getNext()) {
+            n++;
+        }
+        int i = 0;
+        for (Joint j = world.getJointList(); j != null; j = j.getNext()) {
+            if (i >= joints.size() || !joints.get(i).matches(j)) {
+                return false;
+            }
+            i++;
+        }
+        if (n != positions.size() || i != joints.size() || stepped.length != objects.size()) {
+            return false;
+        }
+        for (int k = 0; k < stepped.length; k++) {
+            if (!objects.get(k).matches(stepped[k])) {
+                return false;
+            }
+        }
+        return true;
+    }
+
+    /** Set the world, and the objects stepped with it, in the saved state */
+    public void restore(World world, Object... stepped) {
+        while (world.getContactList() != null) {
+            world.getContactManager().destroy(world.getContactList());
+        }
+        world.clearForces();
+
+        int i = 0;
+        for (Body b = world.getBodyList(); b != null; b = b.getNext()) {
+            b.setTransform(positions.get(i), angles.get(i).floatValue());
+            b.setLinearVelocity(linearVelocities.get(i));
+            b.setAngularVelocity(angularVelocities.get(i).floatValue());
+            b.setAwake(true);
+            i++;
+        }
+        i = 0;
+        for (Joint j = world.getJointList(); j != null; j = j.getNext()) {
+            joints.get(i++).restore(j);
+        }
+        for (int k = 0; k < stepped.length; k++) {
+            objects.get(k).restore(stepped[k]);
+        }
+    }
+
+    /**
+     * The values of the fields of an object that hold its state: primitives,
+     * vectors, arrays of numbers and lists of numbers, of its class and
+     * superclasses. The fields are found by reflection, because the solver
+     * state of joints and controllers is not exposed by their classes.
+     */
+    static class FieldState {
+
+        private Class<?> type;
+        private ArrayList<Field>  fields = new ArrayList<Field>();
+        private ArrayList<Object> values = new ArrayList<Object>();
+
+        FieldState(Object o) {
+            type = o.getClass();
+            for (Class<?> c = type; c != null && c != Object.class; c = c.getSuperclass()) {
+                for (Field f : c.getDeclaredFields()) {
+                    if (Modifier.isStatic(f.getModifiers())) {
+                        continue;
+                    }
+                    try {
+                        f.setAccessible(true);
+                        Object value = copy(f.get(o), f.getType().isPrimitive());
+                        if (value != null) {
+                            fields.add(f);
+                            values.add(value);
+                        }
+                    } catch (Exception e) {
+                        // not part of the state that can be saved
+                    }
+                }
+            }
+        }
+
+        boolean matches(Object o) {
+            return o.getClass() == type;
+        }
+
+        /** Return a copy of a value that is part of the state, or null */
+        private static Object copy(Object value, boolean primitive) {
+            if (primitive) {
+                return value;
+            } else if (value instanceof Vec2) {
+                return ((Vec2) value).clone();
+            } else if (value instanceof Vec3) {
+                return ((Vec3) value).clone();
+            } else if (value instanceof float[]) {
+                return ((float[]) value).clone();
+            } else if (value instanceof double[]) {
+                return ((double[]) value).clone();
+            } else if (value instanceof List && isNumbers((List<?>) value)) {
+                return new ArrayList<Object>((List<?>) value);
+            }
+            return null;
+        }
+
+        private static boolean isNumbers(List<?> list) {
+            for (Object x : list) {
+                if (!(x instanceof Number)) {
+                    return false;
+                }
+            }
+            return true;
+        }
+
+        @SuppressWarnings("unchecked")
+        void restore(Object o) {
+            for (int i = 0; i < fields.size(); i++) {
+                Field f = fields.get(i);
+                Object saved = values.get(i);
+                try {
+                    Object current = f.get(o);
+                    if (saved instanceof Vec2) {
+                        ((Vec2) current).set((Vec2) saved);
+                    } else if (saved instanceof Vec3) {
+                        ((Vec3) current).set((Vec3) saved);
+                    } else if (saved instanceof float[]) {
+                        System.arraycopy(saved, 0, current, 0, ((float[]) saved).length);
+                    } else if (saved instanceof double[]) {
+                        System.arraycopy(saved, 0, current, 0, ((double[]) saved).length);
+                    } else if (saved instanceof List) {
+                        ((List<Object>) current).clear();
+                        ((List<Object>) current).addAll((List<?>) saved);
+                    } else if (!Modifier.isFinal(f.getModifiers())) {
+                        f.set(o, saved);
+                    }
+                } catch (Exception e) {
+                    // the field kept its value
+                }
+            }
+        }
+    }
+}
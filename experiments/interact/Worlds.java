@@ -0,0 +1,86 @@
+package experiments.interact;
+
+import java.util.HashMap;
+import java.util.Map;
+import java.util.concurrent.ConcurrentLinkedQueue;
+import java.util.concurrent.ExecutorService;
+import java.util.concurrent.Executors;
+import java.util.concurrent.atomic.AtomicBoolean;
+
+import sockit.InboundMessage;
+
+/**
+ * Host several independent worlds in one server process, sharing its
+ * connection, heap and JIT. Each world is an InteractExp with its own
+ * playground, addressed by the world id carried in the high bits of the
+ * message types (see Exp.WORLD_SHIFT). A world is created by its first
+ * message, and dropped after its BYE message. The messages of a world are
+ * processed in order, and different worlds run in parallel on a thread pool.
+ */
+public class Worlds {
+
+    private static final int BYE_TYPE = 1;
+
+    protected MessageServer server;
+    protected ExecutorService pool;
+    protected Map<Integer, World> worlds = new HashMap<Integer, World>();
+
+    /** A world, and the messages it has yet to process */
+    protected class World implements Runnable {
+
+        StandAlone sa = new StandAlone();
+        ConcurrentLinkedQueue<InboundMessage> inbox = new ConcurrentLinkedQueue<InboundMessage>();
+        AtomicBoolean scheduled = new AtomicBoolean(false);
+
+        World(int worldId) {
+            sa.exp = new InteractExp(server, worldId, sa);
+        }
+
+        void submit(InboundMessage msg) {
+            inbox.add(msg);
+            if (scheduled.compareAndSet(false, true)) {
+                pool.execute(this);
+            }
+        }
+
+        /** Process the pending messages; a world runs on one thread at a time */
+        public void run() {
+            InboundMessage msg;
+            while ((msg = inbox.poll()) != null) {
+                sa.exp.handleMessage(msg);
+            }
+            scheduled.set(false);
+            // a message may have arrived after the last poll
+            if (!inbox.isEmpty() && scheduled.compareAndSet(false, true)) {
+                pool.execute(this);
+            }
+        }
+    }
+
+    public Worlds(String address, int threads) {
+        this.pool = Executors.newFixedThreadPool(threads);
+
+        server = MessageServer.listen(address);
+    }
+
+    public String getAddress() {
+        return server.getAddress();
+    }
+
+    /** Dispatch the messages to their worlds, as they arrive */
+    public void serve() {
+        while (true) {
+            InboundMessage msg = server.take();
+            int worldId = msg.getType() >> Exp.WORLD_SHIFT;
+            World world = worlds.get(worldId);
+            if (world == null) {
+                world = new World(worldId);
+                worlds.put(worldId, world);
+            }
+            world.submit(msg);
+            if ((msg.getType() & Exp.TYPE_MASK) == BYE_TYPE) {
+                worlds.remove(worldId);
+            }
+        }
+    }
+}